@@ -6,8 +6,10 @@ This file initializes Celery and loads all configuration from Django settings.
 All Celery settings (broker, time limits, workers, etc.) are configured in settings.py
 with the CELERY_ prefix. This ensures a single source of truth for configuration.
 """
+import logging
 import os
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 from celery.schedules import crontab
 
 # Set default Django settings module
@@ -23,6 +25,24 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Auto-discover tasks in all installed apps
 app.autodiscover_tasks()
 
+
+# Selenium workers: start the browser pool's warm browsers in each worker process
+# (BROWSER_POOL_WARM) and quit whatever is idle when the process goes away.
+@worker_process_init.connect
+def warm_browser_pool(**kwargs):
+    from supermarkets.scripts import browser_pool
+    if browser_pool.WARM:
+        try:
+            browser_pool.warm()
+        except Exception:
+            logging.getLogger(__name__).exception("Could not warm the browser pool")
+
+
+@worker_process_shutdown.connect
+def close_browser_pool(**kwargs):
+    from supermarkets.scripts import browser_pool
+    browser_pool.close_all()
+
 # Configure Celery Beat schedule for automated tasks
 #
 # Daily timeline:
@@ -11,9 +11,9 @@ from django.utils import timezone
 from django.db import transaction
 from .models import Storage, RestockLog, ScheduleException
 from .services import RestockService
-import shutil
 from .scripts.decision_maker import DecisionMaker
 from .scripts.helpers import Helper
+from .scripts import feature_store
 from .scripts.inventory_scrapper import Inventory_Scrapper
 from .scripts.inventory_reader import verify_lost_stock_from_excel_combined
 from .scripts.orderer import Orderer
@@ -93,8 +93,7 @@ class AutomatedRestockService(RestockService):
                 return True
 
             finally:
-                inv_scrapper.driver.quit()
-                shutil.rmtree(inv_scrapper.user_data_dir, ignore_errors=True)
+                inv_scrapper.close()
 
         except Exception as e:
             log.status = 'failed'
@@ -138,9 +137,10 @@ class AutomatedRestockService(RestockService):
         min_floor = self.storage.minimum_stock
 
         cur = self.db.cursor()
-        cur.execute("""
+        cur.execute(f"""
             SELECT ps.cod, ps.v, p.descrizione, ps.stock, ps.minimum_stock AS min_override,
-                   ps.sales_sets, ps.bought_sets, ps.sold_last_24,
+                   {self.db.sales_sets_sql("ps")} AS sales_sets,
+                   {self.db.bought_sets_sql("ps")} AS bought_sets, ps.sold_last_24,
                    p.pz_x_collo, p.rapp, p.shelf_life_days,
                    e.sale_start, e.sale_end
             FROM product_stats ps
@@ -168,7 +168,13 @@ class AutomatedRestockService(RestockService):
         from datetime import date as _date
         today = _date.today()
 
-        for row in rows:
+        # Same cached features as the order run: whichever of the two runs first
+        # today computes them, the other reads them back.
+        features = feature_store.demand_features(self.db, [
+            (row['cod'], row['v'], Helper.sales_history(row['sales_sets']), True) for row in rows
+        ], closure_mask)
+
+        for row, (avg_from_sets, deviation, sigma_daily) in zip(rows, features):
             key = f"{row['cod']}.{row['v']}"
             cod, v = row['cod'], row['v']
             stock = raw_stock[key] if raw_stock is not None and key in raw_stock else (row['stock'] or 0)
@@ -189,15 +195,12 @@ class AutomatedRestockService(RestockService):
             # Same fallback chain as decision_maker. Assuming zero instead would
             # collapse eff_min to 0, making `stock < eff_min` unreachable — a new
             # product that genuinely sells could never be reported understocked.
-            avg_daily_sales = self.helper.avg_daily_sales_from_sales_sets(sales_sets, silent=True)
+            avg_daily_sales = avg_from_sets
             if avg_daily_sales is None:
                 avg_daily_sales, _ = self.helper.calculate_weighted_avg_sales_new(sold_last_24, silent=True)
 
             req_stock = round(avg_daily_sales * coverage_days)
 
-            deviation = self.helper.calculate_deviation(sales_sets, silent=True)
-
-            sigma_daily = Helper.demand_sigma_daily(sales_sets, closure_mask)
             sigma_L = sigma_daily * (max(coverage_days, 1) ** 0.5) if sigma_daily is not None else None
 
             # Mirrors processor_N: an override replaces the presence target, not
@@ -402,10 +405,16 @@ class AutomatedRestockService(RestockService):
         )
         return fraction
 
-    def run_full_restock_workflow(self, coverage=None, log=None, progress_callback=None, skip_stats_update=False):
+    def run_full_restock_workflow(self, coverage=None, log=None, progress_callback=None, skip_stats_update=False,
+                                  shared_inputs=None, place_order=True):
         """
         Run complete restock workflow: calculate order then execute it.
         Both steps always run fresh — no checkpoint skipping.
+
+        shared_inputs: DecisionMaker.export_shared_inputs() for this supermarket, when
+                       the supermarket-level planner already loaded them.
+        place_order:   False stops after the order is calculated and stored in the log
+                       (status stays 'processing'); place_planned_order finishes it.
         """
         logger.info(f"Starting restock workflow for {self.storage.name}")
 
@@ -458,9 +467,12 @@ class AutomatedRestockService(RestockService):
                     self.helper,
                     blacklist_set=self.get_blacklist_set(),
                     skip_sale=skip_sale,
-                    product_links=ProductLink.build_pairs(self.supermarket),
+                    product_links=ProductLink.build_pairs(self.supermarket) if shared_inputs is None else None,
+                    shared_inputs=shared_inputs,
+                )
+                decision_maker.decide_orders_for_settore(
+                    self.settore, coverage, self.storage.minimum_stock, batch=True
                 )
-                decision_maker.decide_orders_for_settore(self.settore, coverage, self.storage.minimum_stock)
                 orders_list = decision_maker.orders_list
                 zombie_products = decision_maker.zombie_products
 
@@ -481,6 +493,7 @@ class AutomatedRestockService(RestockService):
                     'settore': self.settore,
                     'coverage': float(coverage)
                 })
+                log.order_calculated_at = timezone.now()
                 log.save()
             finally:
                 decision_maker.close()
@@ -490,46 +503,39 @@ class AutomatedRestockService(RestockService):
                 progress_callback(50, f'Order calculated: {len(orders_list)} products')
             logger.info(f"Order calculated: {len(orders_list)} products, {len(zombie_products)} zombie")
 
-            # Step 2: Execute order
-            if not orders_list:
-                logger.info(f"No items to order for {self.storage.name}")
-                log.status = 'completed'
-                log.current_stage = 'completed'
-                log.completed_at = timezone.now()
-                log.save()
+            if not place_order and orders_list:
                 return log
 
-            if progress_callback:
-                progress_callback(70, f'Placing order for {len(orders_list)} products...')
-
-            orderer = Orderer(
-                username=self.supermarket.username,
-                password=self.supermarket.password
-            )
-            try:
-                orderer.login()
-                successful_orders, order_skipped = orderer.make_orders(self.storage.name, orders_list)
-
-                results = log.get_results()
-                results.setdefault('order_skipped_products', []).extend(order_skipped)
-                log.set_results(results)
+            # Step 2: Execute order
+            return self._place_order(log, orders_list, progress_callback)
 
-                log.products_ordered = len(successful_orders)
-                log.total_packages = sum(order[2] for order in successful_orders)
-                log.status = 'completed'
-                log.current_stage = 'completed'
-                log.completed_at = timezone.now()
-                log.save()
-            finally:
-                orderer.driver.quit()
+        except Exception as e:
+            logger.exception(f"Restock workflow failed for {self.storage.name}")
+            log.status = 'failed'
+            log.current_stage = 'failed'
+            log.error_message = str(e)
+            log.save()
+            raise
+        finally:
+            exit_order_log(_order_log_ctx)
+            exit_supermarket_log(_sm_log_ctx)
 
-            if progress_callback:
-                progress_callback(100, 'Order placed successfully!')
-            logger.info(f"Restock workflow completed successfully for {self.storage.name}")
-            return log
+    def place_planned_order(self, log, progress_callback=None):
+        """
+        Second half of run_full_restock_workflow(place_order=False): send the order
+        stored in the log to the supplier.
+        """
+        orders_list = [
+            (o['cod'], o['var'], o['qty'], o.get('discount'))
+            for o in log.get_results().get('orders', [])
+        ]
 
+        _sm_log_ctx = enter_supermarket_log(self.supermarket.name)
+        _order_log_ctx = enter_order_log(self.supermarket.name, self.storage.name)
+        try:
+            return self._place_order(log, orders_list, progress_callback)
         except Exception as e:
-            logger.exception(f"Restock workflow failed for {self.storage.name}")
+            logger.exception(f"Placing planned order failed for {self.storage.name}")
             log.status = 'failed'
             log.current_stage = 'failed'
             log.error_message = str(e)
@@ -537,4 +543,43 @@ class AutomatedRestockService(RestockService):
             raise
         finally:
             exit_order_log(_order_log_ctx)
-            exit_supermarket_log(_sm_log_ctx)
\ No newline at end of file
+            exit_supermarket_log(_sm_log_ctx)
+
+    def _place_order(self, log, orders_list, progress_callback=None):
+        """Execute a calculated order with the Selenium Orderer and close the log."""
+        if not orders_list:
+            logger.info(f"No items to order for {self.storage.name}")
+            log.status = 'completed'
+            log.current_stage = 'completed'
+            log.completed_at = timezone.now()
+            log.save()
+            return log
+
+        if progress_callback:
+            progress_callback(70, f'Placing order for {len(orders_list)} products...')
+
+        orderer = Orderer(
+            username=self.supermarket.username,
+            password=self.supermarket.password
+        )
+        try:
+            orderer.login()
+            successful_orders, order_skipped = orderer.make_orders(self.storage.name, orders_list)
+
+            results = log.get_results()
+            results.setdefault('order_skipped_products', []).extend(order_skipped)
+            log.set_results(results)
+
+            log.products_ordered = len(successful_orders)
+            log.total_packages = sum(order[2] for order in successful_orders)
+            log.status = 'completed'
+            log.current_stage = 'completed'
+            log.completed_at = timezone.now()
+            log.save()
+        finally:
+            orderer.close()
+
+        if progress_callback:
+            progress_callback(100, 'Order placed successfully!')
+        logger.info(f"Restock workflow completed successfully for {self.storage.name}")
+        return log
@@ -5,12 +5,13 @@ Downloads latest product list from Dropzone and imports to database.
 Also detects cost changes that affect recipe margins.
 """
 import logging
+import os
 from decimal import Decimal
 from pathlib import Path
 from django.conf import settings
 from django.utils import timezone
 from .models import Storage, RecipeProductItem, RecipeCostAlert
-from .scripts.web_lister import download_product_list
+from .scripts.web_lister import download_product_list, stream_product_list
 from .scripts.DatabaseManager import DatabaseManager
 
 logger = logging.getLogger(__name__)
@@ -18,6 +19,9 @@ logger = logging.getLogger(__name__)
 
 class ListUpdateService:
     """Handles automated product list updates"""
+
+    # Keep a CSV copy of each streamed list in temp_lists/ for auditing
+    AUDIT_CSV = os.environ.get('LISTINO_AUDIT_CSV', '').lower() in ('1', 'true', 'yes')
     
     def __init__(self, storage: Storage):
         self.storage = storage
@@ -64,6 +68,28 @@ class ListUpdateService:
         logger.info(f"Downloaded: {file_path}")
         return file_path
     
+    def stream_list(self):
+        """
+        Log in to Dropzone and return an iterator of catalogue records that
+        downloads the product list as it is consumed.
+        """
+        logger.info(f"Streaming product list for {self.storage.name}")
+
+        return stream_product_list(
+            username=self.supermarket.username,
+            password=self.supermarket.password,
+            storage_name=self.storage.name,
+            download_dir=str(self.download_dir),
+            id_cod_mag=self.storage.id_cod_mag,
+            id_cliente=self.supermarket.id_cliente,
+            id_azienda=self.supermarket.id_azienda,
+            id_marchio=self.supermarket.id_marchio,
+            id_clienti_canale=self.supermarket.id_clienti_canale,
+            id_clienti_area=self.supermarket.id_clienti_area,
+            headless=True,
+            audit_csv=self.AUDIT_CSV
+        )
+
     def import_list(self, file_path: str):
         """
         Import product list to database.
@@ -208,9 +234,13 @@ class ListUpdateService:
             # Step 1: Get costs BEFORE import
             old_costs = self._get_recipe_product_costs()
 
-            # Step 2: Download and import
-            file_path = self.download_list()
-            self.import_list(file_path)
+            # Step 2: Download (spooled page by page), then import in one transaction
+            records = self.stream_list()
+            imported, absent_count = self.db.import_catalogue(records, self.settore)
+            logger.info(
+                f"Imported {imported} products for {self.storage.name}, "
+                f"{absent_count} marked unavailable"
+            )
 
             # Step 3: Get costs AFTER import
             new_costs = self._get_recipe_product_costs()
@@ -220,8 +250,6 @@ class ListUpdateService:
             if old_costs:
                 alerts_created = self._create_cost_alerts(old_costs, new_costs)
 
-            # Clean up
-            Path(file_path).unlink()
             self.storage.last_list_update = timezone.now()
             self.storage.save()
 
@@ -232,7 +260,8 @@ class ListUpdateService:
                 'message': f'Product list updated successfully for {self.storage.name}',
                 'storage_id': self.storage.id,
                 'storage_name': self.storage.name,
-                'file_path': file_path,
+                'imported': imported,
+                'marked_unavailable': absent_count,
                 'recipe_alerts_created': alerts_created
             }
 
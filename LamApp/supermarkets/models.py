@@ -899,7 +899,7 @@ class SalesSyncLog(models.Model):
     sync_date = models.DateField(help_text="The date the sold quantities refer to")
     created_at = models.DateTimeField(auto_now_add=True)
 
-    # Counts from apply_realtime_sales, as of the most recent run that day
+    # Counts from apply_realtime_sales, as of the most recent full (not delta) run that day
     received = models.IntegerField(default=0, help_text="Total products received from PowerShell")
     applied = models.IntegerField(default=0, help_text="Products actually updated in DB")
     already_synced = models.IntegerField(default=0, help_text="Skipped — already synced for this date")
@@ -1,12 +1,19 @@
 import re
+import tempfile
 import pandas as pd
 import psycopg2
 import psycopg2.extras
 import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
 from psycopg2.extras import Json, execute_values
-from datetime import date
+from datetime import date, timedelta
 import logging
 
+from . import db_pool
+
 logger = logging.getLogger(__name__)
 
 
@@ -15,6 +22,21 @@ class DatabaseManager:
     # Ceiling on how far back a single losses batch is spread. A client who stops
     # recording for a month would otherwise smear one batch across the whole window.
     LOSS_MAX_SPREAD_DAYS = 7
+    LOSS_TYPES = ("broken", "expired", "internal", "stolen", "shrinkage")
+
+    # Days of history kept in sales_sets / bought_sets, slot 0 included
+    DAILY_HISTORY_DAYS = 60
+
+    # Where the daily history lives. "jsonb": the product_stats.sales_sets / bought_sets
+    # arrays. "table": daily_sales, one row per product per day with any activity, and
+    # the arrays are left NULL. Readers get the same newest-first arrays either way
+    # through sales_sets_sql / bought_sets_sql. A schema is converted on its first
+    # connection under the other setting (see _ensure_history_storage), so every
+    # worker must be restarted with the new value together.
+    SALES_STORAGE = os.environ.get('SALES_HISTORY_STORAGE', 'jsonb')
+
+    # Per-process memo of schemas already upgraded
+    _upgraded_schemas = set()
 
     # --- Connection & Cursor ---
 
@@ -24,14 +46,11 @@ class DatabaseManager:
         else:
             self.schema = "public"
 
-        self.conn = psycopg2.connect(
-            host=os.environ.get('PG_HOST'),
-            database=os.environ.get('PG_DATABASE'),
-            user=os.environ.get('PG_USER'),
-            password=os.environ.get('PG_PASSWORD'),
-            options=f'-c search_path={self.schema},public'
-        )
-        self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        # Borrowed from the per-process pool (search_path is fixed per schema).
+        # The finalizer returns it even if an instance is dropped without close().
+        self.conn = db_pool.checkout(self.schema)
+        self._release = weakref.finalize(self, db_pool.release, self.schema, self.conn)
+        self._ensure_upgrades()
 
     def cursor(self):
         return self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
@@ -42,7 +61,28 @@ class DatabaseManager:
         return clean
 
     def close(self):
-        self.conn.close()
+        """Return the connection to the pool. Safe to call more than once."""
+        self._release()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the enclosed statements as one transaction. The connection is otherwise
+        in autocommit, where each statement commits on its own. Nested use joins
+        the outer transaction.
+        """
+        if not self.conn.autocommit:
+            yield self.cursor()
+            return
+        self.conn.autocommit = False
+        try:
+            yield self.cursor()
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.conn.autocommit = True
 
     # --- Schema / DDL ---
 
@@ -125,10 +165,145 @@ class DatabaseManager:
 
         cur.execute("CREATE INDEX IF NOT EXISTS idx_products_settore ON products(settore)")
         cur.execute("CREATE INDEX IF NOT EXISTS idx_products_cluster ON products(cluster)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_products_ean ON products(ean)")
 
         self.conn.commit()
+        DatabaseManager._upgraded_schemas.discard(self.schema)
+        self._ensure_upgrades()
         print(f"Tables created/verified in schema: {self.schema}")
 
+    def _ensure_upgrades(self):
+        """
+        Bring an existing schema up to date with tables and columns added after
+        create_tables first ran for it. Once per schema per process; a schema
+        without product_stats yet is left to create_tables.
+        """
+        if self.schema in DatabaseManager._upgraded_schemas:
+            return
+        cur = self.cursor()
+        cur.execute("SELECT to_regclass('product_stats') IS NOT NULL AS ready")
+        if not cur.fetchone()["ready"]:
+            return
+
+        # EAN lookups that miss the in-process map (see _ean_map) go to the table
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_products_ean ON products(ean)")
+
+        # Today's running total, sales_sets[0], as its own column so apply_realtime_sales
+        # can diff a payload without reading the arrays. Generated: every writer of
+        # sales_sets keeps it right with no code of its own. Deliberately unindexed:
+        # sold_today changes with every sale a sync books, and an index holding it
+        # would stop those updates from being HOT. The primary key serves the join.
+        self._add_column_if_missing(
+            cur, "product_stats", "sold_today",
+            "NUMERIC GENERATED ALWAYS AS (COALESCE((sales_sets->>0)::numeric, 0)) STORED"
+        )
+        cur.execute("SELECT to_regclass('idx_product_stats_sold_today') IS NOT NULL AS present")
+        if cur.fetchone()["present"]:
+            cur.execute("DROP INDEX IF EXISTS idx_product_stats_sold_today")
+
+        # Maintained aggregate behind get_store_daily_totals. Empty means "rebuild
+        # on next read"; day is the sales_sets slot's date, MAX(day) being slot 0.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS store_daily_totals (
+                day DATE PRIMARY KEY,
+                total NUMERIC NOT NULL DEFAULT 0
+            )
+        """)
+
+        # Cache for scripts/feature_store.py. NULL avg / sigma: not enough history.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS product_features (
+                cod INTEGER NOT NULL,
+                v INTEGER NOT NULL,
+                computed_on DATE NOT NULL,
+                closure_key TEXT NOT NULL,
+                avg_daily_sales DOUBLE PRECISION,
+                deviation DOUBLE PRECISION NOT NULL,
+                sigma_daily DOUBLE PRECISION,
+                PRIMARY KEY (cod, v)
+            )
+        """)
+
+        # Payloads accepted by the realtime sync endpoint in queued mode, applied in
+        # order by tasks.apply_realtime_sales_queue. id doubles as the store's receipt.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS realtime_sync_inbox (
+                id BIGSERIAL PRIMARY KEY,
+                sync_date DATE NOT NULL,
+                received_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                totals JSONB NOT NULL,
+                shelf_life JSONB NOT NULL DEFAULT '[]',
+                -- pending | applied | superseded | failed
+                status TEXT NOT NULL DEFAULT 'pending',
+                processed_at TIMESTAMPTZ,
+                result JSONB
+            )
+        """)
+        self._add_column_if_missing(cur, "realtime_sync_inbox", "delta", "BOOLEAN NOT NULL DEFAULT FALSE")
+
+        # Latest date _rollover_sales_day has run for; a single row.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS sales_roll_state (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                rolled_through DATE
+            )
+        """)
+
+        # Last acknowledged sequence of the store's delta payloads; a single row.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS realtime_sync_state (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                sync_date DATE,
+                last_seq BIGINT,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_realtime_sync_inbox_pending
+            ON realtime_sync_inbox(id) WHERE status = 'pending'
+        """)
+
+        # The daily history of SALES_STORAGE "table". Range partitioned by month: the
+        # day roll creates the months ahead and drops those past DAILY_HISTORY_DAYS.
+        # A product's history starts at history_start (NULL: no history, as a NULL
+        # sales_sets) and its slot 0 is last_update_sold, the running day.
+        self._add_column_if_missing(cur, "product_stats", "history_start", "DATE")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS daily_sales (
+                cod INTEGER NOT NULL,
+                v INTEGER NOT NULL,
+                day DATE NOT NULL,
+                -- NULL: a censored stock-out day, as None in sales_sets
+                sold INTEGER DEFAULT 0,
+                bought INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (cod, v, day)
+            ) PARTITION BY RANGE (day)
+        """)
+        cur.execute("CREATE TABLE IF NOT EXISTS daily_sales_default PARTITION OF daily_sales DEFAULT")
+
+        # Which SALES_STORAGE the schema's daily history is held in; a single row,
+        # absent meaning "jsonb".
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS sales_history_state (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                storage TEXT NOT NULL
+            )
+        """)
+
+        self.conn.commit()
+        self._ensure_history_storage()
+        DatabaseManager._upgraded_schemas.add(self.schema)
+
+    def _add_column_if_missing(self, cur, table, column, ddl_type):
+        # Checked first: ALTER TABLE takes an exclusive lock even when IF NOT EXISTS
+        # turns it into a no-op, and would queue behind every running query.
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+        """, (table, column))
+        if cur.fetchone() is None:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {ddl_type}")
+
     # --- Product CRUD ---
 
     def add_product(self, cod, v, descrizione, rapp, pz_x_collo, settore, disponibilita="Si", ean=None):
@@ -139,6 +314,8 @@ class DatabaseManager:
             ON CONFLICT (cod, v) DO NOTHING
         """, (cod, v, descrizione, rapp, pz_x_collo, settore, disponibilita, ean))
         self.conn.commit()
+        if ean is not None:
+            self.invalidate_ean_cache()
 
     def init_product_stats(self, cod: int, v: int, sold: list, bought: list, stock: int = 0, verified: bool = False):
         sold = sold if sold else [0]
@@ -177,31 +354,70 @@ class DatabaseManager:
         the stats to merge, plus the availability flags used to decide which
         side of the link is the one to order.
         """
+        return self.get_linked_products_stats([(cod, v)]).get((int(cod), int(v)))
+
+    def get_linked_products_stats(self, keys) -> dict:
+        """
+        Batch get_linked_product_stats: {(cod, v): info} for every key with a
+        products row, in one query.
+        """
+        keys = list(dict.fromkeys((int(c), int(v)) for c, v in keys))
+        if not keys:
+            return {}
         cur = self.cursor()
-        cur.execute("""
-            SELECT ps.sales_sets, ps.stock, ps.verified, p.disponibilita, p.purge_flag
+        cur.execute(f"""
+            SELECT p.cod, p.v, {self.sales_sets_sql("ps")} AS sales_sets,
+                   ps.stock, ps.verified, p.disponibilita, p.purge_flag
             FROM products p
+            JOIN unnest(%s::int[], %s::int[]) AS t(cod, v)
+              ON p.cod = t.cod AND p.v = t.v
             LEFT JOIN product_stats ps ON p.cod = ps.cod AND p.v = ps.v
-            WHERE p.cod = %s AND p.v = %s
-        """, (cod, v))
-        row = cur.fetchone()
-        if not row:
-            return None
-        return {
-            "sales_sets": row["sales_sets"] or [],
-            "stock": row["stock"] or 0,
-            "verified": row["verified"],
-            "disponibilita": row["disponibilita"],
-            "purge_flag": row["purge_flag"],
-        }
+        """, ([k[0] for k in keys], [k[1] for k in keys]))
+
+        stats = {}
+        for row in cur.fetchall():
+            stats[(row["cod"], row["v"])] = {
+                "sales_sets": row["sales_sets"] or [],
+                "stock": row["stock"] or 0,
+                "verified": row["verified"],
+                "disponibilita": row["disponibilita"],
+                "purge_flag": row["purge_flag"],
+            }
+        return stats
 
     def get_store_daily_totals(self):
         """
         Element-wise sum of sales_sets across every verified product: one total per
         day slot, newest first. Feeds Helper.closure_day_mask, which uses it to
         spot closures and missed syncs.
+
+        Read from store_daily_totals, which the sales paths keep current as deltas;
+        only an empty table (first use, or after a change too broad to express as a
+        delta) costs a scan of the catalog.
         """
         cur = self.cursor()
+        cur.execute("""
+            SELECT day, total FROM store_daily_totals
+            WHERE day > (SELECT MAX(day) FROM store_daily_totals) - %s
+            ORDER BY day DESC
+        """, (self.DAILY_HISTORY_DAYS,))
+        rows = cur.fetchall()
+        if not rows:
+            self._rebuild_store_daily_totals()
+            cur.execute("SELECT day, total FROM store_daily_totals ORDER BY day DESC")
+            rows = cur.fetchall()
+            if not rows:
+                return []
+
+        anchor = rows[0]["day"]
+        by_day = {r["day"]: float(r["total"] or 0) for r in rows}
+        span = (anchor - rows[-1]["day"]).days + 1
+        return [by_day.get(anchor - timedelta(days=i), 0.0) for i in range(span)]
+
+    def _scan_store_daily_totals(self, cur, anchor):
+        """The full aggregate, as {day: total} with slot 0 dated `anchor`."""
+        if self.SALES_STORAGE == "table":
+            return self._scan_daily_sales_totals(cur, anchor)
         cur.execute("""
             SELECT t.ord, SUM((t.elem)::numeric) AS total
             FROM product_stats ps,
@@ -210,9 +426,105 @@ class DatabaseManager:
               AND ps.sales_sets IS NOT NULL
               AND jsonb_typeof(t.elem) = 'number'
             GROUP BY t.ord
-            ORDER BY t.ord
         """)
-        return [float(r["total"] or 0) for r in cur.fetchall()]
+        return {anchor - timedelta(days=r["ord"] - 1): r["total"] or 0 for r in cur.fetchall()}
+
+    def _scan_daily_sales_totals(self, cur, anchor):
+        """_scan_store_daily_totals over daily_sales: every slot a verified product's sales_sets would hold."""
+        cur.execute("""
+            SELECT MAX(LEAST(%s, last_update_sold - history_start + 1)) AS span
+            FROM product_stats
+            WHERE verified = TRUE AND history_start <= last_update_sold
+        """, (self.DAILY_HISTORY_DAYS,))
+        span = cur.fetchone()["span"] or 0
+        totals = {anchor - timedelta(days=i): 0 for i in range(span)}
+        cur.execute("""
+            SELECT d.day, SUM(d.sold) AS total
+            FROM product_stats ps
+            JOIN daily_sales d ON d.cod = ps.cod AND d.v = ps.v
+            WHERE ps.verified = TRUE
+              AND d.day <= ps.last_update_sold
+              AND d.day >= GREATEST(ps.history_start, ps.last_update_sold - %s)
+            GROUP BY d.day
+        """, (self.DAILY_HISTORY_DAYS - 1,))
+        for r in cur.fetchall():
+            if r["day"] in totals:
+                totals[r["day"]] = r["total"] or 0
+        return totals
+
+    def _lock_store_daily_totals(self, cur, shared=True):
+        """
+        Transaction-scoped advisory lock on store_daily_totals: shared for the delta
+        writers, exclusive for the rebuild. A delta committed while a rebuild scans
+        would otherwise be skipped (the table still looks empty) and missed by the
+        scan alike.
+        """
+        lock = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+        cur.execute(f"SELECT {lock}(hashtext(%s))", (f"store_daily_totals:{self.schema}",))
+
+    def _rebuild_store_daily_totals(self):
+        """Fill an empty store_daily_totals from a fresh scan. A no-op if another caller got there first."""
+        with self.transaction() as cur:
+            self._lock_store_daily_totals(cur, shared=False)
+            cur.execute("SELECT EXISTS (SELECT 1 FROM store_daily_totals) AS filled")
+            if cur.fetchone()["filled"]:
+                return
+            # Date slot 0 by the last roll, not the clock: between midnight and the
+            # nightly roll, slot 0 still holds yesterday.
+            cur.execute("SELECT MAX(last_update_sold) AS day FROM product_stats")
+            anchor = cur.fetchone()["day"] or date.today()
+            totals = self._scan_store_daily_totals(cur, anchor)
+            if totals:
+                execute_values(cur, """
+                    INSERT INTO store_daily_totals (day, total) VALUES %s
+                """, list(totals.items()), page_size=1000)
+
+    def _add_store_daily_totals(self, cur, slot_deltas):
+        """
+        Book {slot: qty} changes to verified products' sales_sets, slot 0 being the
+        running day. Skipped while the table is empty: the rebuild will see them.
+        Call inside the same transaction as the product_stats write: the shared lock
+        then holds a concurrent rebuild off until the write is committed and visible
+        to its scan, so it can neither miss nor double-count them.
+        """
+        rows = [(slot, qty) for slot, qty in slot_deltas.items() if qty]
+        if not rows:
+            return
+        self._lock_store_daily_totals(cur)
+        execute_values(cur, """
+            INSERT INTO store_daily_totals (day, total)
+            SELECT m.anchor - d.slot::int, d.qty::numeric
+            FROM (VALUES %s) AS d(slot, qty)
+            CROSS JOIN (SELECT MAX(day) AS anchor FROM store_daily_totals) AS m
+            WHERE m.anchor IS NOT NULL
+            ON CONFLICT (day) DO UPDATE SET total = store_daily_totals.total + EXCLUDED.total
+        """, rows, page_size=1000)
+
+    def _roll_store_daily_totals(self, cur, sync_date):
+        """
+        The roll's delta: a new, empty slot 0 and nothing else — the closed day keeps
+        its total (censoring only turns a 0 into None) and every other slot just
+        moves one place. A roll that skips days shifts sales_sets by one slot all the
+        same, which dates can't express, so that case falls back to a rebuild.
+        """
+        self._lock_store_daily_totals(cur)
+        cur.execute("SELECT MAX(day) AS anchor FROM store_daily_totals")
+        anchor = cur.fetchone()["anchor"]
+        if anchor is None or anchor >= sync_date:
+            return
+        if (sync_date - anchor).days != 1:
+            self._invalidate_store_daily_totals(cur)
+            return
+        cur.execute("INSERT INTO store_daily_totals (day, total) VALUES (%s, 0)", (sync_date,))
+        cur.execute(
+            "DELETE FROM store_daily_totals WHERE day <= %s",
+            (sync_date - timedelta(days=self.DAILY_HISTORY_DAYS),)
+        )
+
+    def _invalidate_store_daily_totals(self, cur):
+        """For changes that move whole histories in or out of the sum (verification, purge)."""
+        self._lock_store_daily_totals(cur)
+        cur.execute("DELETE FROM store_daily_totals")
 
     def get_promos_ended_days_ago(self, days_ago: int):
         """
@@ -221,9 +533,9 @@ class DatabaseManager:
         measurement idempotent — each promo is seen on exactly one nightly sweep.
         """
         cur = self.cursor()
-        cur.execute("""
+        cur.execute(f"""
             SELECT e.cod, e.v, e.sale_start, e.sale_end, e.price_std, e.price_s,
-                   ps.sales_sets
+                   {self.sales_sets_sql("ps")} AS sales_sets
             FROM economics e
             JOIN product_stats ps ON ps.cod = e.cod AND ps.v = e.v
             WHERE e.sale_start IS NOT NULL
@@ -268,14 +580,9 @@ class DatabaseManager:
         return row["stock"]
 
     def get_product_by_ean(self, ean):
-        cur = self.cursor()
-        cur.execute("""
-            SELECT p.cod, p.v, p.descrizione, p.pz_x_collo, p.settore
-            FROM products p
-            WHERE p.ean = %s
-            LIMIT 1
-        """, (ean,))
-        return cur.fetchone()
+        """cod, v, descrizione, pz_x_collo, settore for the EAN, or None."""
+        product = self.lookup_eans([ean]).get(ean)
+        return dict(product) if product else None
 
     def get_all_stats_by_settore(self, settore):
         cur = self.cursor()
@@ -373,11 +680,16 @@ class DatabaseManager:
         """
         cur = self.cursor()
         if new_stock is not None:
-            cur.execute(
-                "UPDATE product_stats SET stock=%s, verified=TRUE WHERE cod=%s AND v=%s",
-                (new_stock, cod, v)
-            )
-            if cur.rowcount == 0:
+            cur.execute("""
+                WITH old AS (SELECT verified FROM product_stats WHERE cod=%s AND v=%s)
+                UPDATE product_stats SET stock=%s, verified=TRUE WHERE cod=%s AND v=%s
+                RETURNING (SELECT verified FROM old) AS was_verified
+            """, (cod, v, new_stock, cod, v))
+            updated = cur.fetchone()
+            if updated is not None and not updated["was_verified"]:
+                # Its whole history joins the store totals
+                self._invalidate_store_daily_totals(cur)
+            if updated is None:
                 logger.warning(f"No product_stats found for {cod}.{v}, initializing row")
                 self.init_product_stats(cod, v, sold=[0], bought=[0], stock=new_stock, verified=True)
 
@@ -388,60 +700,399 @@ class DatabaseManager:
 
         self.conn.commit()
 
+    # --- Demand features (see scripts/feature_store.py) ---
+
+    def get_product_features(self, keys, computed_on, closure_key) -> dict:
+        """{(cod, v): (avg_daily_sales, deviation, sigma_daily)} for the still-valid cached rows."""
+        if not keys:
+            return {}
+        cur = self.cursor()
+        cur.execute("""
+            SELECT f.cod, f.v, f.avg_daily_sales, f.deviation, f.sigma_daily
+            FROM product_features f
+            JOIN unnest(%s::int[], %s::int[]) AS t(cod, v) ON f.cod = t.cod AND f.v = t.v
+            WHERE f.computed_on = %s AND f.closure_key = %s
+        """, ([k[0] for k in keys], [k[1] for k in keys], computed_on, closure_key))
+        return {
+            (r["cod"], r["v"]): (r["avg_daily_sales"], r["deviation"], r["sigma_daily"])
+            for r in cur.fetchall()
+        }
+
+    def store_product_features(self, rows, computed_on, closure_key):
+        """Upsert [(cod, v, avg_daily_sales, deviation, sigma_daily), ...]."""
+        if not rows:
+            return
+        cur = self.cursor()
+        execute_values(cur, """
+            INSERT INTO product_features
+                (cod, v, avg_daily_sales, deviation, sigma_daily, computed_on, closure_key)
+            VALUES %s
+            ON CONFLICT (cod, v) DO UPDATE SET
+                avg_daily_sales = EXCLUDED.avg_daily_sales,
+                deviation       = EXCLUDED.deviation,
+                sigma_daily     = EXCLUDED.sigma_daily,
+                computed_on     = EXCLUDED.computed_on,
+                closure_key     = EXCLUDED.closure_key
+        """, [tuple(r) + (computed_on, closure_key) for r in rows], page_size=1000)
+        self.conn.commit()
+
+    def _invalidate_product_features(self, cur, keys):
+        """Drop cached features for products whose completed days were just rewritten."""
+        if not keys:
+            return
+        cur.execute("""
+            DELETE FROM product_features f
+            USING unnest(%s::int[], %s::int[]) AS t(cod, v)
+            WHERE f.cod = t.cod AND f.v = t.v
+        """, ([k[0] for k in keys], [k[1] for k in keys]))
+
+    # --- Daily history storage (see SALES_STORAGE) ---
+
+    def sales_sets_sql(self, alias="ps"):
+        """
+        SQL for the sales_sets of product_stats row `alias`, whichever storage holds
+        it: the column itself, or the same newest-first array rebuilt from daily_sales.
+        Every reader of the arrays goes through this or bought_sets_sql.
+        """
+        if self.SALES_STORAGE == "table":
+            return self._daily_history_sql(alias, "sold")
+        return f"{alias}.sales_sets"
+
+    def bought_sets_sql(self, alias="ps"):
+        """SQL for the bought_sets of product_stats row `alias`, as sales_sets_sql."""
+        if self.SALES_STORAGE == "table":
+            return self._daily_history_sql(alias, "bought")
+        return f"{alias}.bought_sets"
+
+    def _daily_history_sql(self, alias, column):
+        # Slot i is the day last_update_sold - i, back to history_start and at most
+        # DAILY_HISTORY_DAYS slots: a day without a row is 0, a NULL sold is null.
+        # No history_start gives no slots, and jsonb_agg over nothing is NULL. The
+        # redundant day bounds make each partition's probe one primary-key range scan.
+        return f"""(
+            SELECT jsonb_agg(
+                       CASE WHEN d.day IS NULL THEN '0'::jsonb
+                            ELSE COALESCE(to_jsonb(d.{column}), 'null'::jsonb) END
+                       ORDER BY g.i)
+            FROM generate_series(
+                0, LEAST({self.DAILY_HISTORY_DAYS}, {alias}.last_update_sold - {alias}.history_start + 1) - 1
+            ) AS g(i)
+            LEFT JOIN daily_sales d
+              ON d.cod = {alias}.cod AND d.v = {alias}.v AND d.day = {alias}.last_update_sold - g.i
+             AND d.day > {alias}.last_update_sold - {self.DAILY_HISTORY_DAYS}
+             AND d.day <= {alias}.last_update_sold
+        )"""
+
+    def _ensure_history_storage(self):
+        """
+        Convert the schema's daily history to SALES_STORAGE if it is held in the other
+        storage. Runs from _ensure_upgrades, before this process touches any history.
+        product_stats is locked against writes while it runs; other processes racing
+        to convert wait for the first, then find nothing left to do.
+        """
+        if self.SALES_STORAGE not in ("jsonb", "table"):
+            raise ValueError(f"SALES_HISTORY_STORAGE must be 'jsonb' or 'table', not {self.SALES_STORAGE!r}")
+
+        def held(cur):
+            cur.execute("SELECT storage FROM sales_history_state")
+            row = cur.fetchone()
+            return row["storage"] if row else "jsonb"
+
+        if held(self.cursor()) == self.SALES_STORAGE:
+            return
+        with self.transaction() as cur:
+            cur.execute("LOCK TABLE product_stats IN EXCLUSIVE MODE")
+            if held(cur) == self.SALES_STORAGE:
+                return
+            if self.SALES_STORAGE == "table":
+                moved = self._history_to_table(cur)
+            else:
+                moved = self._history_to_jsonb(cur)
+            cur.execute("""
+                INSERT INTO sales_history_state (id, storage) VALUES (TRUE, %s)
+                ON CONFLICT (id) DO UPDATE SET storage = EXCLUDED.storage
+            """, (self.SALES_STORAGE,))
+            self._invalidate_store_daily_totals(cur)
+        logger.info(
+            f"[DAILY SALES] schema={self.schema} history moved to {self.SALES_STORAGE} "
+            f"({moved} rows)"
+        )
+
+    def _history_to_table(self, cur) -> int:
+        """
+        Move every product's sales_sets / bought_sets into daily_sales, slot i being
+        the day last_update_sold - i, and clear the arrays. Only days with a sale, a
+        delivery or a censored slot get a row. Returns the number of rows written.
+        """
+        cur.execute("SELECT MAX(last_update_sold) AS day FROM product_stats")
+        anchor = cur.fetchone()["day"] or date.today()
+        oldest = anchor - timedelta(days=self.DAILY_HISTORY_DAYS - 1)
+        self._ensure_daily_sales_partitions(cur, oldest, anchor + timedelta(days=31))
+
+        # An undated history is taken as rolled through the newest date, which is
+        # where the next roll would put it
+        cur.execute("""
+            UPDATE product_stats
+            SET last_update_sold = %s
+            WHERE last_update_sold IS NULL
+              AND (jsonb_typeof(sales_sets) = 'array' OR jsonb_typeof(bought_sets) = 'array')
+        """, (anchor,))
+        cur.execute("""
+            WITH h AS (
+                SELECT ps.cod, ps.v, ps.last_update_sold AS anchor,
+                       CASE WHEN jsonb_typeof(ps.sales_sets) = 'array'
+                            THEN ps.sales_sets ELSE '[]'::jsonb END AS ss,
+                       CASE WHEN jsonb_typeof(ps.bought_sets) = 'array'
+                            THEN ps.bought_sets ELSE '[]'::jsonb END AS bs
+                FROM product_stats ps
+                WHERE ps.last_update_sold IS NOT NULL
+            ),
+            slots AS (
+                SELECT h.cod, h.v, h.anchor - g.i AS day,
+                       h.ss -> g.i AS s, h.bs -> g.i AS b
+                FROM h,
+                     LATERAL generate_series(
+                         0, LEAST(GREATEST(jsonb_array_length(h.ss), jsonb_array_length(h.bs)),
+                                  %(days)s) - 1
+                     ) AS g(i)
+            )
+            INSERT INTO daily_sales (cod, v, day, sold, bought)
+            SELECT cod, v, day,
+                   CASE WHEN jsonb_typeof(s) = 'number' THEN (s #>> '{}')::numeric::int
+                        WHEN jsonb_typeof(s) = 'null' THEN NULL ELSE 0 END,
+                   CASE WHEN jsonb_typeof(b) = 'number' THEN (b #>> '{}')::numeric::int ELSE 0 END
+            FROM slots
+            WHERE day >= %(oldest)s
+              AND (jsonb_typeof(s) = 'null'
+                   OR (jsonb_typeof(s) = 'number' AND (s #>> '{}')::numeric <> 0)
+                   OR (jsonb_typeof(b) = 'number' AND (b #>> '{}')::numeric <> 0))
+        """, {"days": self.DAILY_HISTORY_DAYS, "oldest": oldest})
+        moved = cur.rowcount
+
+        slots = (
+            "GREATEST(jsonb_array_length(CASE WHEN jsonb_typeof(sales_sets) = 'array' THEN sales_sets ELSE '[]' END),"
+            " jsonb_array_length(CASE WHEN jsonb_typeof(bought_sets) = 'array' THEN bought_sets ELSE '[]' END))"
+        )
+        cur.execute(f"""
+            UPDATE product_stats
+            SET history_start = CASE WHEN {slots} > 0 THEN last_update_sold - ({slots} - 1) END,
+                sales_sets = NULL,
+                bought_sets = NULL
+            WHERE sales_sets IS NOT NULL OR bought_sets IS NOT NULL
+        """)
+        return moved
+
+    def _history_to_jsonb(self, cur) -> int:
+        """Rebuild sales_sets / bought_sets from daily_sales and empty it. Returns the products rebuilt."""
+        cur.execute(f"""
+            UPDATE product_stats AS ps
+            SET sales_sets = {self._daily_history_sql("ps", "sold")},
+                bought_sets = {self._daily_history_sql("ps", "bought")},
+                history_start = NULL
+            WHERE ps.history_start IS NOT NULL
+        """)
+        rebuilt = cur.rowcount
+        cur.execute("TRUNCATE daily_sales")
+        return rebuilt
+
+    def _ensure_daily_sales_partitions(self, cur, first_day, last_day):
+        """Create the monthly partitions of daily_sales covering first_day..last_day."""
+        month = first_day.replace(day=1)
+        while month <= last_day:
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            name = f"daily_sales_{month:%Y%m}"
+            cur.execute("SELECT to_regclass(%s) IS NULL AS missing", (name,))
+            if cur.fetchone()["missing"]:
+                cur.execute(
+                    f"CREATE TABLE {name} PARTITION OF daily_sales FOR VALUES FROM (%s) TO (%s)",
+                    (month, next_month)
+                )
+            month = next_month
+
+    def _drop_expired_daily_sales(self, cur, anchor):
+        """Drop the months wholly before the DAILY_HISTORY_DAYS window ending at `anchor`."""
+        oldest = anchor - timedelta(days=self.DAILY_HISTORY_DAYS - 1)
+        cur.execute("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'daily_sales'::regclass
+              AND c.relname ~ '^daily_sales_[0-9]{6}$'
+        """)
+        for r in cur.fetchall():
+            month = date(int(r["relname"][-6:-2]), int(r["relname"][-2:]), 1)
+            if (month + timedelta(days=32)).replace(day=1) <= oldest:
+                cur.execute(f"DROP TABLE {r['relname']}")
+                logger.info(f"[DAILY SALES] schema={self.schema} dropped {r['relname']}")
+        cur.execute("DELETE FROM daily_sales_default WHERE day < %s", (oldest,))
+
     # --- Data Sync ---
 
-    def _rollover_sales_day(self, cur, sync_date) -> int:
+    # schema -> date every product_stats row is known to be rolled through. Only ever
+    # moves forward, so a cached value can be trusted without asking the database.
+    _rolled_through = {}
+
+    def _is_rolled_through(self, cur, sync_date) -> bool:
+        """Whether the day roll for `sync_date` already ran in this schema."""
+        cached = DatabaseManager._rolled_through.get(self.schema)
+        if cached is not None and cached >= sync_date:
+            return True
+        cur.execute("SELECT rolled_through FROM sales_roll_state")
+        row = cur.fetchone()
+        if row is None or row["rolled_through"] is None:
+            return False
+        DatabaseManager._rolled_through[self.schema] = row["rolled_through"]
+        return row["rolled_through"] >= sync_date
+
+    def _rollover_sales_day(self, sync_date) -> int:
         """
         Close every product's current slot and open a fresh one for `sync_date`.
 
-        Idempotent: products already at `sync_date` are skipped.
+        Once per schema per date: sales_roll_state records the date rolled through,
+        so every sync after the first (and the 00:05 roll after a sync got there
+        first) is a cached compare. Products are still skipped one by one when
+        already at `sync_date`, as products created today are.
 
         Closing applies the censored-stockout rule — a verified product that ended on zero
         with an empty shelf while the supplier still had stock was unbuyable, not
-        demandless, so its slot becomes None and drops out of the averages.
+        demandless, so its slot becomes None and drops out of the averages. "Demand
+        driven" means its latest non-None day before the one being closed sold something.
+
+        One UPDATE over the schema (in "table" storage a narrow one, see
+        _roll_daily_sales), in a transaction under a per-schema advisory lock so
+        concurrent syncs cannot both roll.
         """
-        cur.execute("""
-            SELECT ps.cod, ps.v, ps.sales_sets, ps.bought_sets, ps.stock, ps.verified,
-                   p.disponibilita
-            FROM product_stats ps
-            LEFT JOIN products p ON p.cod = ps.cod AND p.v = ps.v
-            WHERE ps.last_update_sold IS NULL OR ps.last_update_sold < %s
-        """, (sync_date,))
-        rows = cur.fetchall()
-        if not rows:
+        if self._is_rolled_through(self.cursor(), sync_date):
             return 0
 
-        updates = []
-        for r in rows:
-            ss = r["sales_sets"] or []
-            if ss and (ss[0] or 0) == 0 and bool(r["verified"]):
-                stock_zero = (r["stock"] or 0) == 0
-                supplier_oos = r["disponibilita"] == 'No'
-                # Look past slot 0 — that is the day being closed, not history
-                last_known_sale = next((v for v in ss[1:] if v is not None), None)
-                demand_driven = last_known_sale is not None and last_known_sale > 0
-                if stock_zero and not supplier_oos and demand_driven:
-                    ss[0] = None
-
-            ss.insert(0, 0)
-            bs = r["bought_sets"] or []
-            bs.insert(0, 0)
-            updates.append((r["cod"], r["v"], Json(ss[:60]), Json(bs[:60]), sync_date))
-
-        # Batched: a full pass covers every product in the schema, and one UPDATE each
-        # meant thousands of round trips. Alias is `d`, not `v` — product_stats has a
-        # column called v and the collision would silently match the wrong rows.
-        execute_values(cur, """
+        with self.transaction() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"sales_roll:{self.schema}",))
+            if self._is_rolled_through(cur, sync_date):
+                return 0
+
+            if self.SALES_STORAGE == "table":
+                rolled = self._roll_daily_sales(cur, sync_date)
+            else:
+                rolled = self._roll_sales_sets(cur, sync_date)
+
+            if rolled:
+                self._invalidate_product_features(cur, [(r["cod"], r["v"]) for r in rolled])
+                self._roll_store_daily_totals(cur, sync_date)
+
+            cur.execute("""
+                INSERT INTO sales_roll_state (id, rolled_through) VALUES (TRUE, %s)
+                ON CONFLICT (id) DO UPDATE
+                SET rolled_through = GREATEST(sales_roll_state.rolled_through, EXCLUDED.rolled_through)
+            """, (sync_date,))
+
+        DatabaseManager._rolled_through[self.schema] = sync_date
+        censored = sum(1 for r in rolled if r["censored"])
+        logger.info(
+            f"[DAY-ROLL] schema={self.schema} day={sync_date} rolled={len(rolled)} censored={censored}"
+        )
+        return len(rolled)
+
+    def _roll_sales_sets(self, cur, sync_date) -> list:
+        """The roll in the JSONB arrays: every due product's arrays shift by one slot."""
+        # The last_update_sold test is repeated on the target row: it is what
+        # Postgres re-checks if a row changed under the statement.
+        cur.execute("""
+            WITH due AS (
+                SELECT ps.cod, ps.v,
+                       CASE WHEN jsonb_typeof(ps.sales_sets) = 'array'
+                            THEN ps.sales_sets ELSE '[]'::jsonb END AS ss,
+                       CASE WHEN jsonb_typeof(ps.bought_sets) = 'array'
+                            THEN ps.bought_sets ELSE '[]'::jsonb END AS bs,
+                       COALESCE(ps.verified, FALSE)
+                         AND COALESCE(ps.stock, 0) = 0
+                         AND p.disponibilita IS DISTINCT FROM 'No' AS may_censor
+                FROM product_stats ps
+                LEFT JOIN products p ON p.cod = ps.cod AND p.v = ps.v
+                WHERE ps.last_update_sold IS NULL OR ps.last_update_sold < %(day)s
+            ),
+            closing AS (
+                SELECT due.*,
+                       due.may_censor
+                         AND jsonb_array_length(due.ss) > 0
+                         AND COALESCE((due.ss->>0)::numeric, 0) = 0
+                         AND COALESCE((
+                             SELECT (e.value #>> '{}')::numeric > 0
+                             FROM jsonb_array_elements(due.ss) WITH ORDINALITY AS e(value, ord)
+                             WHERE e.ord > 1 AND jsonb_typeof(e.value) <> 'null'
+                             ORDER BY e.ord
+                             LIMIT 1
+                         ), FALSE) AS censored
+                FROM due
+            )
             UPDATE product_stats AS ps
-            SET sales_sets       = d.sets::jsonb,
-                bought_sets      = d.bought::jsonb,
-                last_update_sold = d.day::date
-            FROM (VALUES %s) AS d(cod, var, sets, bought, day)
-            WHERE ps.cod = d.cod::int AND ps.v = d.var::int
-        """, updates, page_size=1000)
+            SET sales_sets = jsonb_build_array(0) || COALESCE(jsonb_path_query_array(
+                    CASE WHEN c.censored THEN jsonb_set(c.ss, '{0}', 'null'::jsonb) ELSE c.ss END,
+                    '$[0 to 58]'), '[]'::jsonb),
+                bought_sets = jsonb_build_array(0) || COALESCE(
+                    jsonb_path_query_array(c.bs, '$[0 to 58]'), '[]'::jsonb),
+                last_update_sold = %(day)s
+            FROM closing AS c
+            WHERE ps.cod = c.cod AND ps.v = c.v
+              AND (ps.last_update_sold IS NULL OR ps.last_update_sold < %(day)s)
+            RETURNING ps.cod, ps.v, c.censored
+        """, {"day": sync_date})
+        return cur.fetchall()
 
-        self.conn.commit()
-        return len(rows)
+    def _roll_daily_sales(self, cur, sync_date) -> list:
+        """
+        The roll in daily_sales. A new day is only a date without rows yet, so no
+        history moves: the censored days get their NULL row, every due product's
+        last_update_sold becomes `sync_date`, and the month partitions follow.
+        """
+        self._ensure_daily_sales_partitions(cur, sync_date, sync_date + timedelta(days=31))
+
+        # Same rule as _roll_sales_sets, over the few products it can apply to. The
+        # earlier days are those the product's sales_sets would hold.
+        cur.execute("""
+            WITH closing AS (
+                SELECT ps.cod, ps.v, ps.last_update_sold AS day,
+                       ps.last_update_sold - GREATEST(ps.history_start, ps.last_update_sold - %(span)s) AS earlier
+                FROM product_stats ps
+                LEFT JOIN products p ON p.cod = ps.cod AND p.v = ps.v
+                WHERE ps.last_update_sold < %(day)s
+                  AND ps.history_start <= ps.last_update_sold
+                  AND COALESCE(ps.verified, FALSE)
+                  AND COALESCE(ps.stock, 0) = 0
+                  AND p.disponibilita IS DISTINCT FROM 'No'
+            )
+            INSERT INTO daily_sales AS ds (cod, v, day, sold)
+            SELECT c.cod, c.v, c.day, NULL
+            FROM closing AS c
+            WHERE COALESCE((
+                      SELECT d.sold FROM daily_sales d
+                      WHERE d.cod = c.cod AND d.v = c.v AND d.day = c.day
+                  ), 0) = 0
+              AND COALESCE((
+                      -- The latest earlier day that is not censored; a day without a row sold 0
+                      SELECT COALESCE(d.sold, 0) > 0
+                      FROM generate_series(1, c.earlier) AS g(i)
+                      LEFT JOIN daily_sales d
+                        ON d.cod = c.cod AND d.v = c.v AND d.day = c.day - g.i
+                      WHERE d.day IS NULL OR d.sold IS NOT NULL
+                      ORDER BY g.i
+                      LIMIT 1
+                  ), FALSE)
+            ON CONFLICT (cod, v, day) DO UPDATE SET sold = NULL
+            RETURNING ds.cod, ds.v
+        """, {"day": sync_date, "span": self.DAILY_HISTORY_DAYS - 1})
+        censored = {(r["cod"], r["v"]) for r in cur.fetchall()}
+
+        cur.execute("""
+            UPDATE product_stats
+            SET last_update_sold = %(day)s,
+                history_start = COALESCE(history_start, %(day)s)
+            WHERE last_update_sold IS NULL OR last_update_sold < %(day)s
+            RETURNING cod, v
+        """, {"day": sync_date})
+        rolled = [dict(r, censored=(r["cod"], r["v"]) in censored) for r in cur.fetchall()]
+
+        self._drop_expired_daily_sales(cur, sync_date)
+        return rolled
 
     def roll_sales_day(self, sync_date) -> int:
         """
@@ -451,8 +1102,7 @@ class DatabaseManager:
         the first sync at 08:30, anything ordering or calibrating before then would slice
         off yesterday as if it were the running day.
         """
-        cur = self.cursor()
-        return self._rollover_sales_day(cur, sync_date)
+        return self._rollover_sales_day(sync_date)
 
     def apply_realtime_sales(self, totals, sync_date, shelf_life_map=None) -> dict:
         """
@@ -461,48 +1111,78 @@ class DatabaseManager:
         `totals` is [(cod, var, sold_today), ...] holding the day's total SO FAR, not an
         increment. Only the difference is booked, so every call is idempotent: a repeated
         payload is a no-op, a missed run is made up by the next, and the store keeps no
-        state. sales_sets[0] is rewritten in place; the day boundary is crossed only by
+        state. sales_sets[0] is rewritten in place (in "table" storage, the product's
+        daily_sales row for the running day); the day boundary is crossed only by
         _rollover_sales_day.
         """
+        rolled = self._rollover_sales_day(sync_date)
         cur = self.cursor()
-        rolled = self._rollover_sales_day(cur, sync_date)
 
         # Dedupe first: the batched update would count a repeated (cod, var) twice, where
         # the old per-product loop happened to absorb it.
         wanted = {(int(c), int(v)): int(s) for c, v, s in totals}
 
         applied = 0
-        unchanged = 0
         total_delta = 0
-        unverified_products = []
         stat_updates = []
+        day_rows = []
         shelf_updates = []
+        store_delta = 0  # verified products only, as in get_store_daily_totals
+
+        # The diff runs against the narrow sold_today column (sales_sets[0], kept by
+        # Postgres — see _ensure_upgrades), so the arrays stay out of this read.
+        # Most products in a sync have not moved since the last one, and only those
+        # that have get their JSONB arrays fetched and rewritten. In "table" storage
+        # the running day's daily_sales row plays sold_today, and is all that is written.
+        table = self.SALES_STORAGE == "table"
+        if table:
+            running = "COALESCE(d.sold, 0)"
+            running_join = """
+                LEFT JOIN daily_sales d
+                  ON d.cod = ps.cod AND d.v = ps.v AND d.day = ps.last_update_sold
+            """
+        else:
+            running, running_join = "ps.sold_today", ""
 
-        rows = []
+        matched = []
         if wanted:
-            cur.execute("""
-                SELECT ps.cod, ps.v, ps.sold_last_24, ps.sales_sets, ps.stock, ps.verified
+            cur.execute(f"""
+                SELECT ps.cod, ps.v, ps.verified, {running} <> t.sold AS changed
+                FROM product_stats ps
+                JOIN unnest(%s::int[], %s::int[], %s::int[]) AS t(cod, v, sold)
+                  ON ps.cod = t.cod AND ps.v = t.v
+                {running_join}
+            """, ([k[0] for k in wanted], [k[1] for k in wanted], list(wanted.values())))
+            matched = cur.fetchall()
+
+        not_in_db = len(wanted) - len(matched)
+        unverified_products = [{'cod': r["cod"], 'v': r["v"]} for r in matched if not r["verified"]]
+        changed_keys = [(r["cod"], r["v"]) for r in matched if r["changed"]]
+        unchanged = len(matched) - len(changed_keys)
+
+        rows = []
+        if changed_keys:
+            sets = "NULL" if table else "ps.sales_sets"
+            cur.execute(f"""
+                SELECT ps.cod, ps.v, ps.sold_last_24, {sets} AS sales_sets, ps.stock, ps.verified,
+                       COALESCE(ps.last_update_sold, %s) AS day, {running} AS running
                 FROM product_stats ps
                 JOIN unnest(%s::int[], %s::int[]) AS t(cod, v)
                   ON ps.cod = t.cod AND ps.v = t.v
-            """, ([k[0] for k in wanted], [k[1] for k in wanted]))
+                {running_join}
+            """, (sync_date, [k[0] for k in changed_keys], [k[1] for k in changed_keys]))
             rows = cur.fetchall()
 
-        not_in_db = len(wanted) - len(rows)
-
         for row in rows:
             cod, var = row["cod"], row["v"]
             sold_today = wanted[(cod, var)]
-
             verified = bool(row["verified"])
-            if not verified:
-                unverified_products.append({'cod': cod, 'v': var})
 
             ss = row["sales_sets"] or [0]
             if not ss:
                 ss = [0]
 
-            delta = sold_today - (ss[0] or 0)
+            delta = sold_today - (row["running"] if table else (ss[0] or 0))
             if delta == 0:
                 unchanged += 1
                 continue
@@ -520,19 +1200,36 @@ class DatabaseManager:
             ss[0] = sold_today
             stock = (row["stock"] or 0) - delta
 
-            stat_updates.append((cod, var, Json(sold_array), Json(ss), stock))
+            if table:
+                stat_updates.append((cod, var, Json(sold_array), None, stock, row["day"]))
+                day_rows.append((cod, var, row["day"], sold_today))
+            else:
+                stat_updates.append((cod, var, Json(sold_array), Json(ss), stock, row["day"]))
+            if verified:
+                store_delta += delta
             applied += 1
             total_delta += delta
 
         if stat_updates:
-            execute_values(cur, """
-                UPDATE product_stats AS ps
-                SET sold_last_24 = d.sold::jsonb,
-                    sales_sets   = d.sets::jsonb,
-                    stock        = d.stock::int
-                FROM (VALUES %s) AS d(cod, var, sold, sets, stock)
-                WHERE ps.cod = d.cod::int AND ps.v = d.var::int
-            """, stat_updates, page_size=1000)
+            if table:
+                history = "history_start = COALESCE(ps.history_start, d.day::date)"
+            else:
+                history = "sales_sets = d.sets::jsonb"
+            with self.transaction() as tx:
+                execute_values(tx, f"""
+                    UPDATE product_stats AS ps
+                    SET sold_last_24 = d.sold::jsonb,
+                        stock        = d.stock::int,
+                        {history}
+                    FROM (VALUES %s) AS d(cod, var, sold, sets, stock, day)
+                    WHERE ps.cod = d.cod::int AND ps.v = d.var::int
+                """, stat_updates, page_size=1000)
+                if day_rows:
+                    execute_values(tx, """
+                        INSERT INTO daily_sales AS ds (cod, v, day, sold) VALUES %s
+                        ON CONFLICT (cod, v, day) DO UPDATE SET sold = EXCLUDED.sold
+                    """, day_rows, page_size=1000)
+                self._add_store_daily_totals(tx, {0: store_delta})
 
         if shelf_updates:
             execute_values(cur, """
@@ -557,13 +1254,171 @@ class DatabaseManager:
             'unverified_products': unverified_products,
         }
 
+    # --- Queued realtime sync ---
+
+    # Processed inbox rows are kept this long, so a receipt can still be looked up
+    REALTIME_INBOX_KEEP_DAYS = 7
+
+    def enqueue_realtime_sales(self, totals, sync_date, shelf_life_map=None, delta=False) -> int:
+        """
+        Store a validated realtime payload for apply_realtime_sales to pick up later.
+        Same arguments as apply_realtime_sales; delta marks a payload listing only the
+        products that changed. Returns the receipt id.
+        """
+        cur = self.cursor()
+        cur.execute("""
+            INSERT INTO realtime_sync_inbox (sync_date, totals, shelf_life, delta)
+            VALUES (%s, %s, %s, %s)
+            RETURNING id
+        """, (
+            sync_date,
+            Json([[int(c), int(v), int(s)] for c, v, s in totals]),
+            Json([[c, v, sl] for (c, v), sl in (shelf_life_map or {}).items()]),
+            bool(delta),
+        ))
+        return cur.fetchone()["id"]
+
+    @contextmanager
+    def realtime_sync_lock(self):
+        """
+        Hold the schema's realtime-sync lock: one applier per supermarket at a time,
+        across every worker. Waits for the current holder rather than failing, so a
+        payload enqueued while another worker drains is never left behind.
+        """
+        key = f"realtime_sync:{self.schema}"
+        cur = self.cursor()
+        cur.execute("SELECT pg_advisory_lock(hashtext(%s))", (key,))
+        try:
+            yield
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", (key,))
+
+    def claim_realtime_sales(self) -> list:
+        """
+        Pending inbox payloads to apply, as [{'id', 'sync_date', 'totals',
+        'shelf_life_map', 'merged', 'delta'}, ...], one per sync_date in arrival order.
+        delta is True only if every payload merged into it was a delta.
+
+        Several pending payloads for the same day are coalesced into the newest: each
+        entry is an absolute total, so layering them oldest to newest gives exactly
+        what applying them one by one would — and a delta payload, which lists only
+        the products that changed, keeps the earlier payloads' other products. The
+        older rows are marked superseded. Call with realtime_sync_lock held.
+        """
+        with self.transaction() as cur:
+            cur.execute("""
+                DELETE FROM realtime_sync_inbox
+                WHERE status <> 'pending' AND received_at < now() - %s * INTERVAL '1 day'
+            """, (self.REALTIME_INBOX_KEEP_DAYS,))
+            cur.execute("""
+                SELECT id, sync_date, totals, shelf_life, delta
+                FROM realtime_sync_inbox
+                WHERE status = 'pending'
+                ORDER BY id
+            """)
+            rows = cur.fetchall()
+
+            by_day = {}
+            for r in rows:
+                day = by_day.setdefault(
+                    r["sync_date"], {'ids': [], 'totals': {}, 'shelf': {}, 'delta': True}
+                )
+                day['ids'].append(r["id"])
+                day['delta'] = day['delta'] and r["delta"]
+                for c, v, sold in r["totals"]:
+                    day['totals'][(c, v)] = sold
+                for c, v, sl in r["shelf_life"]:
+                    day['shelf'][(c, v)] = sl
+
+            superseded = [i for day in by_day.values() for i in day['ids'][:-1]]
+            if superseded:
+                cur.execute("""
+                    UPDATE realtime_sync_inbox
+                    SET status = 'superseded', processed_at = now()
+                    WHERE id = ANY(%s)
+                """, (superseded,))
+
+        payloads = [
+            {
+                'id': day['ids'][-1],
+                'sync_date': sync_date,
+                'totals': [(c, v, sold) for (c, v), sold in day['totals'].items()],
+                'shelf_life_map': day['shelf'],
+                'merged': len(day['ids']),
+                'delta': day['delta'],
+            }
+            for sync_date, day in by_day.items()
+        ]
+        return sorted(payloads, key=lambda p: p['id'])
+
+    # --- Realtime sync sequence (delta mode) ---
+
+    def get_realtime_seq(self):
+        """(sync_date, last_seq) the store's next delta must build on, or None."""
+        cur = self.cursor()
+        cur.execute("SELECT sync_date, last_seq FROM realtime_sync_state")
+        row = cur.fetchone()
+        return (row["sync_date"], row["last_seq"]) if row else None
+
+    def set_realtime_seq(self, sync_date, seq):
+        """Record a full (absolute) payload as the new base. seq None clears it."""
+        cur = self.cursor()
+        cur.execute("""
+            INSERT INTO realtime_sync_state (id, sync_date, last_seq, updated_at)
+            VALUES (TRUE, %s, %s, now())
+            ON CONFLICT (id) DO UPDATE
+            SET sync_date = EXCLUDED.sync_date,
+                last_seq = EXCLUDED.last_seq,
+                updated_at = now()
+        """, (sync_date, seq))
+
+    def advance_realtime_seq(self, sync_date, base_seq: int, seq: int) -> bool:
+        """
+        Accept a delta payload: move last_seq from base_seq to seq in one statement,
+        so two requests can never both build on the same base. False when the store
+        and the server disagree on the base — the store must then resync in full.
+        """
+        if seq <= base_seq:
+            return False
+        cur = self.cursor()
+        cur.execute("""
+            UPDATE realtime_sync_state
+            SET last_seq = %s, updated_at = now()
+            WHERE sync_date = %s AND last_seq = %s
+        """, (seq, sync_date, base_seq))
+        return cur.rowcount == 1
+
+    def finish_realtime_sales(self, receipt_id: int, status: str, result: dict = None):
+        """Record the outcome of one inbox payload ('applied' or 'failed')."""
+        cur = self.cursor()
+        cur.execute("""
+            UPDATE realtime_sync_inbox
+            SET status = %s, processed_at = now(), result = %s
+            WHERE id = %s
+        """, (status, Json(result) if result is not None else None, receipt_id))
+
+    def get_realtime_receipt(self, receipt_id: int):
+        """Status of one inbox payload, or None if unknown or already pruned."""
+        cur = self.cursor()
+        cur.execute("""
+            SELECT id, sync_date, received_at, status, processed_at, result
+            FROM realtime_sync_inbox
+            WHERE id = %s
+        """, (receipt_id,))
+        return cur.fetchone()
+
     def apply_invoice_deliveries(self, cod_v_dict: dict) -> dict:
         """
         For each (cod, v) in cod_v_dict, add the delivered quantity to:
         - bought_last_24[0] (current month total)
+        - bought_sets[0] (in "table" storage, the running day's daily_sales row)
         - stock
 
         Does NOT touch sold_last_24 or sales_sets.
+
+        One fetch and one batched UPDATE in a single transaction: a morning DDT for a
+        full store is thousands of lines, and a round trip plus commit per line was
+        most of the import's time.
         """
         today = date.today()
         current_month = today.month
@@ -572,20 +1427,36 @@ class DatabaseManager:
         errors = []
         unverified_products = []
 
+        keys = []
+        for cod, v in cod_v_dict:
+            try:
+                keys.append((int(cod), int(v)))
+            except (TypeError, ValueError):
+                pass  # reported as an error line by the loop below
+
+        rows = {}
+        if keys:
+            cur = self.cursor()
+            cur.execute("""
+                SELECT ps.cod, ps.v, ps.bought_last_24, ps.bought_sets, ps.stock,
+                       ps.last_update_bought, ps.last_update_sold, ps.verified, p.descrizione, p.rapp
+                FROM product_stats ps
+                JOIN products p ON p.cod = ps.cod AND p.v = ps.v
+                JOIN unnest(%s::int[], %s::int[]) AS t(cod, v)
+                  ON ps.cod = t.cod AND ps.v = t.v
+            """, ([k[0] for k in keys], [k[1] for k in keys]))
+            rows = {(r["cod"], r["v"]): r for r in cur.fetchall()}
+
+        table = self.SALES_STORAGE == "table"
+        stat_updates = []
+        day_rows = {}
+        pending = []
         for (cod, v), item in cod_v_dict.items():
             qty = item["qty"] if isinstance(item, dict) else item
             descrizione_invoice = item.get("descrizione", "") if isinstance(item, dict) else ""
             product_key = f"{cod}.{v}"
             try:
-                cur = self.cursor()
-                cur.execute(
-                    "SELECT ps.bought_last_24, ps.bought_sets, ps.stock, ps.last_update_bought, ps.verified, p.descrizione, p.rapp "
-                    "FROM product_stats ps "
-                    "JOIN products p ON p.cod = ps.cod AND p.v = ps.v "
-                    "WHERE ps.cod=%s AND ps.v=%s",
-                    (cod, v)
-                )
-                row = cur.fetchone()
+                row = rows.get((int(cod), int(v)))
                 if not row:
                     logger.debug(f"apply_invoice_deliveries: {product_key} not in DB")
                     not_found.append({"cod": cod, "v": v, "descrizione": descrizione_invoice})
@@ -608,26 +1479,64 @@ class DatabaseManager:
                     bought_array.insert(0, actual_qty)
                     bought_array = bought_array[:24]
 
-                bought_sets = row["bought_sets"] or []
-                if not bought_sets:
-                    bought_sets = [0]
-                bought_sets[0] = (bought_sets[0] or 0) + actual_qty
-
-                cur.execute(
-                    "UPDATE product_stats SET bought_last_24=%s, bought_sets=%s, stock=%s, last_update_bought=%s WHERE cod=%s AND v=%s",
-                    (Json(bought_array), Json(bought_sets), stock + actual_qty, today, cod, v)
-                )
-                self.conn.commit()
-                updated += 1
-                logger.info(f"apply_invoice_deliveries: {product_key} +{qty}×{rapp}={actual_qty} → stock={stock+actual_qty}")
+                running_day = row["last_update_sold"] or today
+                if table:
+                    day_key = (row["cod"], row["v"], running_day)
+                    day_rows[day_key] = day_rows.get(day_key, 0) + actual_qty
+                    bought_sets = None
+                else:
+                    bought_sets = row["bought_sets"] or []
+                    if not bought_sets:
+                        bought_sets = [0]
+                    bought_sets[0] = (bought_sets[0] or 0) + actual_qty
+                    bought_sets = Json(bought_sets)
 
-                if not verified:
-                    unverified_products.append({"cod": cod, "v": v, "descrizione": descrizione, "qty": actual_qty})
+                stat_updates.append((cod, v, Json(bought_array), bought_sets, actual_qty, today, running_day))
+                pending.append((cod, v, product_key, qty, rapp, actual_qty, stock, verified, descrizione))
 
             except Exception as e:
                 logger.error(f"apply_invoice_deliveries: failed for {product_key}: {e}")
                 errors.append({"cod": cod, "v": v, "error": str(e)})
 
+        new_stock = {}
+        if stat_updates:
+            try:
+                if table:
+                    history = "history_start = COALESCE(ps.history_start, d.running::date)"
+                else:
+                    history = "bought_sets = d.sets::jsonb"
+                with self.transaction() as cur:
+                    # Stock moves by the delivered quantity rather than being set from
+                    # the value read above, so a sale or loss booked in between survives
+                    booked = execute_values(cur, f"""
+                        UPDATE product_stats AS ps
+                        SET bought_last_24     = d.bought::jsonb,
+                            stock              = COALESCE(ps.stock, 0) + d.qty::int,
+                            last_update_bought = d.day::date,
+                            {history}
+                        FROM (VALUES %s) AS d(cod, var, bought, sets, qty, day, running)
+                        WHERE ps.cod = d.cod::int AND ps.v = d.var::int
+                        RETURNING ps.cod, ps.v, ps.stock
+                    """, stat_updates, page_size=1000, fetch=True)
+                    if day_rows:
+                        execute_values(cur, """
+                            INSERT INTO daily_sales AS ds (cod, v, day, bought) VALUES %s
+                            ON CONFLICT (cod, v, day) DO UPDATE SET bought = ds.bought + EXCLUDED.bought
+                        """, [k + (qty,) for k, qty in day_rows.items()], page_size=1000)
+                new_stock = {(r["cod"], r["v"]): r["stock"] for r in booked}
+            except Exception as e:
+                # All or nothing: nothing was booked, so every line is reported failed
+                logger.error(f"apply_invoice_deliveries: batch update failed, rolled back: {e}")
+                errors.extend({"cod": p[0], "v": p[1], "error": str(e)} for p in pending)
+                pending = []
+
+        for cod, v, product_key, qty, rapp, actual_qty, stock, verified, descrizione in pending:
+            updated += 1
+            stock = new_stock.get((int(cod), int(v)), stock + actual_qty)
+            logger.info(f"apply_invoice_deliveries: {product_key} +{qty}×{rapp}={actual_qty} → stock={stock}")
+            if not verified:
+                unverified_products.append({"cod": cod, "v": v, "descrizione": descrizione, "qty": actual_qty})
+
         logger.info(
             f"apply_invoice_deliveries: updated={updated} "
             f"not_found={len(not_found)} errors={len(errors)} "
@@ -689,12 +1598,105 @@ class DatabaseManager:
 
     # --- Losses ---
 
+    # --- EAN lookups ---
+    #
+    # Barcode scans and loss files resolve EANs far more often than EANs change, so
+    # each process keeps the schema's whole ean -> product map, loaded in one query.
+    # A hit never touches Postgres; a miss is re-checked against idx_products_ean
+    # (an EAN stored since the load, perhaps by another process) and remembered.
+    # Writers in this process call invalidate_ean_cache; EANs changed or removed by
+    # other processes are picked up when the map expires after EAN_CACHE_TTL seconds.
+    EAN_CACHE_TTL = float(os.environ.get('EAN_CACHE_TTL', 300))
+    _EAN_FIELDS = ("cod", "v", "settore", "descrizione", "pz_x_collo")
+    _ean_maps = {}                  # schema -> (loaded_at, {ean: product})
+    _ean_maps_lock = threading.Lock()
+
+    def _ean_map(self) -> dict:
+        with DatabaseManager._ean_maps_lock:
+            entry = DatabaseManager._ean_maps.get(self.schema)
+        if entry and time.monotonic() - entry[0] < self.EAN_CACHE_TTL:
+            return entry[1]
+
+        loaded_at = time.monotonic()
+        cur = self.cursor()
+        cur.execute("""
+            SELECT DISTINCT ON (ean) ean, cod, v, settore, descrizione, pz_x_collo
+            FROM products
+            WHERE ean IS NOT NULL
+            ORDER BY ean, cod, v
+        """)
+        ean_map = {row["ean"]: {k: row[k] for k in self._EAN_FIELDS} for row in cur.fetchall()}
+        with DatabaseManager._ean_maps_lock:
+            DatabaseManager._ean_maps[self.schema] = (loaded_at, ean_map)
+        logger.debug(f"[EAN CACHE] schema={self.schema} loaded {len(ean_map)} EANs")
+        return ean_map
+
+    def invalidate_ean_cache(self):
+        """Drop this process's EAN map for the schema; the next lookup reloads it."""
+        with DatabaseManager._ean_maps_lock:
+            DatabaseManager._ean_maps.pop(self.schema, None)
+
+    def lookup_eans(self, eans) -> dict:
+        """
+        {ean: {cod, v, settore, descrizione, pz_x_collo}} for the EANs that match a
+        product, keyed as passed in. Non-numeric EANs are skipped. Served from the
+        in-process map; whatever it misses is resolved in one query. The product
+        dicts are shared with the cache — copy before changing them.
+        """
+        wanted = {}
+        for ean in eans:
+            text = str(ean).strip()
+            if text.isdigit():
+                wanted.setdefault(int(text), []).append(ean)
+        if not wanted:
+            return {}
+
+        ean_map = self._ean_map()
+        found = {}
+        missing = []
+        for ean_int, keys in wanted.items():
+            product = ean_map.get(ean_int)
+            if product is None:
+                missing.append(ean_int)
+                continue
+            for ean in keys:
+                found[ean] = product
+
+        if missing:
+            cur = self.cursor()
+            cur.execute("""
+                SELECT DISTINCT ON (p.ean) p.ean, p.cod, p.v, p.settore, p.descrizione, p.pz_x_collo
+                FROM products p
+                JOIN unnest(%s::bigint[]) AS t(ean) ON p.ean = t.ean
+                ORDER BY p.ean, p.cod, p.v
+            """, (missing,))
+            for row in cur.fetchall():
+                product = {k: row[k] for k in self._EAN_FIELDS}
+                ean_map[row["ean"]] = product
+                for ean in wanted[row["ean"]]:
+                    found[ean] = product
+        return found
+
+    def set_product_ean(self, cod: int, v: int, ean):
+        """Store a product's EAN and drop the stale EAN map."""
+        cur = self.cursor()
+        cur.execute("UPDATE products SET ean = %s WHERE cod = %s AND v = %s", (ean, cod, v))
+        self.conn.commit()
+        self.invalidate_ean_cache()
+
     def get_cod_v_by_ean(self, ean: str):
         """Returns dict with cod, v, settore, descrizione for the given EAN, or None if not found."""
-        cur = self.cursor()
-        cur.execute("SELECT cod, v, settore, descrizione FROM products WHERE ean=%s", (ean,))
-        row = cur.fetchone()
-        return dict(row) if row else None
+        return self.get_cod_v_by_eans([ean]).get(ean)
+
+    def get_cod_v_by_eans(self, eans) -> dict:
+        """
+        Batch get_cod_v_by_ean: {ean: {cod, v, settore, descrizione}} for the EANs
+        that match a product, keyed as passed in.
+        """
+        return {
+            ean: {k: product[k] for k in ("cod", "v", "settore", "descrizione")}
+            for ean, product in self.lookup_eans(eans).items()
+        }
 
     def register_losses(self, cod: int, v: int, delta: int, type: str, spread_days: int = 1):
         """
@@ -707,146 +1709,221 @@ class DatabaseManager:
         rilevazione and the previous one, since a batch covers several days; callers
         correcting a single product leave it at 1.
         """
-        allowed = ("broken", "expired", "internal", "stolen", "shrinkage")
-        delta = int(delta)
-        if type not in allowed:
-            raise ValueError(f"Invalid type '{type}'. Allowed: {allowed}")
+        result = self.register_losses_bulk([(cod, v, delta)], type, spread_days=spread_days)[0]
+        if result["action"] in ("not_found", "invalid"):
+            raise ValueError(result["error"])
+        return result
 
-        cur = self.cursor()
+    def register_losses_bulk(self, items, type: str, spread_days: int = 1) -> list:
+        """
+        register_losses for a whole file at once: items is [(cod, v, delta), ...].
 
-        if type == "internal":
-            cur.execute("SELECT sales_sets FROM product_stats WHERE cod=%s AND v=%s", (cod, v))
-            ss_row = cur.fetchone()
-            if ss_row:
-                sales_sets = ss_row["sales_sets"] or []
-                # Start at slot 1: slot 0 is today and each sync rewrites it wholesale.
-                days = max(1, min(int(spread_days), self.LOSS_MAX_SPREAD_DAYS))
-                while len(sales_sets) < 1 + days:
-                    sales_sets.append(0)
-                base, rem = divmod(delta, days)
-                for i in range(days):
-                    # Remainder lands on the most recent days
-                    sales_sets[1 + i] += base + (1 if i < rem else 0)
-                cur.execute(
-                    "UPDATE product_stats SET sales_sets=%s WHERE cod=%s AND v=%s",
-                    (Json(sales_sets), cod, v)
-                )
+        One fetch for every product's stock, cost and loss array, the month-rollover
+        logic in memory, and one transaction writing extra_losses, stock and (for
+        internal) sales_sets or daily_sales. Returns one result per item, in order,
+        each shaped like register_losses' return value; products that register_losses
+        would reject come back as {"action": "not_found" | "invalid", "error": ...}.
 
-        cur.execute("SELECT 1 FROM products WHERE cod=%s AND v=%s", (cod, v))
-        if cur.fetchone() is None:
-            raise ValueError(f"Product {cod}.{v} not found in products table")
+        Items are applied in order, so a product listed twice accumulates exactly as
+        two register_losses calls would.
+        """
+        if type not in self.LOSS_TYPES:
+            raise ValueError(f"Invalid type '{type}'. Allowed: {self.LOSS_TYPES}")
+        items = [(int(cod), int(v), int(delta)) for cod, v, delta in items]
+        if not items:
+            return []
 
-        cur.execute("SELECT cost_std FROM economics WHERE cod=%s AND v=%s", (cod, v))
-        cost_row = cur.fetchone()
-        current_cost = float(cost_row['cost_std']) if cost_row and cost_row['cost_std'] else 0.0
+        keys = list(dict.fromkeys((cod, v) for cod, v, _ in items))
+        cur = self.cursor()
+        cur.execute(f"""
+            SELECT t.cod, t.v,
+                   ps.cod IS NOT NULL AS has_stats, ps.stock, ps.sales_sets, ps.verified,
+                   ps.last_update_sold,
+                   e.cost_std,
+                   el.cod IS NOT NULL AS has_losses, el.{type} AS losses, el.{type}_updated AS losses_updated
+            FROM unnest(%s::int[], %s::int[]) AS t(cod, v)
+            JOIN products p ON p.cod = t.cod AND p.v = t.v
+            LEFT JOIN product_stats ps ON ps.cod = t.cod AND ps.v = t.v
+            LEFT JOIN economics e ON e.cod = t.cod AND e.v = t.v
+            LEFT JOIN extra_losses el ON el.cod = t.cod AND el.v = t.v
+        """, ([k[0] for k in keys], [k[1] for k in keys]))
+        state = {(r["cod"], r["v"]): dict(r) for r in cur.fetchall()}
 
-        cur.execute(
-            f"SELECT {type}, {type}_updated FROM extra_losses WHERE cod=%s AND v=%s",
-            (cod, v)
-        )
-        row = cur.fetchone()
         today = date.today()
+        days = max(1, min(int(spread_days), self.LOSS_MAX_SPREAD_DAYS))
+        table = self.SALES_STORAGE == "table"
+        results = []
+        touched = []
+        store_deltas = {}  # slot -> qty, verified products only
+        day_rows = {}      # (cod, v, day) -> qty, "table" storage
+
+        for cod, v, delta in items:
+            st = state.get((cod, v))
+            if st is None:
+                results.append({"action": "not_found", "cod": cod, "v": v,
+                                "error": f"Product {cod}.{v} not found in products table"})
+                continue
 
-        if row is None:
-            cur.execute(
-                f"INSERT INTO extra_losses (cod, v, {type}, {type}_updated) VALUES (%s, %s, %s, %s)",
-                (cod, v, Json([[delta, current_cost]]), today)
-            )
-            self.conn.commit()
-            self.adjust_stock(cod, v, -delta)
-            return {"action": "new_entry", "cod": cod, "v": v, "delta": delta, "cost": current_cost}
-
-        existing_json = row[type]
-        existing_updated = row[f"{type}_updated"]
-
-        if not existing_json or existing_updated is None:
-            cur.execute(
-                f"UPDATE extra_losses SET {type}=%s, {type}_updated=%s WHERE cod=%s AND v=%s",
-                (Json([[delta, current_cost]]), today, cod, v)
-            )
-            self.conn.commit()
-            self.adjust_stock(cod, v, -delta)
-            return {"action": "initialized_null", "cod": cod, "v": v, "delta": delta, "cost": current_cost}
-
-        arr = existing_json
-        if not isinstance(arr, list):
-            raise ValueError(f"extra_losses.{type} for {cod}.{v} is not a JSON array")
-
-        if not isinstance(existing_updated, date):
-            raise ValueError(f"extra_losses.{type}_updated for {cod}.{v} has unexpected type")
-
-        months_passed = (today.year - existing_updated.year) * 12 + (today.month - existing_updated.month)
-
-        if months_passed == 0:
-            old_qty = arr[0][0] if arr and isinstance(arr[0], list) else arr[0]
-            arr[0] = [(arr[0][0] if isinstance(arr[0], list) else arr[0]) + delta, current_cost]
-            self.adjust_stock(cod, v, -int(delta))
-            cur.execute(
-                f"UPDATE extra_losses SET {type}=%s, {type}_updated=%s WHERE cod=%s AND v=%s",
-                (Json(arr[:24]), today, cod, v)
-            )
-            self.conn.commit()
-            return {"action": "same_month_update", "cod": cod, "v": v, "old_qty": old_qty, "change": delta, "cost": current_cost}
+            losses = st["losses"]
+            updated = st["losses_updated"]
+            if st["has_losses"] and losses and updated is not None:
+                if not isinstance(losses, list):
+                    results.append({"action": "invalid", "cod": cod, "v": v,
+                                    "error": f"extra_losses.{type} for {cod}.{v} is not a JSON array"})
+                    continue
+                if not isinstance(updated, date):
+                    results.append({"action": "invalid", "cod": cod, "v": v,
+                                    "error": f"extra_losses.{type}_updated for {cod}.{v} has unexpected type"})
+                    continue
 
-        # New month(s): convert old format entries, prepend zeros for skipped months
-        converted_arr = [
-            item if (isinstance(item, list) and len(item) == 2) else [item, current_cost]
-            for item in arr
+            if type == "internal" and st["has_stats"]:
+                sales_sets = st["sales_sets"] or []
+                running_day = st["last_update_sold"] or today
+                # Start at slot 1: slot 0 is today and each sync rewrites it wholesale.
+                while not table and len(sales_sets) < 1 + days:
+                    sales_sets.append(0)
+                base, rem = divmod(delta, days)
+                for i in range(days):
+                    # Remainder lands on the most recent days
+                    qty = base + (1 if i < rem else 0)
+                    if table:
+                        day_key = (cod, v, running_day - timedelta(days=1 + i))
+                        day_rows[day_key] = day_rows.get(day_key, 0) + qty
+                    else:
+                        sales_sets[1 + i] += qty
+                    if st["verified"]:
+                        store_deltas[1 + i] = store_deltas.get(1 + i, 0) + qty
+                st["sales_sets"] = sales_sets
+                # The history reaches back at least to the oldest day written
+                st["history_start"] = running_day - timedelta(days=days)
+
+            current_cost = float(st["cost_std"]) if st["cost_std"] else 0.0
+
+            if not st["has_losses"]:
+                st["losses"] = [[delta, current_cost]]
+                result = {"action": "new_entry", "cod": cod, "v": v, "delta": delta, "cost": current_cost}
+            elif not losses or updated is None:
+                st["losses"] = [[delta, current_cost]]
+                result = {"action": "initialized_null", "cod": cod, "v": v, "delta": delta, "cost": current_cost}
+            else:
+                months_passed = (today.year - updated.year) * 12 + (today.month - updated.month)
+                if months_passed == 0:
+                    old_qty = losses[0][0] if losses and isinstance(losses[0], list) else losses[0]
+                    losses[0] = [(losses[0][0] if isinstance(losses[0], list) else losses[0]) + delta, current_cost]
+                    st["losses"] = losses[:24]
+                    result = {"action": "same_month_update", "cod": cod, "v": v,
+                              "old_qty": old_qty, "change": delta, "cost": current_cost}
+                else:
+                    # New month(s): convert old format entries, prepend zeros for skipped months
+                    converted_arr = [
+                        item if (isinstance(item, list) and len(item) == 2) else [item, current_cost]
+                        for item in losses
+                    ]
+                    zeros = [[0, current_cost] for _ in range(max(0, months_passed - 1))]
+                    st["losses"] = ([[delta, current_cost]] + zeros + converted_arr)[:24]
+                    result = {"action": "months_passed_insert", "cod": cod, "v": v,
+                              "months_passed": months_passed, "new_arr_length": len(st["losses"]),
+                              "cost": current_cost}
+
+            st["has_losses"] = True
+            st["losses_updated"] = today
+            if st["has_stats"]:
+                st["stock_delta"] = st.get("stock_delta", 0) + delta
+            else:
+                logger.warning(f"No product_stats found for {cod}.{v}")
+            touched.append((cod, v))
+            results.append(result)
+
+        touched = list(dict.fromkeys(touched))
+        if not touched:
+            return results
+
+        loss_rows = [(cod, v, Json(state[(cod, v)]["losses"]), today) for cod, v in touched]
+        stat_rows = [
+            (cod, v, state[(cod, v)]["stock_delta"],
+             None if table else Json(state[(cod, v)]["sales_sets"]), state[(cod, v)].get("history_start"))
+            for cod, v in touched if state[(cod, v)]["has_stats"]
         ]
-        zeros = [[0, current_cost] for _ in range(max(0, months_passed - 1))]
-        new_arr = [[delta, current_cost]] + zeros + converted_arr
-        new_arr = new_arr[:24]
 
-        cur.execute(
-            f"UPDATE extra_losses SET {type}=%s, {type}_updated=%s WHERE cod=%s AND v=%s",
-            (Json(new_arr), today, cod, v)
-        )
-        self.conn.commit()
-        self.adjust_stock(cod, v, -delta)
-        return {
-            "action": "months_passed_insert",
-            "cod": cod,
-            "v": v,
-            "months_passed": months_passed,
-            "new_arr_length": len(new_arr),
-            "cost": current_cost,
-        }
+        with self.transaction() as cur:
+            execute_values(cur, f"""
+                INSERT INTO extra_losses (cod, v, {type}, {type}_updated)
+                VALUES %s
+                ON CONFLICT (cod, v) DO UPDATE SET
+                    {type} = EXCLUDED.{type},
+                    {type}_updated = EXCLUDED.{type}_updated
+            """, loss_rows, page_size=1000)
+
+            if stat_rows:
+                # Relative: a sync or delivery that lands between the fetch above
+                # and this write is kept, not overwritten with a stale stock
+                if type != "internal":
+                    sets_clause = ""
+                elif table:
+                    sets_clause = ", history_start = LEAST(ps.history_start, d.start::date)"
+                else:
+                    sets_clause = ", sales_sets = d.sets::jsonb"
+                execute_values(cur, f"""
+                    UPDATE product_stats AS ps
+                    SET stock = COALESCE(ps.stock, 0) - d.qty::int{sets_clause}
+                    FROM (VALUES %s) AS d(cod, var, qty, sets, start)
+                    WHERE ps.cod = d.cod::int AND ps.v = d.var::int
+                """, stat_rows, page_size=1000)
+
+            if day_rows:
+                execute_values(cur, """
+                    INSERT INTO daily_sales AS ds (cod, v, day, sold) VALUES %s
+                    ON CONFLICT (cod, v, day) DO UPDATE SET sold = COALESCE(ds.sold, 0) + EXCLUDED.sold
+                """, [k + (qty,) for k, qty in day_rows.items()], page_size=1000)
+
+            if type == "internal":
+                self._invalidate_product_features(cur, touched)
+                self._add_store_daily_totals(cur, store_deltas)
+
+        return results
 
     def prepend_monthly_loss_zeros(self):
         """
-        Prepend [0, 0] to every non-null loss array in extra_losses and update the
+        Prepend [0, 0] to every loss array in extra_losses and update the
         corresponding _updated date. Called on the 1st of every month at 00:30 via Celery Beat.
+
+        One UPDATE for all loss columns, like rollover_sold_last_24: each array
+        column gets its new month, the others are left as they are, and a failure
+        leaves every column untouched rather than some rolled and some not.
         """
-        cur = self.cursor()
         today = date.today()
-        loss_types = ['broken', 'expired', 'internal', 'stolen', 'shrinkage']
-        total_updated = 0
-
-        for loss_type in loss_types:
-            try:
-                cur.execute(f"SELECT cod, v, {loss_type} FROM extra_losses WHERE {loss_type} IS NOT NULL")
-                rows = cur.fetchall()
-
-                for row in rows:
-                    arr = row[loss_type]
-                    if not isinstance(arr, list):
-                        continue
-                    new_arr = [[0, 0]] + arr
-                    new_arr = new_arr[:24]
-                    cur.execute(
-                        f"UPDATE extra_losses SET {loss_type}=%s, {loss_type}_updated=%s WHERE cod=%s AND v=%s",
-                        (Json(new_arr), today, row['cod'], row['v'])
-                    )
-
-                total_updated += len(rows)
-                self.conn.commit()
-                logger.info(f"Prepended monthly zero for {loss_type}: {len(rows)} rows")
-
-            except Exception as e:
-                logger.warning(f"Could not prepend zeros for {loss_type}: {e}")
-                continue
+        is_array = {t: f"COALESCE(jsonb_typeof(el.{t}) = 'array', FALSE)" for t in self.LOSS_TYPES}
+        # old.<type> says whether that column rolls; RETURNING only sees new values
+        rolled = ", ".join(f"{is_array[t]} AS {t}" for t in self.LOSS_TYPES)
+        assignments = ",\n".join(
+            f"""{t} = CASE WHEN old.{t} THEN jsonb_build_array(jsonb_build_array(0, 0)) || COALESCE(
+                        jsonb_path_query_array(e.{t}, '$[0 to 22]'), '[]'::jsonb) ELSE e.{t} END,
+                    {t}_updated = CASE WHEN old.{t} THEN %(today)s ELSE e.{t}_updated END"""
+            for t in self.LOSS_TYPES
+        )
+        counts = ", ".join(f"COUNT(*) FILTER (WHERE o.{t}) AS {t}" for t in self.LOSS_TYPES)
+
+        with self.transaction() as cur:
+            cur.execute(f"""
+                WITH old AS (
+                    SELECT el.cod, el.v, {rolled}
+                    FROM extra_losses el
+                    WHERE {" OR ".join(is_array.values())}
+                ),
+                upd AS (
+                    UPDATE extra_losses AS e
+                    SET {assignments}
+                    FROM old
+                    WHERE e.cod = old.cod AND e.v = old.v
+                    RETURNING old.*
+                )
+                SELECT {counts} FROM upd AS o
+            """, {"today": today})
+            row = cur.fetchone()
 
-        return total_updated
+        for loss_type in self.LOSS_TYPES:
+            logger.info(f"Prepended monthly zero for {loss_type}: {row[loss_type]} rows")
+        return sum(row[t] for t in self.LOSS_TYPES)
 
     # --- Catalogue Updates ---
 
@@ -874,89 +1951,160 @@ class DatabaseManager:
         df[V_COLS]   = df[V_COLS].fillna(0).astype(int)
         df = df.drop_duplicates(subset=[COD_COLS, V_COLS], keep="first")
 
-        prod_rows = []
-        econ_rows = []
-        for _, row in df.iterrows():
-            cod         = int(row[COD_COLS])
-            v           = int(row[V_COLS]) if not pd.isna(row[V_COLS]) else 0
-            descrizione = str(row[DESC_COLS]).strip() if DESC_COLS in df.columns else ""
-            pz_x_collo  = int(row[PZ_COLS]) if PZ_COLS in df.columns and not pd.isna(row[PZ_COLS]) else None
-            disponibilita = str(row[DISP_COLS]).strip() if DISP_COLS in df.columns else "Si"
-            cost        = float(row[COST_COLS]) if COST_COLS in df.columns else None
-            price       = float(row[PRICE_COLS]) if PRICE_COLS in df.columns else None
-            category    = str(row[REP_COLS]).strip() if REP_COLS in df.columns else ""
-
-            rapp = None
-            if RAPP_COLS in df.columns and not pd.isna(row[RAPP_COLS]):
-                val = row[RAPP_COLS]
-                try:
-                    num = float(val)
-                    if not num.is_integer():
-                        print(f"Warning: float value {val} in RAPP_COLS for code {cod}. Skipping.")
-                        continue
-                    rapp = int(num)
-                except ValueError:
-                    print(f"Warning: invalid RAPP_COLS value '{val}' for code {cod}. Skipping.")
-                    continue
+        _SKIP = object()
 
-            prod_rows.append((cod, v, descrizione, rapp, pz_x_collo, settore, disponibilita))
-            econ_rows.append((cod, v, price, cost, None, None, None, None, category))
+        def _column(name, convert, default):
+            if name not in df.columns:
+                return [default] * len(df)
+            return [convert(x) for x in df[name]]
 
-        cur = self.cursor()
-        cur.executemany("""
-            INSERT INTO products (cod, v, descrizione, rapp, pz_x_collo, settore, disponibilita)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT(cod, v) DO UPDATE SET
-                descrizione   = excluded.descrizione,
-                rapp          = excluded.rapp,
-                pz_x_collo    = excluded.pz_x_collo,
-                disponibilita = excluded.disponibilita,
-                first_added_at = CASE
-                    WHEN products.disponibilita = 'No' AND excluded.disponibilita = 'Si'
-                    THEN CURRENT_DATE
-                    ELSE products.first_added_at
-                END
-        """, prod_rows)
+        def _rapp(cod, val):
+            if pd.isna(val):
+                return None
+            try:
+                num = float(val)
+            except ValueError:
+                print(f"Warning: invalid RAPP_COLS value '{val}' for code {cod}. Skipping.")
+                return _SKIP
+            if not num.is_integer():
+                print(f"Warning: float value {val} in RAPP_COLS for code {cod}. Skipping.")
+                return _SKIP
+            return int(num)
+
+        cods = df[COD_COLS].tolist()
+        rapps = (
+            [_rapp(cod, val) for cod, val in zip(cods, df[RAPP_COLS])]
+            if RAPP_COLS in df.columns else [None] * len(df)
+        )
+        columns = zip(
+            cods,
+            df[V_COLS].tolist(),
+            _column(DESC_COLS, lambda x: str(x).strip(), ""),
+            rapps,
+            _column(PZ_COLS, lambda x: None if pd.isna(x) else int(x), None),
+            _column(DISP_COLS, lambda x: str(x).strip(), "Si"),
+            _column(PRICE_COLS, float, None),
+            _column(COST_COLS, float, None),
+            _column(REP_COLS, lambda x: str(x).strip(), ""),
+        )
+        records = (r for r in columns if r[3] is not _SKIP)
 
-        cur.executemany("""
-            INSERT INTO economics
-                (cod, v, price_std, cost_std, price_s, cost_s, sale_start, sale_end, category)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT(cod, v) DO UPDATE SET
-                price_std = CASE
-                    WHEN economics.sale_start IS NOT NULL
-                     AND economics.sale_end   IS NOT NULL
-                     AND CURRENT_DATE <= economics.sale_end
-                    THEN economics.price_std
-                    ELSE excluded.price_std
-                END,
-                cost_std = CASE
-                    WHEN economics.sale_start IS NOT NULL
-                     AND economics.sale_end   IS NOT NULL
-                     AND CURRENT_DATE <= economics.sale_end
-                    THEN economics.cost_std
-                    ELSE excluded.cost_std
-                END,
-                category = excluded.category
-        """, econ_rows)
+        imported, absent_count = self.import_catalogue(records, settore)
+
+        print(f"Imported {imported} products into settore '{settore}'.")
+        if absent_count:
+            print(f"Marked {absent_count} products as unavailable (absent from new list) in settore '{settore}'.")
 
-        # Products absent from today's list are no longer available from the supplier.
-        absent_count = 0
-        if prod_rows:
-            imported_keys = tuple((row[0], row[1]) for row in prod_rows)
+    # Spooled records stay in memory up to this size, then go to a temp file
+    CATALOGUE_SPOOL_BYTES = 8 * 1024 * 1024
+
+    @staticmethod
+    def _copy_text(value):
+        """One field in COPY's text format."""
+        if value is None:
+            return "\\N"
+        return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+                .replace("\n", "\\n").replace("\r", "\\r"))
+
+    def import_catalogue(self, records, settore: str):
+        """
+        Set-based listino import. records is any iterable of
+        (cod, v, descrizione, rapp, pz_x_collo, disponibilita, price_std, cost_std, category)
+        — consumed lazily into a spool file in COPY format, so a generator over a
+        download never has to be held whole. The spool is filled before the
+        transaction opens: a generator that downloads as it goes would otherwise hold
+        the transaction (and the rows it has locked) open for the whole download.
+
+        Then three statements: upsert products, upsert economics (promo prices kept
+        while a sale runs) and mark every product of the settore missing from the
+        list as disponibilita='No'. A key listed twice keeps its first occurrence.
+        Returns (imported, marked_unavailable).
+        """
+        with tempfile.SpooledTemporaryFile(
+            max_size=self.CATALOGUE_SPOOL_BYTES, mode="w+", encoding="utf-8"
+        ) as spool:
+            staged = 0
+            for record in records:
+                spool.write("\t".join(self._copy_text(x) for x in record) + "\n")
+                staged += 1
+            if not staged:
+                return 0, 0
+            spool.seek(0)
+            return self._import_catalogue_spool(spool, settore)
+
+    def _import_catalogue_spool(self, spool, settore: str):
+        """The import_catalogue transaction, staging from a file of COPY text rows."""
+        with self.transaction() as cur:
             cur.execute("""
-                UPDATE products
+                CREATE TEMP TABLE catalogue_stage (
+                    seq BIGSERIAL,
+                    cod INTEGER, v INTEGER, descrizione TEXT, rapp INTEGER, pz_x_collo INTEGER,
+                    disponibilita TEXT, price_std FLOAT, cost_std FLOAT, category TEXT
+                ) ON COMMIT DROP
+            """)
+            cur.copy_expert("""
+                COPY catalogue_stage
+                    (cod, v, descrizione, rapp, pz_x_collo, disponibilita, price_std, cost_std, category)
+                FROM STDIN
+            """, spool)
+
+            first = "(SELECT DISTINCT ON (cod, v) * FROM catalogue_stage ORDER BY cod, v, seq) AS s"
+
+            cur.execute(f"""
+                INSERT INTO products (cod, v, descrizione, rapp, pz_x_collo, settore, disponibilita)
+                SELECT cod, v, descrizione, rapp, pz_x_collo, %s, disponibilita
+                FROM {first}
+                ON CONFLICT(cod, v) DO UPDATE SET
+                    descrizione   = excluded.descrizione,
+                    rapp          = excluded.rapp,
+                    pz_x_collo    = excluded.pz_x_collo,
+                    disponibilita = excluded.disponibilita,
+                    first_added_at = CASE
+                        WHEN products.disponibilita = 'No' AND excluded.disponibilita = 'Si'
+                        THEN CURRENT_DATE
+                        ELSE products.first_added_at
+                    END
+            """, (settore,))
+            imported = cur.rowcount
+
+            cur.execute(f"""
+                INSERT INTO economics
+                    (cod, v, price_std, cost_std, price_s, cost_s, sale_start, sale_end, category)
+                SELECT cod, v, price_std, cost_std, NULL, NULL, NULL, NULL, category
+                FROM {first}
+                ON CONFLICT(cod, v) DO UPDATE SET
+                    price_std = CASE
+                        WHEN economics.sale_start IS NOT NULL
+                         AND economics.sale_end   IS NOT NULL
+                         AND CURRENT_DATE <= economics.sale_end
+                        THEN economics.price_std
+                        ELSE excluded.price_std
+                    END,
+                    cost_std = CASE
+                        WHEN economics.sale_start IS NOT NULL
+                         AND economics.sale_end   IS NOT NULL
+                         AND CURRENT_DATE <= economics.sale_end
+                        THEN economics.cost_std
+                        ELSE excluded.cost_std
+                    END,
+                    category = excluded.category
+            """)
+
+            # Products absent from today's list are no longer available from the supplier.
+            cur.execute("""
+                UPDATE products p
                 SET disponibilita = 'No'
-                WHERE settore = %s
-                  AND (cod, v) NOT IN %s
-                  AND disponibilita != 'No'
-            """, (settore, imported_keys))
+                WHERE p.settore = %s
+                  AND p.disponibilita != 'No'
+                  AND NOT EXISTS (
+                      SELECT 1 FROM catalogue_stage s WHERE s.cod = p.cod AND s.v = p.v
+                  )
+            """, (settore,))
             absent_count = cur.rowcount
 
-        self.conn.commit()
-        print(f"Imported {len(prod_rows)} products into settore '{settore}'.")
-        if absent_count:
-            print(f"Marked {absent_count} products as unavailable (absent from new list) in settore '{settore}'.")
+        # Descriptions and settori of EAN-bearing products may have changed
+        self.invalidate_ean_cache()
+        return imported, absent_count
 
     def update_promos(self, promo_list):
         """
@@ -1037,24 +2185,65 @@ class DatabaseManager:
         The products row and extra_losses are kept: losses are permanent economic records
         that fade naturally over time via prepend_monthly_loss_zeros.
         """
-        cur = self.cursor()
-        deleted_from = []
+        return self.purge_products([(cod, v)])[0]
 
-        for table in ('product_stats', 'economics'):
-            cur.execute(f"DELETE FROM {table} WHERE cod=%s AND v=%s", (cod, v))
-            if cur.rowcount > 0:
-                deleted_from.append(table)
-
-        cur.execute("UPDATE products SET purge_flag=FALSE WHERE cod=%s AND v=%s", (cod, v))
-        self.conn.commit()
+    def purge_products(self, keys) -> list:
+        """
+        purge_product for many (cod, v) at once: one statement per table, one
+        transaction. Returns purge_product's result dict for each distinct key, in
+        the order given.
+        """
+        keys = list(dict.fromkeys((int(c), int(v)) for c, v in keys))
+        if not keys:
+            return []
+        cods, vs = [k[0] for k in keys], [k[1] for k in keys]
 
-        return {
-            'action': 'purged',
-            'cod': cod,
-            'v': v,
-            'deleted_from': deleted_from,
-            'message': f'Product {cod}.{v} data cleared from: {", ".join(deleted_from)}'
-        }
+        with self.transaction() as cur:
+            cur.execute("""
+                DELETE FROM product_stats ps
+                USING unnest(%s::int[], %s::int[]) AS t(cod, v)
+                WHERE ps.cod = t.cod AND ps.v = t.v
+                RETURNING ps.cod, ps.v, ps.verified
+            """, (cods, vs))
+            stats_deleted = cur.fetchall()
+            cur.execute("""
+                DELETE FROM economics e
+                USING unnest(%s::int[], %s::int[]) AS t(cod, v)
+                WHERE e.cod = t.cod AND e.v = t.v
+                RETURNING e.cod, e.v
+            """, (cods, vs))
+            economics_deleted = {(r["cod"], r["v"]) for r in cur.fetchall()}
+            if self.SALES_STORAGE == "table":
+                cur.execute("""
+                    DELETE FROM daily_sales d
+                    USING unnest(%s::int[], %s::int[]) AS t(cod, v)
+                    WHERE d.cod = t.cod AND d.v = t.v
+                """, (cods, vs))
+            self._invalidate_product_features(cur, keys)
+            cur.execute("""
+                UPDATE products p
+                SET purge_flag = FALSE
+                FROM unnest(%s::int[], %s::int[]) AS t(cod, v)
+                WHERE p.cod = t.cod AND p.v = t.v
+            """, (cods, vs))
+            if any(r["verified"] for r in stats_deleted):
+                self._invalidate_store_daily_totals(cur)
+
+        stats_keys = {(r["cod"], r["v"]) for r in stats_deleted}
+        results = []
+        for cod, v in keys:
+            deleted_from = [
+                table for table, done in (('product_stats', stats_keys), ('economics', economics_deleted))
+                if (cod, v) in done
+            ]
+            results.append({
+                'action': 'purged',
+                'cod': cod,
+                'v': v,
+                'deleted_from': deleted_from,
+                'message': f'Product {cod}.{v} data cleared from: {", ".join(deleted_from)}'
+            })
+        return results
 
     def check_and_purge_flagged(self):
         """Purge all flagged products whose stock has reached (or dropped below) 0."""
@@ -1065,7 +2254,7 @@ class DatabaseManager:
             JOIN product_stats ps ON p.cod = ps.cod AND p.v = ps.v
             WHERE p.purge_flag = TRUE AND ps.stock <= 0
         """)
-        return [self.purge_product(row['cod'], row['v']) for row in cur.fetchall()]
+        return self.purge_products([(row['cod'], row['v']) for row in cur.fetchall()])
 
     def purge_obsolete_products(self):
         """
@@ -1085,4 +2274,4 @@ class DatabaseManager:
               AND p.disponibilita = 'No'
               AND ps.stock <= 0
         """)
-        return [self.purge_product(row['cod'], row['v']) for row in cur.fetchall()]
+        return self.purge_products([(row['cod'], row['v']) for row in cur.fetchall()])
@@ -167,16 +167,17 @@ def main():
     # A promo whose window overlaps the sales_sets history inflates that product's
     # variance. Only promos ended within 14 days are excised by the ordering path,
     # so anything older is still sitting in the data being counted as volatility.
-    query = """
-        SELECT ps.cod, ps.v, p.descrizione, p.settore, ps.sales_sets,
+    query = f"""
+        SELECT ps.cod, ps.v, p.descrizione, p.settore, h.sales_sets,
                (e.sale_start IS NOT NULL
                 AND e.sale_end >= CURRENT_DATE - 60
                 AND e.sale_start <= CURRENT_DATE) AS promo_in_window
         FROM product_stats ps
         JOIN products p ON p.cod = ps.cod AND p.v = ps.v
+        CROSS JOIN LATERAL (SELECT {db.sales_sets_sql("ps")} AS sales_sets) h
         LEFT JOIN economics e ON e.cod = ps.cod AND e.v = ps.v
         WHERE ps.verified = TRUE
-          AND ps.sales_sets IS NOT NULL
+          AND h.sales_sets IS NOT NULL
     """
     params = []
     if args.settore:
@@ -333,7 +334,7 @@ def main():
         print("  variance equals the mean. This is the case where z*sigma is worth building.")
     print()
 
-    db.conn.close()
+    db.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,211 @@
+# LamApp/supermarkets/scripts/batch_stats.py
+"""
+Matrix versions of the per-product demand statistics in Helper, for
+DecisionMaker's batch mode.
+
+One row per product, one column per sales_sets slot (newest first), None stored
+as NaN and short rows padded with NaN on the right. Every function returns,
+value for value, what its Helper counterpart returns on the same row — the
+batch path must produce the very same order list, so the float arithmetic is
+arranged to round identically, not merely "close enough":
+
+- Sales counts are small integers (or halves, once a median has been used as a
+  winsorizing cap), so sums and sums of squares of them are exact in float64 in
+  any order. Means and variances are built from those exact sums with a single
+  division, which is exactly what `statistics` returns (it computes with
+  Fractions and rounds once).
+- Sums of non-integer terms go the way the Helper sums them: the exponential
+  weights through np.cumsum, which accumulates strictly left to right like its
+  `+=` loop, the squared residuals through the builtin sum(), which since Python
+  3.12 is compensated and no longer equals a left-to-right sum.
+- exp() and x ** 0.5 are taken from the Python math library, not numpy: the two
+  libraries disagree in the last bit on a fraction of inputs.
+"""
+import math
+from datetime import datetime
+
+import numpy as np
+
+from .helpers import Helper
+
+
+def sales_matrix(series_list, width=None):
+    """Stack newest-first sales lists into a float matrix, None -> NaN."""
+    if width is None:
+        width = max((len(s) for s in series_list), default=0)
+    matrix = np.full((len(series_list), width), np.nan)
+    for r, series in enumerate(series_list):
+        for c, v in enumerate(series[:width]):
+            if v is not None:
+                matrix[r, c] = v
+    return matrix
+
+
+def _compact_left(matrix):
+    """Move each row's observed values to the front, keeping their order."""
+    order = np.argsort(np.isnan(matrix), axis=1, kind="stable")
+    return np.take_along_axis(matrix, order, axis=1)
+
+
+def _row_median(sorted_vals, counts):
+    """statistics.median of each row of an ascending, NaN-last matrix."""
+    rows = np.arange(sorted_vals.shape[0])
+    lo_idx = np.maximum((counts - 1) // 2, 0)
+    hi_idx = np.maximum(counts // 2, 0)
+    if sorted_vals.shape[1] == 0:
+        return np.full(len(counts), np.nan)
+    lo = sorted_vals[rows, np.minimum(lo_idx, sorted_vals.shape[1] - 1)]
+    hi = sorted_vals[rows, np.minimum(hi_idx, sorted_vals.shape[1] - 1)]
+    return np.where(counts % 2 == 1, hi, (lo + hi) / 2)
+
+
+def winsorize_matrix(matrix):
+    """Row-wise Helper.winsorize_series. Returns a new matrix."""
+    out = matrix.copy()
+    if matrix.size == 0:
+        return out
+
+    observed = ~np.isnan(matrix)
+    counts = observed.sum(axis=1)
+    eligible = counts >= Helper.OUTLIER_MIN_DAYS
+    if not eligible.any():
+        return out
+
+    median = _row_median(np.sort(matrix, axis=1), counts)
+    abs_dev = np.abs(matrix - median[:, None])
+    mad = _row_median(np.sort(abs_dev, axis=1), counts)
+    threshold = median + Helper.OUTLIER_K * (1.4826 * mad)
+
+    # Share of the row's observed days at or above each value (NaN compares False)
+    at_or_above = (matrix[:, None, :] >= matrix[:, :, None]).sum(axis=2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share = at_or_above / counts[:, None]
+
+    spikes = (
+        observed
+        & eligible[:, None]
+        & (matrix >= Helper.OUTLIER_MIN_ABS)
+        & (matrix > threshold[:, None])
+        & (share <= Helper.OUTLIER_RECUR_FRAC)
+    )
+    rows = spikes.any(axis=1)
+    if not rows.any():
+        return out
+
+    kept = np.where(observed & ~spikes, matrix, -np.inf).max(axis=1)
+    safe_max = np.where(np.isneginf(kept), median, kept)
+    out[spikes] = np.broadcast_to(safe_max[:, None], matrix.shape)[spikes]
+    return out
+
+
+def avg_daily_sales_batch(winsorized, min_days=14, half_life=14):
+    """
+    Row-wise Helper.avg_daily_sales_from_sales_sets on an already winsorized
+    matrix. NaN where the scalar version returns None.
+    """
+    n_rows, width = winsorized.shape
+    result = np.full(n_rows, np.nan)
+    if width == 0:
+        return result
+
+    counts = (~np.isnan(winsorized)).sum(axis=1)
+    compact = _compact_left(winsorized)
+
+    lam = math.log(2) / half_life
+    weights = np.array([math.exp(-lam * age) for age in range(width)])
+
+    terms = np.nan_to_num(compact * weights, nan=0.0)
+    weighted_sum = np.cumsum(terms, axis=1)[:, -1]
+    weight_total = np.cumsum(weights)
+
+    ok = counts >= min_days
+    result[ok] = weighted_sum[ok] / weight_total[counts[ok] - 1]
+    return result
+
+
+def _exact_variance(total, total_sq, n):
+    """statistics.variance from exact sums: one rounding, like the Fraction path."""
+    return (n * total_sq - total * total) / (n * (n - 1))
+
+
+def deviation_batch(winsorized, recent_window=14, min_baseline=14, z_min=1.5):
+    """Row-wise Helper.calculate_deviation on an already winsorized matrix."""
+    n_rows, width = winsorized.shape
+    deviations = [0] * n_rows
+    if width < recent_window + min_baseline:
+        return deviations
+
+    counts = (~np.isnan(winsorized)).sum(axis=1)
+    compact = np.nan_to_num(_compact_left(winsorized), nan=0.0)
+    base_len = ((counts - recent_window) // 7) * 7
+    ok = counts >= recent_window + min_baseline
+
+    recent = compact[:, :recent_window]
+    cols = np.arange(width - recent_window)
+    baseline = np.where(cols < base_len[:, None], compact[:, recent_window:], 0.0)
+
+    sum_r, sum_b = recent.sum(axis=1), baseline.sum(axis=1)
+    sq_r, sq_b = (recent * recent).sum(axis=1), (baseline * baseline).sum(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_r = sum_r / recent_window
+        mean_b = sum_b / base_len
+        se_welch = np.sqrt(
+            _exact_variance(sum_r, sq_r, recent_window) / recent_window
+            + _exact_variance(sum_b, sq_b, base_len) / base_len
+        )
+        pooled_rate = (sum_r + sum_b) / (recent_window + base_len)
+        se_poisson = np.sqrt(pooled_rate * (1 / recent_window + 1 / base_len))
+        se = np.maximum(se_welch, se_poisson)
+        z = (mean_r - mean_b) / se
+
+    live = ok & (mean_b > 0) & (se > 0) & ~(np.abs(z) < z_min)
+    for r in np.flatnonzero(live):
+        # Python's round(), not numpy's: they differ on values like x.xx5
+        recent_mean, baseline_mean = float(mean_r[r]), float(mean_b[r])
+        deviation = round((recent_mean - baseline_mean) / baseline_mean * 100, 2)
+        deviations[r] = max(-50, min(deviation, 50))
+    return deviations
+
+
+def demand_sigma_batch(winsorized, closure_mask=None, today=None):
+    """Row-wise Helper.demand_sigma_daily on an already winsorized matrix."""
+    n_rows, width = winsorized.shape
+    sigmas = [None] * n_rows
+    if width == 0:
+        return sigmas
+
+    observed = ~np.isnan(winsorized)
+    if closure_mask:
+        closed = np.zeros(width, dtype=bool)
+        span = min(width, len(closure_mask))
+        closed[:span] = np.asarray(closure_mask[:span], dtype=bool)
+        observed &= ~closed
+
+    base_dow = (today or datetime.now().date()).weekday()
+    dow = (base_dow - 1 - np.arange(width)) % 7
+    values = np.where(observed, winsorized, 0.0)
+
+    # One (rows x 7) pass for the per-weekday counts and sums
+    dow_onehot = dow[:, None] == np.arange(7)[None, :]
+    dow_counts = observed.astype(np.int64) @ dow_onehot.astype(np.int64)
+    dow_sums = values @ dow_onehot.astype(float)
+
+    grouped = dow_counts >= 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dow_means = np.where(grouped, dow_sums / dow_counts, 0.0)
+
+    in_group = observed & grouped[:, dow]
+    residuals = np.where(in_group, values - dow_means[:, dow], 0.0)
+    squares = residuals * residuals
+
+    n_observed = observed.sum(axis=1)
+    n_residuals = in_group.sum(axis=1)
+    dof = n_residuals - grouped.sum(axis=1)
+
+    ok = (n_observed >= Helper.SIGMA_MIN_DAYS) & (dof > 0) & (n_residuals >= Helper.SIGMA_MIN_DAYS)
+    for r in np.flatnonzero(ok):
+        # Builtin sum(), as in the Helper: it is compensated since Python 3.12
+        sum_sq = sum(squares[r, in_group[r]].tolist())
+        sigmas[r] = (sum_sq / int(dof[r])) ** 0.5
+    return sigmas
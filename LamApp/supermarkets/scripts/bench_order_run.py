@@ -0,0 +1,320 @@
+# LamApp/supermarkets/scripts/bench_order_run.py
+"""
+Database-side cost of a store's day, on the synthetic supermarkets of
+synthetic_dataset.py: needs PostgreSQL (PG_* as for the app) but no Dropzone.
+
+Stages, timed per supermarket and per run:
+  day-roll     roll_sales_day for today. Before each run (not timed) the schema is put
+               back to its state before the first run, dated as rolled through
+               yesterday, so every run rolls every product over the same histories.
+               Without this stage the roll still runs, untimed
+  sync         apply_realtime_sales, --syncs payloads of running totals in which
+               --sync-share of the products have sold something since the previous one
+  orders       DecisionMaker + decide_orders_for_settore(batch=True) per storage, as
+               run_full_restock_workflow does, with the manifest's product links.
+               The roll just invalidated every cached feature, so this is the cold
+               run of the day
+  calibration  compute_calibration_for_storage per storage, reading back the features
+               the order run stored. Needs Django settings (DJANGO_SETTINGS_MODULE,
+               default LamApp.settings); skipped with a warning when they don't load
+
+Reported per stage: samples, p50/p95/worst wall time, rows per sample and rows/s
+at p50. Rows are products rolled, payload lines, or products in the settore.
+Runs write to the bench_sm_* schemas only.
+
+Usage (from LamApp/):
+    python -m supermarkets.scripts.bench_order_run --generate --supermarkets 3 --products 6000
+    python -m supermarkets.scripts.bench_order_run --runs 10 --json bench.json
+    python -m supermarkets.scripts.bench_order_run --stages orders calibration --scalar
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+from . import synthetic_dataset
+from .DatabaseManager import DatabaseManager
+from .decision_maker import DecisionMaker
+from .helpers import Helper
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("day-roll", "sync", "orders", "calibration")
+
+
+def rewind_day(name, today):
+    """
+    Make the schema look rolled through yesterday, so today's roll has work to do.
+
+    The first call snapshots what a run changes (the daily history, stock, the store
+    totals) into bench_* tables of the schema; every call restores them, slot 0
+    becoming yesterday. Without it each run would shift the histories one more day
+    and sync the stock a little lower, and no two runs would measure the same store.
+    A snapshot holds one SALES_STORAGE: after a switch it is retaken from the
+    converted schema.
+    """
+    yesterday = today - timedelta(days=1)
+    db = DatabaseManager(name)
+    try:
+        cur = db.cursor()
+        cur.execute("SELECT to_regclass('bench_snapshot_storage') IS NOT NULL AS present")
+        taken = None
+        if cur.fetchone()["present"]:
+            cur.execute("SELECT storage FROM bench_snapshot_storage")
+            taken = cur.fetchone()["storage"]
+        if taken != db.SALES_STORAGE:
+            db.get_store_daily_totals()     # fill store_daily_totals, so it is snapshotted too
+            with db.transaction() as tx:
+                tx.execute("""
+                    DROP TABLE IF EXISTS bench_stats_snapshot, bench_totals_snapshot,
+                                         bench_daily_snapshot, bench_snapshot_storage
+                """)
+                tx.execute("""
+                    CREATE TABLE bench_stats_snapshot AS
+                    SELECT cod, v, sales_sets, bought_sets, history_start, sold_last_24, stock
+                    FROM product_stats
+                """)
+                tx.execute("CREATE TABLE bench_totals_snapshot AS SELECT day, total FROM store_daily_totals")
+                tx.execute("CREATE TABLE bench_daily_snapshot AS SELECT * FROM daily_sales")
+                tx.execute("CREATE TABLE bench_snapshot_storage AS SELECT %s::text AS storage",
+                           (db.SALES_STORAGE,))
+
+        with db.transaction() as tx:
+            # The snapshot's newest day is its slot 0, which is now yesterday
+            tx.execute("SELECT %s::date - MAX(day) AS shift FROM bench_totals_snapshot", (yesterday,))
+            shift = tx.fetchone()["shift"] or 0
+            tx.execute("""
+                UPDATE product_stats AS ps
+                SET sales_sets = s.sales_sets, bought_sets = s.bought_sets,
+                    history_start = s.history_start + %s,
+                    sold_last_24 = s.sold_last_24, stock = s.stock, last_update_sold = %s
+                FROM bench_stats_snapshot AS s
+                WHERE ps.cod = s.cod AND ps.v = s.v
+            """, (shift, yesterday))
+            tx.execute("UPDATE sales_roll_state SET rolled_through = %s", (yesterday,))
+            tx.execute("DELETE FROM daily_sales")
+            tx.execute("""
+                INSERT INTO daily_sales (cod, v, day, sold, bought)
+                SELECT cod, v, day + %s, sold, bought FROM bench_daily_snapshot
+            """, (shift,))
+            tx.execute("DELETE FROM store_daily_totals")
+            tx.execute("""
+                INSERT INTO store_daily_totals (day, total)
+                SELECT day + %s, total FROM bench_totals_snapshot
+            """, (shift,))
+        DatabaseManager._rolled_through.pop(db.schema, None)
+    finally:
+        db.close()
+
+
+def run_day_roll(name, today):
+    db = DatabaseManager(name)
+    try:
+        return db.roll_sales_day(today)
+    finally:
+        db.close()
+
+
+class SyncFeed:
+    """Running per-product totals for today, advanced like a till feed between syncs."""
+
+    def __init__(self, name, share, seed):
+        self.share = share
+        self.rng = random.Random(f"{seed}:{name}:sync")
+        db = DatabaseManager(name)
+        try:
+            cur = db.cursor()
+            cur.execute("SELECT cod, v FROM product_stats")
+            self.keys = [(r["cod"], r["v"]) for r in cur.fetchall()]
+        finally:
+            db.close()
+        self.totals = {}
+
+    def reset(self):
+        """The roll opened a fresh slot 0: nothing sold yet today."""
+        self.totals = {}
+
+    def next_payload(self):
+        for key in self.rng.sample(self.keys, int(len(self.keys) * self.share)):
+            self.totals[key] = self.totals.get(key, 0) + self.rng.randint(1, 3)
+        # A few codes the store sells that the catalogue doesn't know
+        unknown = [(999000 + i, 1, 1) for i in range(max(1, len(self.keys) // 200))]
+        return [(cod, v, sold) for (cod, v), sold in self.totals.items()] + unknown
+
+
+def run_sync(name, payload, today):
+    db = DatabaseManager(name)
+    try:
+        db.apply_realtime_sales(payload, today)
+    finally:
+        db.close()
+    return len(payload)
+
+
+def run_orders(name, storage, links, coverage, batch=True):
+    db = DatabaseManager(name)
+    decision_maker = DecisionMaker(
+        db, Helper(),
+        product_links=[(tuple(primary), tuple(secondary)) for primary, secondary in links],
+    )
+    try:
+        decision_maker.decide_orders_for_settore(
+            storage["settore"], coverage, storage["minimum_stock"], batch=batch
+        )
+    finally:
+        decision_maker.close()
+    return storage["products"]
+
+
+def calibration_runner():
+    """
+    A callable(name, storage, coverage) -> products evaluated that runs
+    compute_calibration_for_storage, or None when Django cannot be set up here.
+    """
+    try:
+        import django
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "LamApp.settings")
+        django.setup()
+        from ..automation_services import AutomatedRestockService
+        from ..models import Storage
+    except Exception as e:
+        logger.warning(f"Skipping calibration, Django is not available: {e}")
+        return None
+
+    def run(name, storage, coverage):
+        # Only storage.settore/minimum_stock, db and helper are read, so an unsaved
+        # Storage will do and no Supermarket rows are needed
+        service = AutomatedRestockService.__new__(AutomatedRestockService)
+        service.storage = Storage(settore=storage["settore"], minimum_stock=storage["minimum_stock"])
+        service.settore = storage["settore"]
+        service.helper = Helper()
+        service.db = DatabaseManager(name)
+        try:
+            return service.compute_calibration_for_storage(coverage_days=coverage)["products_evaluated"]
+        finally:
+            service.db.close()
+
+    return run
+
+
+def _timed(samples, stage, call):
+    started = time.perf_counter()
+    rows = call()
+    samples.setdefault(stage, []).append((time.perf_counter() - started, rows))
+
+
+def _percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples):
+    results = []
+    for stage, values in samples.items():
+        timings = [t for t, _ in values]
+        rows = statistics.median(r for _, r in values)
+        p50 = statistics.median(timings)
+        results.append({
+            "stage": stage,
+            "samples": len(values),
+            "p50_s": round(p50, 4),
+            "p95_s": round(_percentile(timings, 95), 4),
+            "max_s": round(max(timings), 4),
+            "rows": int(rows),
+            "rows_per_s": round(rows / p50, 1) if p50 else None,
+        })
+    return results
+
+
+def print_report(results):
+    columns = ("stage", "samples", "p50_s", "p95_s", "max_s", "rows", "rows_per_s")
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the day roll, sync, order run and calibration")
+    parser.add_argument("--manifest", default="bench_dataset.json",
+                        help="written by synthetic_dataset; generated first when missing")
+    parser.add_argument("--generate", action="store_true", help="(re)create the synthetic schemas first")
+    parser.add_argument("--supermarkets", type=int, default=3, help="with --generate")
+    parser.add_argument("--products", type=int, default=6000, help="per supermarket, with --generate")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--syncs", type=int, default=4, help="sync payloads per run")
+    parser.add_argument("--sync-share", type=float, default=0.2,
+                        help="share of products that sold between two syncs")
+    parser.add_argument("--coverage", type=float, default=3.0, help="days, for orders and calibration")
+    parser.add_argument("--scalar", action="store_true", help="also time the per-product (batch=False) order path")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+
+    if args.generate or not os.path.exists(args.manifest):
+        manifest = synthetic_dataset.generate(args.supermarkets, args.products, args.seed)
+        with open(args.manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+    else:
+        manifest = synthetic_dataset.load_manifest(args.manifest)
+
+    calibrate = calibration_runner() if "calibration" in args.stages else None
+    today = date.today()
+    feeds = {
+        sm["name"]: SyncFeed(sm["name"], args.sync_share, args.seed)
+        for sm in manifest["supermarkets"]
+    } if "sync" in args.stages else {}
+
+    samples = {}
+    failed = False
+    for run in range(args.runs):
+        for sm in manifest["supermarkets"]:
+            name = sm["name"]
+            try:
+                # Every run starts from the same store, timed roll or not
+                rewind_day(name, today)
+                if "day-roll" in args.stages:
+                    _timed(samples, "day-roll", lambda: run_day_roll(name, today))
+                else:
+                    run_day_roll(name, today)
+                if name in feeds:
+                    feeds[name].reset()
+                if name in feeds:
+                    for _ in range(args.syncs):
+                        payload = feeds[name].next_payload()
+                        _timed(samples, "sync", lambda: run_sync(name, payload, today))
+                for storage in sm["storages"]:
+                    if "orders" in args.stages:
+                        _timed(samples, "orders", lambda: run_orders(name, storage, sm["links"], args.coverage))
+                        if args.scalar:
+                            _timed(samples, "orders/scalar", lambda: run_orders(
+                                name, storage, sm["links"], args.coverage, batch=False))
+                    if calibrate is not None:
+                        _timed(samples, "calibration", lambda: calibrate(name, storage, args.coverage))
+            except Exception as e:
+                failed = True
+                logger.exception(f"Run {run} on {name} failed: {e}")
+
+    results = summarize(samples)
+    if results:
+        print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
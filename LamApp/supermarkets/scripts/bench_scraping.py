@@ -0,0 +1,189 @@
+# LamApp/supermarkets/scripts/bench_scraping.py
+"""
+End-to-end throughput of the HTTP scrapers against fake_dropzone: no network,
+no Chrome, no database — so it runs the same on a laptop and in CI. It does
+import the scrapers, so the app's requirements.txt must be installed.
+
+Scenarios, each on a fresh account (so every run pays its own HTTP login and
+connection setup, as a Celery task does):
+  list-update  login, then every Reparto page of a GENERI VARI listino through
+               iter_listino + listino_records (the import itself is not timed)
+  ddt-import   login, fetch_scorporo, fetch_all_righe at each --concurrency, process_righe
+  loss-export  the RilevazioniTestate/RilevazioniRighe calls export_all_testate_from_day
+               makes for --days days (its CSV and LossSyncState writes need Django)
+
+Reported per scenario: p50 and worst wall time, requests, rows, rows/s at p50,
+and the client's errors and retries. Exits non-zero when a scenario fails.
+
+Usage (from LamApp/):
+    python -m supermarkets.scripts.bench_scraping
+    python -m supermarkets.scripts.bench_scraping --latency 0.05 --concurrency 1 4 8 --runs 5
+    python -m supermarkets.scripts.bench_scraping --failure-rate 0.05 --json bench.json
+"""
+import argparse
+import json
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from . import dropzone_client
+from .fake_dropzone import FakeDropzone
+from .web_lister import WebLister, listino_records
+
+LOSS_HEADERS = {
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+    "X-Requested-With": "XMLHttpRequest",
+}
+
+
+def _lister(account, download_dir, storage_name=""):
+    return WebLister(
+        username=account, password="bench", storage_name=storage_name,
+        download_dir=download_dir, id_cod_mag=1, id_cliente=1, id_azienda=1,
+        id_marchio=1, id_clienti_canale=1, id_clienti_area=1, id_user=1, x5cper=1,
+        browser=False,
+    )
+
+
+def run_list_update(account, download_dir):
+    lister = _lister(account, download_dir, storage_name="01 BENCH GENERI VARI")
+    lister.login()
+    lister.apply_category_filters()
+    rows = sum(1 for _ in listino_records(lister.iter_listino(lister.dropzone())))
+    return lister.dropzone(), rows
+
+
+def run_ddt_import(account, download_dir, concurrency):
+    lister = _lister(account, download_dir)
+    lister.login()
+    day = (date.today() - timedelta(days=1)).strftime("%Y%m%d")
+    invoices = lister.fetch_scorporo(date_from=day, date_to=day)
+    righe = [r for batch in lister.fetch_all_righe(invoices, max_workers=concurrency) for r in batch]
+    lister.process_righe(righe)
+    return lister.dropzone(), len(righe)
+
+
+def run_loss_export(account, days):
+    client = dropzone_client.http_session(account, "bench")
+    url_testate = f"{dropzone_client.BASE_URL}/rilevazioni/RilevazioniTestate_call.php"
+    url_righe = f"{dropzone_client.BASE_URL}/rilevazioni/RilevazioniRighe_call.php"
+    rows = 0
+    for days_back in range(days + 1):
+        day = (date.today() - timedelta(days=days_back)).strftime("%Y-%m-%d")
+        resp = client.post(url_testate, headers=LOSS_HEADERS, data={
+            "funzione": "lista", "IDAzienda": "", "IDCliente": 1, "DescRilevazione": "",
+            "Dal": day, "Al": day, "IsExported": "", "numRecord": 100,
+        }, timeout=60)
+        resp.raise_for_status()
+        for testata in resp.json():
+            resp = client.post(url_righe, headers=LOSS_HEADERS, data={
+                "funzione": "lista",
+                "IDRilevazioniTestata": testata["RilevazioniTestateIDRilevazioniTestata"],
+            }, timeout=60)
+            resp.raise_for_status()
+            rows += len(resp.json())
+    return client, rows
+
+
+def measure(name, runs, scenario):
+    """Run scenario(account) `runs` times; one result dict for the report."""
+    timings, requests_made, errors, retries, rows = [], 0, 0, 0, 0
+    for run in range(runs):
+        account = f"bench-{name}-{run}-{time.monotonic_ns()}"
+        started = time.perf_counter()
+        client, rows = scenario(account)
+        timings.append(time.perf_counter() - started)
+        for m in client.metrics().values():
+            requests_made += m["calls"]
+            errors += m["errors"]
+            retries += m["retries"]
+
+    p50 = statistics.median(timings)
+    return {
+        "scenario": name,
+        "runs": runs,
+        "p50_s": round(p50, 4),
+        "max_s": round(max(timings), 4),
+        "requests_per_run": requests_made // runs,
+        "rows": rows,
+        "rows_per_s": round(rows / p50, 1) if p50 else None,
+        "errors": errors,
+        "retries": retries,
+    }
+
+
+def print_report(results):
+    columns = ("scenario", "runs", "p50_s", "max_s", "requests_per_run", "rows", "rows_per_s", "errors", "retries")
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Dropzone scrapers against a local fake")
+    parser.add_argument("--scenarios", nargs="+", default=["list-update", "ddt-import", "loss-export"],
+                        choices=["list-update", "ddt-import", "loss-export"])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per fake API response")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--session-requests", type=int, default=0,
+                        help="expire fake sessions after this many calls (exercises re-login)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4],
+                        help="fetch_all_righe workers to compare for ddt-import")
+    parser.add_argument("--listino-size", type=int, default=3000, help="products per Reparto page")
+    parser.add_argument("--ddt-count", type=int, default=40)
+    parser.add_argument("--righe-per-ddt", type=int, default=60)
+    parser.add_argument("--days", type=int, default=30, help="days walked back by loss-export")
+    parser.add_argument("--backoff", type=float, default=0.05, help="client retry backoff, seconds")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(levelname)s %(name)s: %(message)s")
+
+    fake = FakeDropzone(
+        latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+        session_requests=args.session_requests, listino_size=args.listino_size,
+        ddt_count=args.ddt_count, righe_per_ddt=args.righe_per_ddt,
+    )
+    dropzone_client.BASE_URL = fake.base_url
+    dropzone_client.BACKOFF = args.backoff
+    # Let the widest fan-out through the per-host limit; set before any client exists
+    dropzone_client.MAX_PER_HOST = max(dropzone_client.MAX_PER_HOST, *args.concurrency)
+
+    results = []
+    failed = False
+    with fake, tempfile.TemporaryDirectory() as tmp:
+        plan = []
+        if "list-update" in args.scenarios:
+            plan.append(("list-update", lambda acc: run_list_update(acc, tmp)))
+        if "ddt-import" in args.scenarios:
+            for c in args.concurrency:
+                plan.append((f"ddt-import/c{c}", lambda acc, c=c: run_ddt_import(acc, tmp, c)))
+        if "loss-export" in args.scenarios:
+            plan.append(("loss-export", lambda acc: run_loss_export(acc, args.days)))
+
+        for name, scenario in plan:
+            try:
+                results.append(measure(name, args.runs, scenario))
+            except Exception as e:
+                failed = True
+                logging.getLogger(__name__).exception(f"Scenario {name} failed: {e}")
+
+    if results:
+        print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
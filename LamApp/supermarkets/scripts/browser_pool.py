@@ -0,0 +1,209 @@
+# LamApp/supermarkets/scripts/browser_pool.py
+"""
+Process-wide pool of warm headless Chrome sessions for the selenium queue.
+
+Starting Chrome (profile directory, chromedriver spawn, browser boot) and then
+logging in to Dropzone costs several seconds per job. A worker process instead
+keeps a few browsers idle between tasks: a job leases one, preferably one that
+is still logged in as the same Dropzone account, and hands it back when done.
+
+A returned browser is health-checked, stripped back to a single tab and kept
+for the next lease, unless it has served BROWSER_POOL_MAX_USES leases, is older
+than BROWSER_POOL_MAX_AGE, was returned with discard=True, or the pool is already full — in
+which case it is quit. A browser leased for another account has every cookie
+and Dropzone's site data cleared first (through the DevTools protocol: WebDriver's
+delete_all_cookies only reaches the current page's domain, which on a parked
+about:blank tab is none), so it never carries someone else's session; one that
+cannot be cleared is quit instead.
+
+Settings are per process, which is per gunicorn or Celery worker:
+  BROWSER_POOL_SIZE       idle browsers kept (default 1; 0 quits every browser on return)
+  BROWSER_POOL_MAX_USES   leases before a browser is replaced (default 20)
+  BROWSER_POOL_MAX_AGE    seconds before a browser is replaced (default 3600)
+  BROWSER_POOL_WARM       browsers started when a worker process boots (default 0)
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.environ.get('BROWSER_POOL_SIZE', 1))
+MAX_USES = int(os.environ.get('BROWSER_POOL_MAX_USES', 20))
+MAX_AGE = float(os.environ.get('BROWSER_POOL_MAX_AGE', 3600))
+WARM = int(os.environ.get('BROWSER_POOL_WARM', 0))
+
+DROPZONE_ORIGIN = "https://dropzone.pac2000a.it"
+
+
+class PooledBrowser:
+    """A Chrome session and its profile directory, plus what the pool tracks."""
+
+    def __init__(self, driver, user_data_dir):
+        self.driver = driver
+        self.user_data_dir = user_data_dir
+        self.account = None     # Dropzone username it last logged in as
+        self.uses = 0
+        self.started_at = time.monotonic()
+
+    def healthy(self) -> bool:
+        try:
+            return self.driver.execute_script("return 1;") == 1
+        except WebDriverException:
+            return False
+
+    def clear_session(self):
+        """Forget every login: all cookies of every domain, and Dropzone's storage."""
+        self.driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        self.driver.execute_cdp_cmd(
+            "Storage.clearDataForOrigin", {"origin": DROPZONE_ORIGIN, "storageTypes": "all"}
+        )
+        self.account = None
+
+    def reset(self):
+        """Close every tab but the first and park it on a blank page."""
+        handles = self.driver.window_handles
+        for handle in handles[1:]:
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        self.driver.switch_to.window(handles[0])
+        self.driver.get("about:blank")
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except WebDriverException:
+            pass
+        shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+
+def launch(headless: bool = True) -> PooledBrowser:
+    """Start a Chrome session with the options every scraper uses."""
+    user_data_dir = f"/tmp/chrome-{uuid.uuid4()}"
+    os.makedirs(user_data_dir, exist_ok=True)
+    os.chmod(user_data_dir, 0o700)
+
+    os.environ["HOME"] = user_data_dir
+    os.environ["XDG_RUNTIME_DIR"] = user_data_dir
+
+    chrome_options = Options()
+    chrome_options.binary_location = "/usr/bin/google-chrome"
+    if headless:
+        chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-setuid-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--disable-software-rasterizer")
+        chrome_options.add_argument("--window-size=1920,1080")
+        chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_experimental_option('excludeSwitches', ['enable-logging'])
+    chrome_options.add_argument('--log-level=3')
+    chrome_options.add_argument(f"--user-data-dir={user_data_dir}")
+
+    started = time.monotonic()
+    try:
+        driver = webdriver.Chrome(service=Service(), options=chrome_options)
+    except Exception:
+        shutil.rmtree(user_data_dir, ignore_errors=True)
+        raise
+    logger.info(f"[BROWSER POOL] Started Chrome in {time.monotonic() - started:.1f}s")
+    return PooledBrowser(driver, user_data_dir)
+
+
+_idle = []
+_idle_lock = threading.Lock()
+_idle_pid = os.getpid()
+
+
+def _idle_list():
+    """This process's idle list. Call with _idle_lock held."""
+    global _idle, _idle_pid
+    # Browsers belong to the process that started them (Celery prefork)
+    if _idle_pid != os.getpid():
+        _idle = []
+        _idle_pid = os.getpid()
+    return _idle
+
+
+def _take_idle(account):
+    with _idle_lock:
+        idle = _idle_list()
+        for i, browser in enumerate(idle):
+            if browser.account == account:
+                return idle.pop(i)
+        return idle.pop(0) if idle else None
+
+
+def lease(account, headless: bool = True) -> PooledBrowser:
+    """
+    A browser for a job of `account`: an idle one still logged in as that
+    account if there is one, else any healthy idle one, else a new one.
+    Give it back with release().
+    """
+    while True:
+        browser = _take_idle(account)
+        if browser is None:
+            return launch(headless)
+        if not browser.healthy():
+            logger.info("[BROWSER POOL] Discarding dead idle browser")
+            browser.quit()
+            continue
+        if browser.account != account:
+            try:
+                browser.clear_session()
+            except WebDriverException:
+                logger.info("[BROWSER POOL] Discarding idle browser whose session could not be cleared")
+                browser.quit()
+                continue
+        logger.info(f"[BROWSER POOL] Reusing browser ({browser.uses} previous leases)")
+        return browser
+
+
+def release(browser: PooledBrowser, discard: bool = False):
+    """Return a leased browser: kept warm for the next lease, or quit."""
+    browser.uses += 1
+    too_old = time.monotonic() - browser.started_at > MAX_AGE
+    if discard or too_old or browser.uses >= MAX_USES or not browser.healthy():
+        browser.quit()
+        return
+    try:
+        browser.reset()
+    except WebDriverException:
+        browser.quit()
+        return
+    with _idle_lock:
+        idle = _idle_list()
+        if len(idle) < POOL_SIZE:
+            idle.append(browser)
+            return
+    browser.quit()
+
+
+def warm(count: int = WARM):
+    """Start browsers until `count` (at most BROWSER_POOL_SIZE) are idle."""
+    target = min(count, POOL_SIZE)
+    while True:
+        with _idle_lock:
+            if len(_idle_list()) >= target:
+                return
+        browser = launch()
+        with _idle_lock:
+            _idle_list().append(browser)
+
+
+def close_all():
+    """Quit every idle browser in this process (worker shutdown)."""
+    with _idle_lock:
+        idle = list(_idle_list())
+        _idle.clear()
+    for browser in idle:
+        browser.quit()
@@ -0,0 +1,171 @@
+# LamApp/supermarkets/scripts/db_pool.py
+"""
+Process-wide PostgreSQL connection pool, one sub-pool per supermarket schema.
+
+search_path is fixed at connect time (`-c search_path=...`), so a connection
+belongs to exactly one schema and is only ever handed back out for that schema
+— no SET on checkout, and nothing a caller does to its session can leak into
+another supermarket's queries.
+
+Limits are per process, which is per gunicorn or Celery worker:
+  PG_POOL_MAX_PER_SCHEMA  connections one schema may hold open (default 4)
+  PG_POOL_TIMEOUT         seconds to wait for a free one before failing (default 30)
+  PG_POOL_PING_AFTER      idle seconds after which a connection is pinged before reuse (default 60)
+  PG_POOL_MAX_AGE         seconds after which a connection is replaced on return (default 3600)
+"""
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+MAX_PER_SCHEMA = int(os.environ.get('PG_POOL_MAX_PER_SCHEMA', 4))
+CHECKOUT_TIMEOUT = float(os.environ.get('PG_POOL_TIMEOUT', 30))
+PING_AFTER = float(os.environ.get('PG_POOL_PING_AFTER', 60))
+MAX_AGE = float(os.environ.get('PG_POOL_MAX_AGE', 3600))
+
+
+class PoolExhausted(psycopg2.OperationalError):
+    """No connection for the schema became free within PG_POOL_TIMEOUT."""
+
+
+class _SchemaPool:
+    # psycopg2.pool keeps only `minconn` idle connections and opens all of them
+    # up front, and fails immediately when full instead of waiting — so a
+    # small pool of our own: an idle stack plus a semaphore for the size limit.
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.slots = threading.BoundedSemaphore(MAX_PER_SCHEMA)
+        self.lock = threading.Lock()
+        self.idle = []          # (conn, returned_at), most recently returned last
+        self.opened_at = {}     # id(conn) -> connect time, for MAX_AGE
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            host=os.environ.get('PG_HOST'),
+            database=os.environ.get('PG_DATABASE'),
+            user=os.environ.get('PG_USER'),
+            password=os.environ.get('PG_PASSWORD'),
+            options=f'-c search_path={self.schema},public'
+        )
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with self.lock:
+            self.opened_at[id(conn)] = time.monotonic()
+        return conn
+
+    def checkout(self):
+        if not self.slots.acquire(timeout=CHECKOUT_TIMEOUT):
+            raise PoolExhausted(
+                f"No free connection for schema '{self.schema}' after {CHECKOUT_TIMEOUT:.0f}s "
+                f"({MAX_PER_SCHEMA} in use)"
+            )
+        try:
+            return self._reuse_idle() or self._connect()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def _reuse_idle(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                conn, returned_at = self.idle.pop()
+            if conn.closed:
+                self._forget(conn)
+                continue
+            if time.monotonic() - returned_at < PING_AFTER or self._ping(conn):
+                return conn
+            logger.info(f"[DB POOL] Discarding dead idle connection for schema '{self.schema}'")
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _ping(conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _forget(self, conn):
+        with self.lock:
+            self.opened_at.pop(id(conn), None)
+
+    def _close_quietly(self, conn):
+        self._forget(conn)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def release(self, conn):
+        try:
+            if conn.closed:
+                self._forget(conn)
+                return
+            status = conn.info.transaction_status
+            too_old = time.monotonic() - self.opened_at.get(id(conn), 0) > MAX_AGE
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN or too_old:
+                self._close_quietly(conn)
+                return
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                # Left mid-transaction (an exception, or a caller that switched
+                # autocommit off) — never hand that state to the next user.
+                conn.rollback()
+            if not conn.autocommit:
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with self.lock:
+                self.idle.append((conn, time.monotonic()))
+        except psycopg2.Error:
+            self._close_quietly(conn)
+        finally:
+            self.slots.release()
+
+    def closeall(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def _pool_for(schema):
+    global _pools, _pools_pid
+    with _pools_lock:
+        # Connections must not cross a fork (gunicorn --preload, Celery prefork):
+        # a child starts with its own, empty set of pools.
+        if _pools_pid != os.getpid():
+            _pools = {}
+            _pools_pid = os.getpid()
+        pool = _pools.get(schema)
+        if pool is None:
+            pool = _pools[schema] = _SchemaPool(schema)
+        return pool
+
+
+def checkout(schema):
+    """Borrow an autocommit connection whose search_path is `schema`."""
+    return _pool_for(schema).checkout()
+
+
+def release(schema, conn):
+    """Give a connection back. Safe on connections the caller already closed."""
+    _pool_for(schema).release(conn)
+
+
+def close_all():
+    """Close every pooled connection in this process (worker shutdown)."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
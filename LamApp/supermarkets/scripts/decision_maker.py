@@ -3,9 +3,13 @@ import logging
 from .DatabaseManager import DatabaseManager
 from datetime import date, timedelta
 from math import ceil
+
+import numpy as np
+
 from .helpers import Helper
 from .analyzer import analyzer
-from .processor_N import process_N_sales
+from .processor_N import process_N_sales, process_N_sales_batch
+from . import feature_store
 
 # Writes to decision_maker.log — separate from other logs due to high volume
 logger = logging.getLogger(__name__)
@@ -13,7 +17,7 @@ logger = logging.getLogger(__name__)
 
 class DecisionMaker:
     def __init__(self, db: DatabaseManager, helper: Helper, blacklist_set=None, skip_sale: bool = False,
-                 product_links=None):
+                 product_links=None, shared_inputs=None):
         """
         Initialize decision maker with PostgreSQL support.
 
@@ -21,6 +25,9 @@ class DecisionMaker:
                        Only one side of each pair is ordered; the other side's stats are
                        merged into it. Which side that is gets resolved in
                        _resolve_product_links.
+        shared_inputs: output of export_shared_inputs() from a DecisionMaker on the same
+                       supermarket. Replaces the per-supermarket reads (losses, promos,
+                       closure mask, links), and product_links with it.
         """
         self.helper = helper
         self.conn = db.conn
@@ -28,6 +35,7 @@ class DecisionMaker:
         self.cursor = db.cursor()
         self.skip_sale = skip_sale
         self.orders_list = []
+        self.shared = shared_inputs
 
         self.zombie_products = []   # Products that are finished/not restockable
 
@@ -40,7 +48,14 @@ class DecisionMaker:
         # Product link lookups — resolved once, used while iterating every settore
         self.link_partner = {}      # (cod, v) of the side to order -> (cod, v) of the side merged into it
         self.link_suppressed = {}   # (cod, v) not to order -> (cod, v) of the side that carries the order
-        self._resolve_product_links(product_links or [])
+        self.link_stats = {}        # (cod, v) of a link side -> get_linked_product_stats, one query per run
+        if self.shared is not None:
+            for order_cod, order_v, merged_cod, merged_v in self.shared["links"]:
+                self.link_partner[(order_cod, order_v)] = (merged_cod, merged_v)
+                self.link_suppressed[(merged_cod, merged_v)] = (order_cod, order_v)
+            self.link_stats = self.db.get_linked_products_stats(self.link_partner.values())
+        else:
+            self._resolve_product_links(product_links or [])
 
         logger.info(f"DecisionMaker initialized with {len(self.blacklist)} blacklisted products")
 
@@ -60,9 +75,12 @@ class DecisionMaker:
         the order can still go through on the secondary — the merged sales
         history and stock stay the same either way.
         """
+        self.link_stats = self.db.get_linked_products_stats(
+            side for pair in product_links for side in pair
+        )
         for primary, secondary in product_links:
-            primary_info = self.db.get_linked_product_stats(*primary)
-            secondary_info = self.db.get_linked_product_stats(*secondary)
+            primary_info = self.link_stats.get(primary)
+            secondary_info = self.link_stats.get(secondary)
 
             order_side, merged_side = primary, secondary
             if not self._link_side_is_available(primary_info) and self._link_side_is_available(secondary_info):
@@ -76,13 +94,52 @@ class DecisionMaker:
             self.link_partner[order_side] = merged_side
             self.link_suppressed[merged_side] = order_side
 
+    def export_shared_inputs(self) -> dict:
+        """
+        Everything this DecisionMaker read that is per supermarket rather than per
+        settore, in a JSON-safe form: extra losses, current and upcoming promos,
+        recently ended promos, the closure mask and the resolved product links.
+
+        Supermarket-level order planning loads these once and hands them to each
+        storage's DecisionMaker (shared_inputs=...), which then reads nothing but its
+        own settore. Promos are kept with no look-ahead limit; each storage applies
+        its own coverage window.
+        """
+        internal_lookup, expired_lookup = self.get_extra_losses()
+        upcoming = self._query_products_on_sale(None)
+        return {
+            "date": date.today().isoformat(),
+            "internal": [[cod, v, arr] for (cod, v), arr in internal_lookup.items()],
+            "expired": [[cod, v, arr] for (cod, v), arr in expired_lookup.items()],
+            "sales": [
+                [cod, v, info["discount"], info["sale_start"].isoformat(), info["sale_end"].isoformat()]
+                for (cod, v), info in upcoming.items()
+            ],
+            "ended_sales": [
+                [cod, v, info["days_lasted"], info["days_since_the_end"]]
+                for (cod, v), info in self.sale_discounts_ended.items()
+            ],
+            "closure_mask": self.get_closure_mask(),
+            "links": [
+                [order[0], order[1], merged[0], merged[1]]
+                for order, merged in self.link_partner.items()
+            ],
+        }
+
+    def get_closure_mask(self):
+        """Closure / no-sync day mask for sigma, from the store-wide daily totals."""
+        if self.shared is not None:
+            return list(self.shared["closure_mask"])
+        return Helper.closure_day_mask(self.db.get_store_daily_totals())
+
     def get_products_by_settore(self, settore):
         """
         Retrieve all products (and their stats) for a given settore.
         """
-        query = """
-            SELECT p.cod, p.v, p.descrizione, ps.stock, ps.sold_last_24, ps.bought_last_24, ps.sales_sets,
-                ps.bought_sets, p.pz_x_collo, p.rapp, ps.verified, p.disponibilita, p.purge_flag,
+        query = f"""
+            SELECT p.cod, p.v, p.descrizione, ps.stock, ps.sold_last_24, ps.bought_last_24,
+                {self.db.sales_sets_sql("ps")} AS sales_sets, {self.db.bought_sets_sql("ps")} AS bought_sets,
+                p.pz_x_collo, p.rapp, ps.verified, p.disponibilita, p.purge_flag,
                 ps.minimum_stock, p.shelf_life_days, ps.promo_lifts
             FROM products p
             LEFT JOIN product_stats ps ON p.cod = ps.cod AND p.v = ps.v
@@ -98,6 +155,12 @@ class DecisionMaker:
           internal_dict: {(cod, v): internal_array} for products with internal losses
           expired_dict:  {(cod, v): expired_array} for products with expired losses
         """
+        if self.shared is not None:
+            return (
+                {(cod, v): arr for cod, v, arr in self.shared["internal"]},
+                {(cod, v): arr for cod, v, arr in self.shared["expired"]},
+            )
+
         self.cursor.execute("""
             SELECT cod, v, internal, expired
             FROM extra_losses
@@ -117,8 +180,23 @@ class DecisionMaker:
 
 
     def retrieve_products_on_sale(self, days_ahead=0):
+        if self.shared is not None:
+            future = date.today() + timedelta(days=int(days_ahead))
+            return {
+                (cod, v): {
+                    "discount": discount,
+                    "sale_start": date.fromisoformat(start),
+                    "sale_end": date.fromisoformat(end),
+                }
+                for cod, v, discount, start, end in self.shared["sales"]
+                if date.fromisoformat(start) <= future
+            }
+        return self._query_products_on_sale(days_ahead)
+
+    def _query_products_on_sale(self, days_ahead):
+        """Promos running today or starting within days_ahead (None: any time ahead)."""
         today = date.today()
-        future = today + timedelta(days=int(days_ahead))
+        future = today + timedelta(days=int(days_ahead)) if days_ahead is not None else date.max
 
         self.cursor.execute("""
             SELECT cod, v, price_std, price_s, sale_start, sale_end
@@ -161,6 +239,12 @@ class DecisionMaker:
         return self.sale_discounts.get((cod, v))
     
     def retrieve_products_recently_ended_sale(self):
+        if self.shared is not None:
+            return {
+                (cod, v): {"days_lasted": days_lasted, "days_since_the_end": days_since_the_end}
+                for cod, v, days_lasted, days_since_the_end in self.shared["ended_sales"]
+            }
+
         today = date.today()
 
         self.cursor.execute("""
@@ -205,10 +289,155 @@ class DecisionMaker:
         threshold_date = sale_start + timedelta(days=threshold_day - 1)
         return today <= threshold_date
 
-    def decide_orders_for_settore(self, settore, coverage, minimum_stock_base=None):
+    def _prepare_product(self, row, settore, zombie_products):
+        """
+        The checks that need no demand statistics: blacklist, purge, links,
+        catalog data, zombies and recently-ended sales. Returns None when the
+        product is skipped, otherwise what the order calculation needs.
+        """
+        product_cod = row["cod"]
+        product_var = row["v"]
+
+        # CHECK BLACKLIST
+        if (product_cod, product_var) in self.blacklist:
+            logger.info(f"Skipping blacklisted product: {product_cod}.{product_var}")
+            return None
+
+        product_flag = row["purge_flag"]
+
+        # CHECK Purge
+        if product_flag:
+            logger.info(f"Skipping purging product: {product_cod}.{product_var}")
+            return None
+
+        # CHECK PRODUCT LINK — only one side of a link is ordered; merge into it later
+        link_carrier = self.link_suppressed.get((product_cod, product_var))
+        if link_carrier is not None:
+            logger.info(
+                f"Skipping linked product: {product_cod}.{product_var} "
+                f"(handled by {link_carrier[0]}.{link_carrier[1]})"
+            )
+            return None
+
+        descrizione = row["descrizione"]
+        stock = row["stock"]
+
+        if stock is None:
+            logger.info(f"Skipping Article: {product_cod}.{product_var}. Because has no registered stock")
+            return None
+
+        stock = max(0, stock)
+        sold_array = row["sold_last_24"] or []
+        bought_array = row["bought_last_24"] or []
+        sales_sets = row["sales_sets"] or []
+        bought_sets = row["bought_sets"] or []
+        # False once this run alters the history (link merge, promo slice): such
+        # features are computed fresh and never cached.
+        raw_history = True
+
+        # PRODUCT LINK — merge the other side's sales_sets and stock into this one
+        linked_partner = self.link_partner.get((product_cod, product_var))
+        if linked_partner is not None:
+            partner_stats = self.link_stats.get(linked_partner)
+            if partner_stats is not None:
+                sales_sets = Helper.merge_sales_sets(sales_sets, partner_stats["sales_sets"])
+                raw_history = False
+                stock = stock + max(0, partner_stats["stock"])
+                logger.info(
+                    f"Merged linked product {linked_partner[0]}.{linked_partner[1]} "
+                    f"into {product_cod}.{product_var}: "
+                    f"stock+={partner_stats['stock']}"
+                )
+
+        # After the merge: merge_sales_sets pairs slots positionally and both sides
+        # still carry their running day at slot 0.
+        sales_sets = Helper.sales_history(sales_sets)
+
+        package_size = row["pz_x_collo"]
+        package_multi = row["rapp"]
+        verified = row["verified"]
+        disponibilita = row["disponibilita"]
+        minimum_stock_override = row.get("minimum_stock", None)
+        shelf_life_days = row.get("shelf_life_days", None)
+
+        logger.info(f"Processing {product_cod}.{product_var} - {descrizione} (stock={stock})")
+
+        if not verified and disponibilita == "No":
+            logger.info(f"{product_cod}.{product_var} - {descrizione} skipped because is not verified and not available")
+            return None
+
+        if stock == 0 and verified and disponibilita == "No" and settore != "DEPERIBILI":
+            logger.info(f"{product_cod}.{product_var} - {descrizione} marked as zombie because is not available and has verified stock of 0")
+            zombie_products.append({
+                'cod': product_cod,
+                'var': product_var,
+                'reason': 'Finished and not restockable (disponibilita=No, stock=0)'
+            })
+            return None
+
+        # Divisor from here on. Skip rather than default to 1, which would order
+        # loose units against a supplier that ships full cases.
+        if not package_size or not package_multi:
+            reason = f"Invalid package size (pz_x_collo={package_size}, rapp={package_multi}) — catalog data missing"
+            logger.warning(f"{product_cod}.{product_var} - {descrizione}: {reason}")
+            Helper.next_article(product_cod, product_var, package_size, descrizione, reason)
+            return None
+
+        package_size *= package_multi
+
+        if bought_array[0] == 0 and sold_array[0] == 0:
+            if not verified and (disponibilita == "Si" or settore == "DEPERIBILI"):
+                reason = "Never been in system (brand new product)"
+                Helper.next_article(product_cod, product_var, package_size, descrizione, reason)
+                return None
+            elif disponibilita == "No":
+                reason = "Not available for restocking and no sales history"
+                Helper.next_article(product_cod, product_var, package_size, descrizione, reason)
+                return None
+
+        sale_end_info = self.get_ended_discount_for(product_cod, product_var)
+
+        if sale_end_info is not None:
+            days_lasted = sale_end_info["days_lasted"]
+            days_since_the_end = sale_end_info["days_since_the_end"]
+            # sales_sets[i] holds day (today - 1 - i), so the sale's last day —
+            # peak clearance volume — sits at (days_since_the_end - 1)
+            start = days_since_the_end - 1
+            logger.info(
+                f"{product_cod}.{product_var}: recently-ended sale ({days_lasted}d, ended {days_since_the_end}d ago) "
+                f"-> removing sales_sets[{start}:{start + days_lasted}] to avoid skewing avg_daily_sales"
+            )
+            sales_sets = sales_sets[:start] + sales_sets[start + days_lasted:]
+            raw_history = False
+            sale_info = None
+        else :
+            sale_info = self.get_discount_for(product_cod, product_var)
+
+        return {
+            "row": row,
+            "cod": product_cod,
+            "var": product_var,
+            "descrizione": descrizione,
+            "stock": stock,
+            "sold_array": sold_array,
+            "bought_sets": bought_sets,
+            "sales_sets": sales_sets,
+            "raw_history": raw_history,
+            "package_size": package_size,
+            "verified": verified,
+            "minimum_stock_override": minimum_stock_override,
+            "shelf_life_days": shelf_life_days,
+            "sale_info": sale_info,
+        }
+
+    def decide_orders_for_settore(self, settore, coverage, minimum_stock_base=None, batch=False):
         """
         Main method — iterate over all products in a settore and decide what to order.
         Now tracks zombie_products.
+
+        batch=True computes the demand statistics and order quantities for the whole
+        settore as array operations (see _decide_orders_batch). Same orders_list,
+        without the per-product calculation trail in decision_maker.log.
         """
         logger.info(f"Processing settore: {settore} with coverage: {coverage} days")
         logger.info(f"Active blacklist has {len(self.blacklist)} products")
@@ -219,7 +448,7 @@ class DecisionMaker:
         internal_lookup, expired_lookup = self.get_extra_losses()
 
         # Closure / sync-gap days look like real zeros and would inflate every sigma
-        closure_mask = Helper.closure_day_mask(self.db.get_store_daily_totals())
+        closure_mask = self.get_closure_mask()
         excluded = sum(1 for c in closure_mask if c)
         if excluded:
             logger.info(f"Excluding {excluded} closure/no-sync day(s) from sigma estimation")
@@ -233,119 +462,43 @@ class DecisionMaker:
         order_list = []
         zombie_products = []
 
-        for row in products:
-            product_cod = row["cod"]
-            product_var = row["v"]
-            
-            # CHECK BLACKLIST
-            if (product_cod, product_var) in self.blacklist:
-                logger.info(f"Skipping blacklisted product: {product_cod}.{product_var}")
-                continue
-
-            product_flag = row["purge_flag"]
-
-            # CHECK Purge
-            if product_flag:
-                logger.info(f"Skipping purging product: {product_cod}.{product_var}")
-                continue
+        decide = self._decide_orders_batch if batch else self._decide_orders_scalar
+        decide(
+            products, settore, coverage, minimum_stock_base,
+            internal_lookup, expired_lookup, closure_mask, safety_z,
+            order_list, zombie_products,
+        )
 
-            # CHECK PRODUCT LINK — only one side of a link is ordered; merge into it later
-            link_carrier = self.link_suppressed.get((product_cod, product_var))
-            if link_carrier is not None:
-                logger.info(
-                    f"Skipping linked product: {product_cod}.{product_var} "
-                    f"(handled by {link_carrier[0]}.{link_carrier[1]})"
-                )
-                continue
-
-            descrizione = row["descrizione"]
-            stock = row["stock"]
-
-            if stock is None:
-                logger.info(f"Skipping Article: {product_cod}.{product_var}. Because has no registered stock")
-                continue
-
-            stock = max(0, stock)
-            sold_array = row["sold_last_24"] or []
-            bought_array = row["bought_last_24"] or []
-            sales_sets = row["sales_sets"] or []
-            bought_sets = row["bought_sets"] or []
-
-            # PRODUCT LINK — merge the other side's sales_sets and stock into this one
-            linked_partner = self.link_partner.get((product_cod, product_var))
-            if linked_partner is not None:
-                partner_stats = self.db.get_linked_product_stats(linked_partner[0], linked_partner[1])
-                if partner_stats is not None:
-                    sales_sets = Helper.merge_sales_sets(sales_sets, partner_stats["sales_sets"])
-                    stock = stock + max(0, partner_stats["stock"])
-                    logger.info(
-                        f"Merged linked product {linked_partner[0]}.{linked_partner[1]} "
-                        f"into {product_cod}.{product_var}: "
-                        f"stock+={partner_stats['stock']}"
-                    )
-
-            # After the merge: merge_sales_sets pairs slots positionally and both sides
-            # still carry their running day at slot 0.
-            sales_sets = Helper.sales_history(sales_sets)
-
-            package_size = row["pz_x_collo"]
-            package_multi = row["rapp"]
-            verified = row["verified"]
-            disponibilita = row["disponibilita"]
-            minimum_stock_override = row.get("minimum_stock", None)
-            shelf_life_days = row.get("shelf_life_days", None)
-
-            logger.info(f"Processing {product_cod}.{product_var} - {descrizione} (stock={stock})")
-
-            if not verified and disponibilita == "No":
-                logger.info(f"{product_cod}.{product_var} - {descrizione} skipped because is not verified and not available")
-                continue
+        analyzer.log_statistics()
+        
+        # Store lists
+        self.orders_list = order_list
+        self.zombie_products = zombie_products
 
-            if stock == 0 and verified and disponibilita == "No" and settore != "DEPERIBILI":
-                logger.info(f"{product_cod}.{product_var} - {descrizione} marked as zombie because is not available and has verified stock of 0")
-                zombie_products.append({
-                    'cod': product_cod,
-                    'var': product_var,
-                    'reason': 'Finished and not restockable (disponibilita=No, stock=0)'
-                })
-                continue
+        logger.info(f"Finished settore '{settore}':")
+        logger.info(f"  - Orders: {len(order_list)}")
+        logger.info(f"  - Zombie products: {len(zombie_products)}")
 
-            # Divisor from here on. Skip rather than default to 1, which would order
-            # loose units against a supplier that ships full cases.
-            if not package_size or not package_multi:
-                reason = f"Invalid package size (pz_x_collo={package_size}, rapp={package_multi}) — catalog data missing"
-                logger.warning(f"{product_cod}.{product_var} - {descrizione}: {reason}")
-                Helper.next_article(product_cod, product_var, package_size, descrizione, reason)
+    def _decide_orders_scalar(self, products, settore, coverage, minimum_stock_base,
+                              internal_lookup, expired_lookup, closure_mask, safety_z,
+                              order_list, zombie_products):
+        """Per-product path: one product at a time, fully logged."""
+        for row in products:
+            product = self._prepare_product(row, settore, zombie_products)
+            if product is None:
                 continue
 
-            package_size *= package_multi
-
-            if bought_array[0] == 0 and sold_array[0] == 0:
-                if not verified and (disponibilita == "Si" or settore == "DEPERIBILI"):
-                    reason = "Never been in system (brand new product)"
-                    Helper.next_article(product_cod, product_var, package_size, descrizione, reason)
-                    continue
-                elif disponibilita == "No":
-                    reason = "Not available for restocking and no sales history"
-                    Helper.next_article(product_cod, product_var, package_size, descrizione, reason)
-                    continue
-
-            sale_end_info = self.get_ended_discount_for(product_cod, product_var)
-
-            if sale_end_info is not None:
-                days_lasted = sale_end_info["days_lasted"]
-                days_since_the_end = sale_end_info["days_since_the_end"]
-                # sales_sets[i] holds day (today - 1 - i), so the sale's last day —
-                # peak clearance volume — sits at (days_since_the_end - 1)
-                start = days_since_the_end - 1
-                logger.info(
-                    f"{product_cod}.{product_var}: recently-ended sale ({days_lasted}d, ended {days_since_the_end}d ago) "
-                    f"-> removing sales_sets[{start}:{start + days_lasted}] to avoid skewing avg_daily_sales"
-                )
-                sales_sets = sales_sets[:start] + sales_sets[start + days_lasted:]
-                sale_info = None
-            else :
-                sale_info = self.get_discount_for(product_cod, product_var)
+            product_cod, product_var = product["cod"], product["var"]
+            descrizione = product["descrizione"]
+            stock = product["stock"]
+            sold_array = product["sold_array"]
+            bought_sets = product["bought_sets"]
+            sales_sets = product["sales_sets"]
+            package_size = product["package_size"]
+            verified = product["verified"]
+            minimum_stock_override = product["minimum_stock_override"]
+            shelf_life_days = product["shelf_life_days"]
+            sale_info = product["sale_info"]
 
             avg_from_sets = Helper.avg_daily_sales_from_sales_sets(sales_sets)
             if avg_from_sets is not None:
@@ -461,16 +614,130 @@ class DecisionMaker:
                 analyzer.stat_recorder(0, status, check)
                 self.helper.order_denied(product_cod, product_var, package_size, descrizione, category, check)
 
-        analyzer.log_statistics()
-        
-        # Store lists
-        self.orders_list = order_list
-        self.zombie_products = zombie_products
+    def _decide_orders_batch(self, products, settore, coverage, minimum_stock_base,
+                             internal_lookup, expired_lookup, closure_mask, safety_z,
+                             order_list, zombie_products):
+        """
+        Whole-settore path. Same decisions as _decide_orders_scalar, in the same
+        order, but avg / deviation / sigma come from feature_store (cached per day,
+        misses computed in one products x days matrix) and the order quantities
+        from process_N_sales_batch. The per-product rules that are cheap or rare
+        (fallback average, internal losses, OOS and promo corrections, expiry
+        factors) stay scalar.
+        """
+        prepared = []
+        for row in products:
+            product = self._prepare_product(row, settore, zombie_products)
+            if product is None:
+                continue
+            # The scalar path drops these only after computing the average; the
+            # outcome does not depend on it, so drop them before the matrix.
+            if product["sale_info"] is not None and self.skip_sale:
+                reason = "Skip products on sale mode is active for this order"
+                Helper.next_article(product["cod"], product["var"], product["package_size"],
+                                    product["descrizione"], reason)
+                continue
+            if not product["verified"]:
+                reason = "Not verified in system"
+                Helper.next_article(product["cod"], product["var"], product["package_size"],
+                                    product["descrizione"], reason)
+                continue
+            prepared.append(product)
+
+        if not prepared:
+            return
+
+        features = feature_store.demand_features(self.db, [
+            (p["cod"], p["var"], p["sales_sets"], p["raw_history"]) for p in prepared
+        ], closure_mask)
+        avg_from_sets = [f[0] for f in features]
+        deviations = [f[1] for f in features]
+        sigmas = [f[2] for f in features]
+        logger.info(f"Batch statistics ready for {len(prepared)} products")
+
+        n = len(prepared)
+        avg_daily = np.empty(n)
+        req_stock = np.empty(n)
+        discounts = [None] * n
+        expiry = np.full(n, np.nan)
+        batch_expiry = np.zeros(n, dtype=bool)
+        sigma_L = np.full(n, np.nan)
+        coverage_root = max(coverage, 1) ** 0.5
+        today = date.today()
 
-        logger.info(f"Finished settore '{settore}':")
-        logger.info(f"  - Orders: {len(order_list)}")
-        logger.info(f"  - Zombie products: {len(zombie_products)}")
+        for i, product in enumerate(prepared):
+            key = (product["cod"], product["var"])
+            sales_sets = product["sales_sets"]
+
+            has_set_avg = avg_from_sets[i] is not None
+            if has_set_avg:
+                avg = avg_from_sets[i]
+            else:
+                avg, _ = self.helper.calculate_weighted_avg_sales_new(product["sold_array"], silent=True)
+
+            internal_array = internal_lookup.get(key)
+            if internal_array:
+                internal_daily = Helper.internal_loss_daily_rate(internal_array)
+                if internal_daily > 0:
+                    avg += internal_daily
+
+            req = avg * coverage
+            if has_set_avg:
+                oos_window = sales_sets[:7]
+                null_count = sum(1 for v in oos_window if v is None)
+                if null_count > 0:
+                    null_rate = null_count / len(oos_window)
+                    req *= 1.5 if null_rate >= 1.0 else min(1.0 / (1.0 - null_rate), 1.5)
+
+            sale_info = product["sale_info"]
+            if sale_info is not None:
+                discount = sale_info["discount"] or 10
+                if self.is_in_first_60_percent(today, sale_info["sale_start"], sale_info["sale_end"]):
+                    measured_lift = Helper.expected_promo_lift(product["row"].get("promo_lifts"), discount)
+                    if measured_lift is not None:
+                        req *= measured_lift
+                    else:
+                        req += req * 0.10
+                discounts[i] = discount
+
+            shelf_life_days = product["shelf_life_days"]
+            if shelf_life_days is not None and shelf_life_days <= 90:
+                if key in expired_lookup:
+                    factor = Helper.compute_expiry_factor(expired_lookup[key], product["sold_array"])
+                    if factor is not None:
+                        expiry[i] = factor
+                batch_expiry[i] = bool(Helper.compute_batch_expiry_factor(
+                    product["bought_sets"], sales_sets, product["stock"], shelf_life_days, avg
+                ))
+
+            if sigmas[i] is not None:
+                sigma_L[i] = sigmas[i] * coverage_root
+            avg_daily[i] = avg
+            req_stock[i] = req
+
+        overrides = [np.nan if p["minimum_stock_override"] is None else p["minimum_stock_override"] for p in prepared]
+        shelf_lives = [np.nan if p["shelf_life_days"] is None else p["shelf_life_days"] for p in prepared]
+        orders, checks = process_N_sales_batch(
+            [p["package_size"] for p in prepared], deviations, avg_daily, req_stock,
+            [p["stock"] for p in prepared], [d is not None for d in discounts],
+            minimum_stock_base, overrides, expiry, shelf_lives, batch_expiry,
+            sigma_L, safety_z,
+        )
+
+        category = "N"
+        for i, product in enumerate(prepared):
+            result, check = int(orders[i]), int(checks[i])
+            if result:
+                if avg_daily[i] <= 0.2:
+                    analyzer.low_sale_recorder(product["descrizione"], product["cod"], product["var"])
+                analyzer.stat_recorder(result, True, check)
+                Helper.order_this(order_list, product["cod"], product["var"], result,
+                                  product["descrizione"], category, check, discounts[i])
+            else:
+                analyzer.stat_recorder(0, False, check)
+                self.helper.order_denied(product["cod"], product["var"], product["package_size"],
+                                         product["descrizione"], category, check)
 
     def close(self):
-        """Cleanly close the database connection."""
-        self.conn.close()
\ No newline at end of file
+        """Cleanly release the database connection."""
+        self.db.close()
\ No newline at end of file
@@ -0,0 +1,327 @@
+# LamApp/supermarkets/scripts/dropzone_client.py
+"""
+Process-wide HTTP clients for Dropzone, one per Dropzone account.
+
+Every scraper used to build a fresh requests.Session per call and copy the
+browser's cookies into it, so a DDT import paid a TCP+TLS handshake for each
+of its hundreds of fatture_righe calls. A DropzoneClient keeps one keep-alive
+session per account for the life of the worker process and adds:
+
+- cookie refresh: a 401 calls the client's `reauth` hook (set by whoever owns
+  the login — re-harvesting a browser's cookies, say) and replays the request once;
+- retries with exponential backoff on connection errors and 429/502/503/504 —
+  every call we make is a read, so replaying one is safe. Read timeouts are not
+  retried: the listino call alone may legitimately run for minutes;
+- per-endpoint timing metrics (calls, errors, retries, total and worst seconds);
+- a per-host limit on requests in flight, shared by every client in the
+  process, so parallel fetches for several supermarkets cannot flood the host.
+
+It can also log in by itself (login / http_session): the login page's form is
+fetched and replayed with the credentials, no browser involved. The session is
+then reused by every job of the account in the process until it has been idle
+for DROPZONE_SESSION_TTL, and a 401 logs in again. Only the order entry, which
+drives the Dropzone UI, still needs Selenium.
+
+Settings are per process, which is per gunicorn or Celery worker:
+  DROPZONE_MAX_PER_HOST   requests one host may have in flight (default 4)
+  DROPZONE_RETRIES        retries after the first attempt (default 3)
+  DROPZONE_BACKOFF        seconds before the first retry, doubled each time (default 0.5)
+  DROPZONE_SESSION_TTL    idle seconds after which a login is not reused (default 1200)
+  DROPZONE_HTTP_LOGIN     "1" lets the read-only scrapers log in over HTTP, without
+                          Chrome (default "0": the browser login, as before)
+  DROPZONE_BASE_URL       where the API calls go (default the real host; see fake_dropzone.py)
+"""
+import logging
+import os
+import random
+import threading
+import time
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+MAX_PER_HOST = int(os.environ.get('DROPZONE_MAX_PER_HOST', 4))
+RETRIES = int(os.environ.get('DROPZONE_RETRIES', 3))
+BACKOFF = float(os.environ.get('DROPZONE_BACKOFF', 0.5))
+
+SESSION_TTL = float(os.environ.get('DROPZONE_SESSION_TTL', 1200))
+HTTP_LOGIN = os.environ.get('DROPZONE_HTTP_LOGIN', '0') == '1'
+
+BASE_URL = os.environ.get('DROPZONE_BASE_URL', 'https://dropzone.pac2000a.it')
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class LoginFailed(Exception):
+    """The login form could not be found or did not accept the credentials."""
+
+
+class _FormParser(HTMLParser):
+    """Collects each <form>'s action, method and <input> attributes."""
+
+    def __init__(self):
+        super().__init__()
+        self.forms = []
+        self._form = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "form":
+            self._form = {"action": attrs.get("action"), "method": attrs.get("method"), "inputs": []}
+            self.forms.append(self._form)
+        elif tag == "input" and self._form is not None:
+            self._form["inputs"].append(attrs)
+
+    def handle_endtag(self, tag):
+        if tag == "form":
+            self._form = None
+
+
+def _login_form(html):
+    """The first form with a password input, or None."""
+    parser = _FormParser()
+    parser.feed(html or "")
+    for form in parser.forms:
+        if any((i.get("type") or "").lower() == "password" for i in form["inputs"]):
+            return form
+    return None
+
+
+def _field_name(form, element_id, fallback_type):
+    for i in form["inputs"]:
+        if i.get("id") == element_id and i.get("name"):
+            return i["name"]
+    for i in form["inputs"]:
+        if (i.get("type") or "text").lower() == fallback_type and i.get("name"):
+            return i["name"]
+    return element_id
+
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+
+def _slots_for(host):
+    with _host_slots_lock:
+        slots = _host_slots.get(host)
+        if slots is None:
+            slots = _host_slots[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        return slots
+
+
+class DropzoneClient:
+    """Keep-alive session for one Dropzone account. Safe to share between threads."""
+
+    def __init__(self, account):
+        self.account = account
+        self.session = requests.Session()
+        # Size the connection pool to the host limit so no request in flight
+        # ever has to open (and then throw away) a connection of its own.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_PER_HOST)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.reauth = None      # callable(client) that renews the cookies, or None
+        self.http_login = False # cookies come from login(), not from a browser
+        self._auth_until = 0.0  # monotonic deadline of an HTTP login's idle window
+        self._auth_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {}      # path -> {calls, errors, retries, seconds, max_seconds}
+
+    # --- Authentication ---
+
+    def set_cookies(self, cookies, user_agent=None):
+        """Replace the session's cookies with [{'name': ..., 'value': ...}, ...]."""
+        self.session.cookies.clear()
+        for c in cookies:
+            self.session.cookies.set(c["name"], c["value"])
+        if user_agent:
+            self.session.headers["User-Agent"] = user_agent
+
+    def use_browser(self, driver):
+        """
+        Take the cookies and User-Agent of a logged-in Selenium driver. Until
+        replaced, a 401 re-reads them from the same driver.
+        """
+        def reauth(client):
+            client.set_cookies(driver.get_cookies())
+
+        self.set_cookies(driver.get_cookies(), driver.execute_script("return navigator.userAgent;"))
+        self.reauth = reauth
+        self.http_login = False
+        return self
+
+    def login(self, username, password):
+        """
+        Log in without a browser: GET the home page, fill the form that carries a
+        password field (hidden inputs kept, username/password found by their
+        element ids like the Selenium login) and submit it. Raises LoginFailed
+        when there is no such form or the response still shows one.
+        """
+        started = time.monotonic()
+        self.session.cookies.clear()
+        page = self.session.get(f"{BASE_URL}/", timeout=30)
+        page.raise_for_status()
+        form = _login_form(page.text)
+        if form is None:
+            raise LoginFailed(f"No login form at {page.url}")
+
+        fields = {
+            i["name"]: i.get("value") or ""
+            for i in form["inputs"]
+            if i.get("name") and (i.get("type") or "text").lower() not in ("submit", "button", "image")
+        }
+        fields[_field_name(form, "username", "text")] = username
+        fields[_field_name(form, "password", "password")] = password
+
+        action = urljoin(page.url, form["action"] or page.url)
+        method = (form["method"] or "POST").upper()
+        if method == "GET":
+            response = self.session.get(action, params=fields, timeout=30)
+        else:
+            response = self.session.post(action, data=fields, timeout=30)
+        self._record("login", time.monotonic() - started, error=not response.ok)
+        if not response.ok or _login_form(response.text) is not None:
+            raise LoginFailed(
+                f"Dropzone login for {username} rejected (HTTP {response.status_code}); "
+                f"set DROPZONE_HTTP_LOGIN=0 to log in through Chrome"
+            )
+
+        self.reauth = lambda client: client.login(username, password)
+        self.http_login = True
+        self._auth_until = time.monotonic() + SESSION_TTL
+        logger.info(f"[DROPZONE] HTTP login for {username} in {time.monotonic() - started:.2f}s")
+        return self
+
+    def ensure_login(self, username, password):
+        """login() unless this client's HTTP login is still inside its idle window."""
+        with self._auth_lock:
+            if not (self.http_login and time.monotonic() < self._auth_until):
+                self.login(username, password)
+        return self
+
+    def _refresh_auth(self, stale_cookies):
+        with self._auth_lock:
+            # Another thread may have renewed the cookies while this one waited
+            if self.session.cookies.get_dict() == stale_cookies:
+                self.reauth(self)
+
+    # --- Requests ---
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """
+        session.request with the retry, re-authentication, host limit and metrics
+        described above. Returns the final response; raise_for_status is the
+        caller's, as with a plain session.
+        """
+        parts = urlsplit(url)
+        slots = _slots_for(parts.netloc)
+        reauthed = False
+        attempt = 0
+
+        while True:
+            cookies = self.session.cookies.get_dict()
+            started = time.monotonic()
+            try:
+                with slots:
+                    response = self.session.request(method, url, **kwargs)
+            except requests.ConnectionError as e:
+                retry = attempt < RETRIES
+                self._record(parts.path, time.monotonic() - started, error=True, retried=retry)
+                if not retry:
+                    raise
+                self._backoff(attempt, parts.path, e)
+                attempt += 1
+                continue
+
+            elapsed = time.monotonic() - started
+            status = response.status_code
+            logger.debug(f"[DROPZONE] {method} {parts.path} -> {status} in {elapsed:.2f}s")
+
+            if status == 401 and self.reauth and not reauthed:
+                self._record(parts.path, elapsed, error=True)
+                logger.info(f"[DROPZONE] 401 on {parts.path} for {self.account}, renewing cookies")
+                self._refresh_auth(cookies)
+                reauthed = True
+                continue
+
+            if status in RETRY_STATUSES and attempt < RETRIES:
+                self._record(parts.path, elapsed, error=True, retried=True)
+                self._backoff(attempt, parts.path, f"HTTP {status}", response.headers.get("Retry-After"))
+                attempt += 1
+                continue
+
+            self._record(parts.path, elapsed, error=status >= 400)
+            if status != 401:
+                self._auth_until = time.monotonic() + SESSION_TTL
+            return response
+
+    def _backoff(self, attempt, path, reason, retry_after=None):
+        delay = BACKOFF * (2 ** attempt) * (1 + random.random() / 2)
+        if retry_after and str(retry_after).isdigit():
+            delay = max(delay, float(retry_after))
+        logger.warning(
+            f"[DROPZONE] {path} failed ({reason}), retry {attempt + 1}/{RETRIES} in {delay:.1f}s"
+        )
+        time.sleep(delay)
+
+    # --- Metrics ---
+
+    def _record(self, path, seconds, error=False, retried=False):
+        with self._metrics_lock:
+            m = self._metrics.setdefault(
+                path, {"calls": 0, "errors": 0, "retries": 0, "seconds": 0.0, "max_seconds": 0.0}
+            )
+            m["calls"] += 1
+            m["errors"] += int(error)
+            m["retries"] += int(retried)
+            m["seconds"] += seconds
+            m["max_seconds"] = max(m["max_seconds"], seconds)
+
+    def metrics(self) -> dict:
+        """{path: {calls, errors, retries, seconds, max_seconds}} since the last reset."""
+        with self._metrics_lock:
+            return {path: dict(m) for path, m in self._metrics.items()}
+
+    def log_metrics(self, reset=True):
+        """One INFO line per endpoint called; clears the counters unless reset=False."""
+        with self._metrics_lock:
+            snapshot, self._metrics = self._metrics, ({} if reset else self._metrics)
+        for path, m in sorted(snapshot.items()):
+            avg = m["seconds"] / m["calls"] if m["calls"] else 0.0
+            logger.info(
+                f"[DROPZONE] account={self.account} {path}: calls={m['calls']} "
+                f"errors={m['errors']} retries={m['retries']} "
+                f"avg={avg:.2f}s max={m['max_seconds']:.2f}s"
+            )
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_clients_pid = os.getpid()
+
+
+def client_for(account) -> DropzoneClient:
+    """The process's DropzoneClient for a Dropzone account (its username)."""
+    global _clients, _clients_pid
+    with _clients_lock:
+        # Sockets must not cross a fork (gunicorn --preload, Celery prefork)
+        if _clients_pid != os.getpid():
+            _clients = {}
+            _clients_pid = os.getpid()
+        client = _clients.get(account)
+        if client is None:
+            client = _clients[account] = DropzoneClient(account)
+        return client
+
+
+def http_session(username, password) -> DropzoneClient:
+    """The account's client, logged in over HTTP unless its session is still fresh."""
+    return client_for(username).ensure_login(username, password)
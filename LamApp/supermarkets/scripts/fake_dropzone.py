@@ -0,0 +1,345 @@
+# LamApp/supermarkets/scripts/fake_dropzone.py
+"""
+Local stand-in for dropzone.pac2000a.it, for load-testing the scrapers offline.
+
+Serves the login form and the JSON endpoints the HTTP scrapers call, with
+synthetic data that has the real responses' field names:
+
+  GET  /                                        login form, or the home page once logged in
+  POST /login.php                               sets the session cookie
+  POST /anagrafiche/Listino_callV2.php          listino rows, per RepartoIn
+  POST /anagrafiche/ArticoliDecodifica_call.php product decodifica
+  POST /articoli/codiciBarre/CodiciBarreProxyAbs_call.php   barcodes
+  POST /fteweb/ScorporoAmministrativo_call.php  DDT headers
+  POST /fteweb/fatture_righe_data.php           DDT line items
+  POST /rilevazioni/RilevazioniTestate_call.php loss testate, per day
+  POST /rilevazioni/RilevazioniRighe_call.php   loss righe, per testata
+
+Recorded responses replace the synthetic ones: with fixtures_dir set, a file
+named after the endpoint (Listino_callV2.json, fatture_righe_data.json, ...)
+is served as is for every call to it.
+
+Calls without a live session cookie get a 401, like an expired Dropzone
+session. Knobs for load tests: latency/jitter per response, failure_rate (that
+share of API calls answered with failure_status), and session_requests (a
+session expires after that many API calls, to exercise re-login).
+
+Point the scrapers at it with DROPZONE_BASE_URL, or set
+dropzone_client.BASE_URL in-process. See bench_scraping.py.
+
+Usage:
+    python fake_dropzone.py --port 8765 --latency 0.05 --failure-rate 0.02
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><body>
+<form action="login.php" method="post">
+  <input type="hidden" name="token" value="{token}">
+  <input id="username" name="username" type="text">
+  <input id="password" name="password" type="password">
+  <input type="submit" value="Accedi">
+</form>
+</body></html>"""
+
+HOME_PAGE = """<!DOCTYPE html>
+<html><body><div id="carta31">Ordini</div><div id="carta2">Documenti</div></body></html>"""
+
+LOSS_TYPES = ("ROTTURE", "SCADUTO", "UTILIZZO INTERNO")
+DESC_MAGS = ("GENERI VARI", "DEPERIBILI", "SURGELATI")
+
+
+class FakeDropzone:
+    """A Dropzone stand-in on a background thread. Use start()/stop() or `with`."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+                 failure_rate=0.0, failure_status=503, session_requests=0,
+                 listino_size=3000, ddt_count=40, righe_per_ddt=60,
+                 testate_per_day=1, righe_per_testata=30, fixtures_dir=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.session_requests = session_requests
+        self.listino_size = listino_size
+        self.ddt_count = ddt_count
+        self.righe_per_ddt = righe_per_ddt
+        self.testate_per_day = testate_per_day
+        self.righe_per_testata = righe_per_testata
+        self.fixtures_dir = Path(fixtures_dir) if fixtures_dir else None
+        self.seed = seed
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sessions = {}     # session id -> API calls left (None: unlimited)
+        self.calls = {}         # path -> count, every request served
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+        self._api = {
+            "/anagrafiche/Listino_callV2.php": self._listino,
+            "/anagrafiche/ArticoliDecodifica_call.php": self._decodifica,
+            "/articoli/codiciBarre/CodiciBarreProxyAbs_call.php": self._barcodes,
+            "/fteweb/ScorporoAmministrativo_call.php": self._scorporo,
+            "/fteweb/fatture_righe_data.php": self._righe,
+            "/rilevazioni/RilevazioniTestate_call.php": self._testate,
+            "/rilevazioni/RilevazioniRighe_call.php": self._rilevazioni_righe,
+        }
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- Sessions ---
+
+    def _new_session(self):
+        sid = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[sid] = self.session_requests or None
+        return sid
+
+    def _use_session(self, sid) -> bool:
+        with self._lock:
+            if sid not in self._sessions:
+                return False
+            left = self._sessions[sid]
+            if left is not None:
+                if left <= 0:
+                    del self._sessions[sid]
+                    return False
+                self._sessions[sid] = left - 1
+            return True
+
+    # --- Synthetic responses ---
+
+    def _fixture(self, path):
+        if self.fixtures_dir is None:
+            return None
+        candidate = self.fixtures_dir / (Path(path).stem + ".json")
+        if candidate.exists():
+            return json.loads(candidate.read_text(encoding="utf-8"))
+        return None
+
+    def _listino(self, form):
+        rows = []
+        for reparto in (form.get("RepartoIn") or "0").split(","):
+            reparto = int(reparto or 0)
+            rows.append({"arIDArticolo": "0", "arDescrizione": f"REPARTO {reparto}"})
+            for i in range(self.listino_size):
+                cod = reparto * 100000 + i + 1
+                rows.append({
+                    "arIDArticolo": str(cod),
+                    "arCodiceArticolo": str(cod),
+                    "arVarianteArticolo": str(1 + i % 3),
+                    "arDescrizione": f"ARTICOLO {cod}",
+                    "Imballo": str(6 + i % 18),
+                    "arRapportoCessioneVendita": "1",
+                    "disponibilita2": "Si" if i % 17 else "No",
+                    "cessione": f"{1 + (i % 500) / 100:.2f}",
+                    "vendita": f"{1.5 + (i % 500) / 80:.2f}",
+                    "reDescrizione": f"CATEGORIA {i % 40}",
+                })
+        return rows
+
+    def _decodifica(self, form):
+        barcode = form.get("CodiceBarre") or ""
+        cod = form.get("CodiceArticolo") or str(int(barcode) % 1000000 if barcode.isdigit() else 0)
+        return {
+            "IDArticolo": cod,
+            "CodiceArticolo": cod,
+            "VarianteArticolo": form.get("VarianteArticolo") or "1",
+            "Descrizione": f"ARTICOLO {cod}",
+            "Imballo": "12",
+            "RapportoCessioneVendita": "1",
+            "disponibilita2": "Si",
+            "cessione": "1.20",
+            "vendita": "1.99",
+            "DexReparto": "CATEGORIA 1",
+        }
+
+    def _barcodes(self, form):
+        return [{"CodiceBarre": str(8000000000000 + int(form.get("IDArticolo") or 0))}]
+
+    def _scorporo(self, form):
+        day = form.get("X5DDOCda", "20240101")
+        return [
+            {
+                "X5CAZN": "01", "X5CNAT": "DT", "X5NBAA": day[:4], "X5CTAG": "A",
+                "X5NRCT": "1", "X5NRCC": f"{n + 1:08d}", "X5NRCD": "1", "X5DDOC": day,
+            }
+            for n in range(self.ddt_count)
+        ]
+
+    def _righe(self, form):
+        invoice = int(form.get("uanrcc") or 0)
+        desc_mag = DESC_MAGS[invoice % len(DESC_MAGS)]
+        return [
+            {
+                "UACART": str(100000 + (invoice * 37 + i) % 20000),
+                "UACDAR": "1",
+                "DescMag": desc_mag,
+                "UAQESP": str(1 + i % 12),
+                "UAXART": f"ARTICOLO {i}",
+            }
+            for i in range(self.righe_per_ddt)
+        ]
+
+    def _testate(self, form):
+        day = form.get("Dal", "")
+        seed = sum(ord(c) for c in day)
+        return [
+            {
+                "RilevazioniTestateDescRilevazione": LOSS_TYPES[(seed + n) % len(LOSS_TYPES)],
+                "RilevazioniTestateIDRilevazioniTestata": str(seed * 100 + n),
+                "numRighe": str(self.righe_per_testata),
+            }
+            for n in range(self.testate_per_day)
+        ]
+
+    def _rilevazioni_righe(self, form):
+        testata = int(form.get("IDRilevazioniTestata") or 0)
+        return [
+            {
+                "RilevazioniRigheCodiceBarre": str(8000000000000 + (testata + i) % 20000),
+                "RilevazioniRigheDescrizione": f"ARTICOLO {i}",
+                "RilevazioniRigheQuantitaOriginale": str(1 + i % 4),
+            }
+            for i in range(self.righe_per_testata)
+        ]
+
+    # --- HTTP ---
+
+    def _delay(self):
+        with self._lock:
+            extra = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+            fail = self.failure_rate and self._random.random() < self.failure_rate
+        if self.latency or extra:
+            time.sleep(self.latency + extra)
+        return fail
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive, like the real host
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json", headers=()):
+                data = body.encode("utf-8") if isinstance(body, str) else body
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _session_id(self):
+                for part in (self.headers.get("Cookie") or "").split(";"):
+                    name, _, value = part.strip().partition("=")
+                    if name == "PHPSESSID":
+                        return value
+                return None
+
+            def _count(self, path):
+                with fake._lock:
+                    fake.calls[path] = fake.calls.get(path, 0) + 1
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                self._count(path)
+                if path != "/":
+                    return self._send(404, "{}")
+                with fake._lock:
+                    logged_in = self._session_id() in fake._sessions
+                page = HOME_PAGE if logged_in else LOGIN_PAGE.format(token=uuid.uuid4().hex)
+                self._send(200, page, "text/html; charset=utf-8")
+
+            def do_POST(self):
+                path = urlsplit(self.path).path
+                self._count(path)
+                length = int(self.headers.get("Content-Length") or 0)
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+
+                if path == "/login.php":
+                    if not form.get("username") or not form.get("password"):
+                        return self._send(200, LOGIN_PAGE.format(token="retry"), "text/html; charset=utf-8")
+                    sid = fake._new_session()
+                    return self._send(
+                        200, HOME_PAGE, "text/html; charset=utf-8",
+                        headers=[("Set-Cookie", f"PHPSESSID={sid}; Path=/")],
+                    )
+
+                handler = fake._api.get(path)
+                if handler is None:
+                    return self._send(404, "{}")
+                if not fake._use_session(self._session_id()):
+                    return self._send(401, '{"error": "session expired"}')
+                if fake._delay():
+                    return self._send(fake.failure_status, '{"error": "injected failure"}')
+
+                payload = fake._fixture(path)
+                if payload is None:
+                    payload = handler(form)
+                self._send(200, json.dumps(payload))
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local Dropzone stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds, at random")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of API calls that fail")
+    parser.add_argument("--failure-status", type=int, default=503)
+    parser.add_argument("--session-requests", type=int, default=0,
+                        help="API calls a session survives (0: unlimited)")
+    parser.add_argument("--fixtures", help="directory of recorded <endpoint>.json responses")
+    args = parser.parse_args()
+
+    fake = FakeDropzone(
+        host=args.host, port=args.port, latency=args.latency, jitter=args.jitter,
+        failure_rate=args.failure_rate, failure_status=args.failure_status,
+        session_requests=args.session_requests, fixtures_dir=args.fixtures,
+    )
+    print(f"Fake Dropzone on {fake.base_url} — export DROPZONE_BASE_URL={fake.base_url}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
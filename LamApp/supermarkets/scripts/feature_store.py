@@ -0,0 +1,85 @@
+# LamApp/supermarkets/scripts/feature_store.py
+"""
+Per-product demand features shared by the order run and the calibration report.
+
+Both derive the same three numbers from a product's completed days: the
+recency-weighted average (avg_daily_sales_from_sales_sets), the trend
+(calculate_deviation) and the weekday-adjusted sigma (demand_sigma_daily).
+They are kept in the schema's product_features table so whichever runs first
+in a day pays for them and the other reads them back.
+
+A cached row is valid while all of these hold:
+- computed_on is today — sigma's weekday alignment moves with the date, and the
+  midnight roll shifts every product's history by one slot;
+- closure_key matches the current closure mask, which sigma depends on;
+- nothing has rewritten the product's completed days since. The writers that
+  do — the day roll and internal-use losses — delete the product's row.
+Realtime sales and deliveries only touch the running day (slot 0) and
+bought_sets, which no feature reads.
+
+Histories that a caller has altered for one run (a linked product's merged
+sales, a just-ended promo sliced out) are computed alongside but never stored.
+"""
+import logging
+from datetime import date
+
+from . import batch_stats
+
+logger = logging.getLogger(__name__)
+
+
+def closure_key(closure_mask) -> str:
+    """Compact, comparable form of a closure mask: '0010...'."""
+    return "".join("1" if c else "0" for c in (closure_mask or []))
+
+
+def compute_features(histories, closure_mask, today=None) -> list:
+    """(avg_from_sets, deviation, sigma_daily) for each completed-day history."""
+    if not histories:
+        return []
+    winsorized = batch_stats.winsorize_matrix(batch_stats.sales_matrix(histories))
+    avgs = batch_stats.avg_daily_sales_batch(winsorized)
+    deviations = batch_stats.deviation_batch(winsorized)
+    sigmas = batch_stats.demand_sigma_batch(winsorized, closure_mask, today=today)
+    return [
+        (None if avgs[i] != avgs[i] else float(avgs[i]), deviations[i], sigmas[i])
+        for i in range(len(histories))
+    ]
+
+
+def demand_features(db, items, closure_mask) -> list:
+    """
+    Features for items = [(cod, v, history, cacheable), ...], in order.
+
+    history is the product's completed days (Helper.sales_history), newest first.
+    Cacheable items are read from product_features where still valid; every miss
+    is computed in one matrix pass and, if cacheable, written back.
+    """
+    today = date.today()
+    key = closure_key(closure_mask)
+
+    cacheable = [(cod, v) for cod, v, _, ok in items if ok]
+    cached = db.get_product_features(cacheable, today, key) if cacheable else {}
+
+    missing = [i for i, (cod, v, _, ok) in enumerate(items) if not (ok and (cod, v) in cached)]
+    computed = compute_features([items[i][2] for i in missing], closure_mask, today=today)
+
+    results = [None] * len(items)
+    to_store = []
+    for i, features in zip(missing, computed):
+        results[i] = features
+        cod, v, _, ok = items[i]
+        if ok:
+            to_store.append((cod, v) + features)
+    for i, (cod, v, _, ok) in enumerate(items):
+        if results[i] is None:
+            results[i] = cached[(cod, v)]
+
+    if to_store:
+        db.store_product_features(to_store, today, key)
+
+    logger.info(
+        f"[FEATURES] schema={db.schema} products={len(items)} "
+        f"cached={len(items) - len(missing)} computed={len(missing)} stored={len(to_store)}"
+    )
+    return results
@@ -20,6 +20,9 @@ def verify_lost_stock_from_excel_combined(db: DatabaseManager, internal_spread_d
     internal_spread_days is the gap between this UTILIZZO INTERNO rilevazione and the
     previous one; register_losses spreads the batch back over that many days instead of
     spiking a single one. Ignored for the other loss types.
+
+    Each file is resolved with one EAN lookup and registered with one
+    register_losses_bulk call, so a file costs a few round-trips whatever its length.
     """
     EAN_COL = "EAN"
     STOCK_COL = "Quantity"
@@ -95,40 +98,52 @@ def verify_lost_stock_from_excel_combined(db: DatabaseManager, internal_spread_d
             absent_count = 0
             error_count = 0
 
+            wanted = []  # (ean, delta), file order
             for _, row in combined.iterrows():
-                ean = row[EAN_COL]
                 delta = int(row[STOCK_COL])
+                if delta != 0:
+                    wanted.append((row[EAN_COL], delta))
 
-                if delta == 0:
-                    continue
+            products = db.get_cod_v_by_eans([ean for ean, _ in wanted])
 
-                product = db.get_cod_v_by_ean(ean)
+            matched = []  # (ean, delta, product)
+            for ean, delta in wanted:
+                product = products.get(ean)
                 if product is None:
                     logger.info(f"  EAN {ean} x{delta} — not found in database (skipped)")
                     absent_count += 1
                     absent_eans.append({'ean': ean, 'qty': delta, 'loss_type': loss_type})
-                    continue
+                else:
+                    matched.append((ean, delta, product))
+
+            try:
+                results = db.register_losses_bulk(
+                    [(p['cod'], p['v'], delta) for _, delta, p in matched],
+                    loss_type, spread_days=internal_spread_days
+                )
+            except Exception as e:
+                logger.warning(f"Error registering {len(matched)} losses from {file_name}: {type(e).__name__}: {e}")
+                error_count += len(matched)
+                results = []
 
+            for (ean, delta, product), result in zip(matched, results):
                 cod = product['cod']
                 v = product['v']
                 settore = product['settore']
                 descrizione = product['descrizione']
 
-                try:
-                    db.register_losses(cod, v, delta, loss_type, spread_days=internal_spread_days)
-                    processed_count += 1
-                    total_losses += delta
-                    logger.info(f"  {loss_type}: EAN {ean} ({descrizione}) x{delta}")
-
-                    by_settore.setdefault(settore, {}).setdefault(loss_type, []).append({
-                        'cod': cod, 'v': v, 'descrizione': descrizione, 'qty': delta
-                    })
-                except ValueError as e:
+                if result['action'] in ('not_found', 'invalid'):
                     logger.info(f"  EAN {ean} ({cod}.{v}) — not in product_stats (skipped)")
                     absent_count += 1
-                except Exception as e:
-                    logger.warning(f"Error processing EAN {ean} ({cod}.{v}): {type(e).__name__}: {e}")
-                    error_count += 1
+                    continue
+
+                processed_count += 1
+                total_losses += delta
+                logger.info(f"  {loss_type}: EAN {ean} ({descrizione}) x{delta}")
+
+                by_settore.setdefault(settore, {}).setdefault(loss_type, []).append({
+                    'cod': cod, 'v': v, 'descrizione': descrizione, 'qty': delta
+                })
 
             logger.info(f"Processed {file_name}: {processed_count} losses registered, {absent_count} skipped, {error_count} errors")
             files_processed += 1
@@ -261,27 +276,41 @@ def process_loss_csv_dropzone(db: DatabaseManager, csv_path: str, loss_type: str
     total_losses = 0
     absent_eans = []
 
+    wanted = []  # (ean, delta), file order
     for _, row in combined.iterrows():
-        ean = str(row[EAN_COL]).strip()
         delta = int(row[QTY_COL])
-        if delta == 0:
-            continue
+        if delta != 0:
+            wanted.append((str(row[EAN_COL]).strip(), delta))
+
+    products = db.get_cod_v_by_eans([ean for ean, _ in wanted])
 
-        product = db.get_cod_v_by_ean(ean)
+    matched = []
+    for ean, delta in wanted:
+        product = products.get(ean)
         if product is None:
             logger.info(f"EAN {ean} x{delta} — not found in database (skipped)")
             absent_count += 1
             absent_eans.append({'ean': ean, 'qty': delta})
-            continue
+        else:
+            matched.append((ean, delta, product))
 
-        try:
-            db.register_losses(product['cod'], product['v'], delta, loss_type)
-            logger.info(f"  {loss_type}: EAN {ean} ({product['descrizione']}) x{delta}")
-            processed_count += 1
-            total_losses += delta
-        except Exception as e:
-            logger.warning(f"Error registering loss for EAN {ean}: {e}")
+    try:
+        results = db.register_losses_bulk(
+            [(p['cod'], p['v'], delta) for _, delta, p in matched], loss_type
+        )
+    except Exception as e:
+        logger.warning(f"Error registering {len(matched)} losses: {e}")
+        error_count += len(matched)
+        results = []
+
+    for (ean, delta, product), result in zip(matched, results):
+        if result['action'] in ('not_found', 'invalid'):
+            logger.warning(f"Error registering loss for EAN {ean}: {result['error']}")
             error_count += 1
+            continue
+        logger.info(f"  {loss_type}: EAN {ean} ({product['descrizione']}) x{delta}")
+        processed_count += 1
+        total_losses += delta
 
     return {
         'success': True,
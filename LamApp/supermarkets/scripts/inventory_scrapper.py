@@ -7,14 +7,15 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
-import os, uuid
+import os, uuid, shutil
 import sys
 from django.conf import settings
 import logging
-import requests
 import csv
 from datetime import date, timedelta
 
+from . import dropzone_client
+
 logger = logging.getLogger(__name__)
 
 # Save path for loss files (ROTTURE, SCADUTO, UTILIZZO INTERNO)
@@ -31,11 +32,22 @@ CSV_COLUMN_MAP = {
 
 class Inventory_Scrapper:
 
-    def __init__(self, supermarket, username: str, password: str) -> None:
+    def __init__(self, supermarket, username: str, password: str, browser: bool = None) -> None:
         self.supermarket = supermarket
         self.username = username
         self.password = password
         self.id_cliente = self.supermarket.id_cliente
+        self.session = None
+
+        # The export is plain HTTP; Chrome is only needed to log in, and not
+        # even for that with DROPZONE_HTTP_LOGIN on
+        if browser is None:
+            browser = not dropzone_client.HTTP_LOGIN
+        self.driver = None
+        self.user_data_dir = None
+        if not browser:
+            return
+
         # Set up the Selenium WebDriver
 
         self.user_data_dir = f"/tmp/chrome-{uuid.uuid4()}"
@@ -85,9 +97,21 @@ class Inventory_Scrapper:
         self.wait = WebDriverWait(self.driver, 10)
         self.actions = ActionChains(self.driver)
 
+    def close(self):
+        """Quit the browser, if any, and remove its profile directory."""
+        if self.driver is not None:
+            self.driver.quit()
+        if self.user_data_dir:
+            shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
     def login(self):
         """Login to Dropzone"""
         logger.info("Logging in to Dropzone...")
+        if self.driver is None:
+            self.session = dropzone_client.http_session(self.username, self.password)
+            logger.info(" Login successful")
+            return
+
         self.driver.get('https://dropzone.pac2000a.it/')
 
         # Wait for login page
@@ -102,7 +126,7 @@ class Inventory_Scrapper:
         password_field.send_keys(self.password)
         self.actions.send_keys(Keys.ENTER)
         self.actions.perform()
-        
+
         logger.info(" Login successful")
     
     def export_all_testate_from_day(self, max_days_back: int = 30):
@@ -113,9 +137,9 @@ class Inventory_Scrapper:
         """
         from ..models import LossSyncState
 
-        session = requests.Session()
-        for c in self.driver.get_cookies():
-            session.cookies.set(c["name"], c["value"])
+        session = self.session
+        if session is None:
+            session = self.session = dropzone_client.client_for(self.username).use_browser(self.driver)
 
         headers = {
             "Accept": "application/json, text/javascript, */*; q=0.01",
@@ -125,8 +149,8 @@ class Inventory_Scrapper:
             "User-Agent": "Mozilla/5.0",
         }
 
-        url_testate = "https://dropzone.pac2000a.it/rilevazioni/RilevazioniTestate_call.php"
-        url_righe = "https://dropzone.pac2000a.it/rilevazioni/RilevazioniRighe_call.php"
+        url_testate = f"{dropzone_client.BASE_URL}/rilevazioni/RilevazioniTestate_call.php"
+        url_righe = f"{dropzone_client.BASE_URL}/rilevazioni/RilevazioniRighe_call.php"
         ALLOWED_TYPES = {"ROTTURE", "SCADUTO", "UTILIZZO INTERNO"}
 
         sync_state, _ = LossSyncState.objects.get_or_create(supermarket=self.supermarket)
@@ -221,4 +245,5 @@ class Inventory_Scrapper:
                 sync_state.last_date_utilizzo_interno = first_date_found[desc]
 
         sync_state.save()
+        session.log_metrics()
         logger.info("All available testate exported.")
\ No newline at end of file
@@ -1,17 +1,16 @@
 # LamApp/supermarkets/scripts/orderer.py - WITH SKIP TRACKING
-from selenium.webdriver.chrome.options import Options
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import TimeoutException
 import time
 import re
-import os, uuid, shutil
 import logging
 
+from . import browser_pool
+
 # Use Django's logging system
 logger = logging.getLogger(__name__)
 
@@ -29,54 +28,49 @@ class Orderer:
         self.username = username
         self.password = password
         
-        self.user_data_dir = f"/tmp/chrome-{uuid.uuid4()}"
-        os.makedirs(self.user_data_dir, exist_ok=True)
-        os.chmod(self.user_data_dir, 0o700)
-
-        os.environ["HOME"] = self.user_data_dir
-        os.environ["XDG_RUNTIME_DIR"] = self.user_data_dir
-
-        # Set up the Selenium WebDriver
-        chrome_options = Options()
-        chrome_options.binary_location = "/usr/bin/google-chrome"
-        chrome_options.add_argument("--headless=new")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-setuid-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--disable-software-rasterizer")
-        chrome_options.add_argument("--window-size=1920,1080")
-        chrome_options.add_experimental_option('excludeSwitches', ['enable-logging'])
-        chrome_options.add_argument('--log-level=3')
-
-        # Set a writable directory for Chrome to use
-        chrome_options.add_argument(f"--user-data-dir={self.user_data_dir}")
-
-        service = Service()
-
-        self.driver = webdriver.Chrome(service=service, options=chrome_options)
+        # A warm browser from the worker's pool, possibly still logged in
+        self.browser = browser_pool.lease(username)
+        self.driver = self.browser.driver
+        self.user_data_dir = self.browser.user_data_dir
         self.wait = WebDriverWait(self.driver, 300)
         self.actions = ActionChains(self.driver)
         
         # Track products skipped during ordering phase
         self.order_skipped_products = []
         
+    def close(self):
+        """Hand the browser back to the pool."""
+        if self.driver is not None:
+            browser_pool.release(self.browser)
+            self.driver = None
+
     def login(self):
         """Login to Dropzone"""
         self.driver.get('https://dropzone.pac2000a.it/')
 
-        # Wait for the page to fully load
-        self.wait.until(
-            EC.presence_of_element_located((By.ID, "username"))
-        )
+        # Wait for the page to fully load: the login form, or the home page of a
+        # pooled browser whose session is still open
+        self.wait.until(EC.any_of(
+            EC.presence_of_element_located((By.ID, "username")),
+            EC.presence_of_element_located((By.ID, "carta31")),
+        ))
+
+        # A session left open by another account is not ours to reuse
+        if not self.driver.find_elements(By.ID, "username") and self.browser.account != self.username:
+            logger.info("Browser holds a Dropzone session for another account, logging out")
+            self.browser.clear_session()
+            self.driver.get('https://dropzone.pac2000a.it/')
+            self.wait.until(EC.presence_of_element_located((By.ID, "username")))
 
         # Login
-        username_field = self.driver.find_element(By.ID, "username")
-        password_field = self.driver.find_element(By.ID, "password")
-        username_field.send_keys(self.username)
-        password_field.send_keys(self.password)
-        self.actions.send_keys(Keys.ENTER)
-        self.actions.perform()
+        if self.driver.find_elements(By.ID, "username"):
+            username_field = self.driver.find_element(By.ID, "username")
+            password_field = self.driver.find_element(By.ID, "password")
+            username_field.send_keys(self.username)
+            password_field.send_keys(self.password)
+            self.actions.send_keys(Keys.ENTER)
+            self.actions.perform()
+            self.browser.account = self.username
 
         self.wait.until(
             EC.presence_of_element_located((By.ID, "carta31"))
@@ -128,6 +122,96 @@ class Orderer:
 
         time.sleep(0.2)
 
+    # Picks the storage's item straight from the magazzini combo box. Returns the
+    # combo's value afterwards, or null when no item carries that label.
+    SELECT_STORAGE_JS = """
+        const combo = document.getElementById('magazziniInsert');
+        if (!combo) return null;
+        const wanted = arguments[0];
+        const item = Array.from(combo.querySelectorAll('smart-list-item')).find(
+            i => ((i.label || i.getAttribute('label') || i.textContent) || '').trim() === wanted
+        );
+        if (!item) return null;
+        if (typeof combo.select === 'function') {
+            combo.select(item);
+        } else {
+            combo.selectedValues = [item.value];
+        }
+        return combo.value;
+    """
+
+    def _select_storage(self, desired_value: str):
+        """
+        Select the storage in the magazzini combo box: directly through the
+        component when it knows the label, otherwise by stepping through the
+        list with the arrow keys until the value matches.
+        """
+        combo_box_element = self.driver.find_element(By.ID, "magazziniInsert")
+
+        if self.driver.execute_script(self.SELECT_STORAGE_JS, desired_value) == desired_value:
+            self.actions.send_keys(Keys.ESCAPE)
+            self.actions.perform()
+            return
+
+        logger.info(f"Direct selection of '{desired_value}' failed, stepping through the list")
+        for key in (Keys.ARROW_DOWN, Keys.ARROW_DOWN, Keys.ARROW_UP, Keys.ARROW_UP):
+            self.actions.send_keys(key)
+            self.actions.perform()
+            time.sleep(0.5)
+        seen = set()
+        while True:
+            input_value = combo_box_element.get_attribute("value")
+            if input_value == desired_value:
+                self.actions.send_keys(Keys.ESCAPE)
+                self.actions.perform()
+                return
+            if input_value in seen:
+                raise ValueError(f"Storage '{desired_value}' not found in the ordering system")
+            seen.add(input_value)
+            self.actions.send_keys(Keys.ARROW_DOWN)
+            self.actions.perform()
+            # The value changes once the combo has moved to the next item
+            try:
+                WebDriverWait(self.driver, 2).until(
+                    lambda d: combo_box_element.get_attribute("value") != input_value
+                )
+            except TimeoutException:
+                pass
+
+    @staticmethod
+    def _as_number(text):
+        """An input's text as a float ("12", "12,00", "1.200,5"), or None if it isn't one."""
+        text = str(text).strip().replace("\u00a0", "").replace(" ", "")
+        if "," in text:
+            text = text.replace(".", "").replace(",", ".")
+        try:
+            return float(text)
+        except ValueError:
+            return None
+
+    @classmethod
+    def _shows(cls, shown, value) -> bool:
+        """Whether an input reading `shown` holds `value`, allowing for number formatting."""
+        if shown is None:
+            return False
+        if shown == str(value):
+            return True
+        number = cls._as_number(shown)
+        return number is not None and number == cls._as_number(value)
+
+    def _fill(self, field, value):
+        """Type value into an input and wait until the input shows it."""
+        field.send_keys(Keys.CONTROL + 'a', value)
+        try:
+            WebDriverWait(self.driver, 2, poll_frequency=0.05).until(
+                lambda d: self._shows(field.get_attribute("value"), value)
+            )
+        except TimeoutException:
+            # Carry on as before, but leave a trace if the order comes out wrong
+            logger.warning(
+                f"Input still reads {field.get_attribute('value')!r} 2s after typing {value!r}"
+            )
+
     def make_orders(self, storage: str, order_list: tuple):
         """
         Make orders with skip tracking.
@@ -136,76 +220,40 @@ class Orderer:
         NOTE: These are products skipped DURING ORDER EXECUTION (e.g., system disabled)
         This is different from decision_maker's skipped_products (skipped during calculation)
         """
+        # One Orderer makes every storage's order, and each call reports its own skips
+        self.order_skipped_products = []
 
         desired_value = re.sub(r'^\d+\s+', '', storage)
 
         self.wait.until(
-            EC.presence_of_element_located((By.ID, "newRowButtonMenuSopra"))
-        )
-
-        order_button = self.driver.find_element(By.ID, "newRowButtonMenuSopra")
-        order_button.click()
-
-        time.sleep(1)
+            EC.element_to_be_clickable((By.ID, "newRowButtonMenuSopra"))
+        ).click()
 
         # Step 1: Wait for the modal to appear
-        modal_container = self.wait.until(
+        self.wait.until(
             EC.visibility_of_element_located((By.ID, "finestraInsertOrdini"))
         )
 
         # Step 2: Wait for the button inside the modal using XPath
-        button_inside_modal = self.wait.until(
+        self.wait.until(
             EC.element_to_be_clickable((By.XPATH, "//*[@id='IDCodiceClienteBis']/div[1]/div/div[1]/span[2]"))
-        )
-
-        button_inside_modal.click()
+        ).click()
 
         xpath = "/html/body/div[2]/div[2]/div[5]/div/div/div/div[2]/div/form/div[1]/div/smart-combo-box/div[1]/div/div[2]/smart-list-box/div[1]/div[2]/div[2]/smart-list-item"
 
-        element = self.wait.until(
+        self.wait.until(
             EC.element_to_be_clickable((By.XPATH, xpath))
-        )
-
-        element.click()
-
-        time.sleep(0.2)
+        ).click()
 
-        button_inside_modal2 = self.wait.until(
+        self.wait.until(
             EC.element_to_be_clickable((By.XPATH, "//*[@id='magazziniInsert']/div[1]/div/div[1]/span[2]"))
-        )
+        ).click()
 
-        button_inside_modal2.click()
-
-        time.sleep(0.2)
-
-        combo_box_element = self.driver.find_element(By.ID, "magazziniInsert")
-        self.actions.send_keys(Keys.ARROW_DOWN)
-        self.actions.perform()
-        time.sleep(0.5)
-        self.actions.send_keys(Keys.ARROW_DOWN)
-        self.actions.perform()
-        time.sleep(0.5)
-        self.actions.send_keys(Keys.ARROW_UP)
-        self.actions.perform()
-        time.sleep(0.5)
-        self.actions.send_keys(Keys.ARROW_UP)
-        self.actions.perform()
-        time.sleep(0.5)
-        
-        while True:
-            input_value = combo_box_element.get_attribute("value")
-            if input_value == desired_value:
-                self.actions.send_keys(Keys.ESCAPE)
-                self.actions.perform()
-                break
-            self.actions.send_keys(Keys.ARROW_DOWN)
-            self.actions.perform()
-            time.sleep(0.5)
-            
-        time.sleep(0.2)
+        self._select_storage(desired_value)
 
-        confirm_button = self.driver.find_element(By.XPATH, '//*[@id="confermaInsertTestata"]')
-        confirm_button.click()
+        self.wait.until(
+            EC.element_to_be_clickable((By.XPATH, '//*[@id="confermaInsertTestata"]'))
+        ).click()
 
         self.wait.until(
             lambda driver: len(driver.window_handles) > 2
@@ -213,10 +261,13 @@ class Orderer:
 
         self.driver.switch_to.window(self.driver.window_handles[-1])
 
-        new_order_button = self.driver.find_element(By.ID, "addButtonT")
-        new_order_button.click()
+        self.wait.until(
+            EC.element_to_be_clickable((By.ID, "addButtonT"))
+        ).click()
 
-        time.sleep(0.2)
+        self.wait.until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, "#w_Quantita input"))
+        )
 
         parent_div1 = self.driver.find_element(By.ID, "codArt")
         parent_div2 = self.driver.find_element(By.ID, "varArt")
@@ -226,15 +277,17 @@ class Orderer:
         var_art_field = parent_div2.find_element(By.TAG_NAME, "input")
         stock_size = parent_div3.find_element(By.TAG_NAME, "input")
         search_button = self.driver.find_element(By.XPATH, '/html/body/div[66]/div[2]/form/div[4]/div[2]/div[3]/div')
-        
+
+        label_on = "//div[contains(@class,'jqx-switchbutton-label-on') and contains(@style,'visibility: visible')]"
+        label_off = "//div[contains(@class,'jqx-switchbutton-label-off') and contains(@style,'visibility: visible')]"
+
         successful_orders = []
         
         for order_item in order_list:
             cod_part, var_part, qty_part, discount = order_item
             
-            cod_art_field.send_keys(Keys.CONTROL + 'a', cod_part)
-            var_art_field.send_keys(Keys.CONTROL + 'a', var_part)
-            time.sleep(0.2)
+            self._fill(cod_art_field, cod_part)
+            self._fill(var_art_field, var_part)
             search_button.click()
 
             # Check if product doesn't accept orders (disabled by system).
@@ -242,22 +295,12 @@ class Orderer:
             # entered, label-off can flash visible even for enabled products. We wait until
             # exactly one of the two labels is visible (stable state), then check which one.
             try:
-                WebDriverWait(self.driver, 3).until(
-                    lambda d: bool(
-                        d.find_elements(By.XPATH, "//div[contains(@class,'jqx-switchbutton-label-on') and contains(@style,'visibility: visible')]")
-                    ) != bool(
-                        d.find_elements(By.XPATH, "//div[contains(@class,'jqx-switchbutton-label-off') and contains(@style,'visibility: visible')]")
-                    )
+                WebDriverWait(self.driver, 3, poll_frequency=0.1).until(
+                    lambda d: bool(d.find_elements(By.XPATH, label_on)) != bool(d.find_elements(By.XPATH, label_off))
                 )
             except Exception:
                 pass  # timeout: fall through and read current state anyway
-            is_off = self.driver.find_elements(
-                By.XPATH,
-                "//div[contains(@class, 'jqx-switchbutton-label-off') and contains(@style, 'visibility: visible')]"
-            ) and not self.driver.find_elements(
-                By.XPATH,
-                "//div[contains(@class, 'jqx-switchbutton-label-on') and contains(@style, 'visibility: visible')]"
-            )
+            is_off = self.driver.find_elements(By.XPATH, label_off) and not self.driver.find_elements(By.XPATH, label_on)
             if is_off:
                 logger.info(f"Article {cod_part}.{var_part} doesn't accept orders (disabled in ordering system)")
                 
@@ -268,15 +311,15 @@ class Orderer:
                     'reason': 'Product disabled in ordering system (cannot place order)'
                 })
                 continue
-            stock_size.send_keys(Keys.CONTROL + 'a', qty_part)
-
-            time.sleep(0.2)
+            self._fill(stock_size, qty_part)
 
             confirm_button_order = self.driver.find_element(By.ID, "okModificaRiga")
             confirm_button_order.click()
             successful_orders.append((cod_part, var_part, qty_part, discount))
             
         logger.info(f"Order execution complete: {len(successful_orders)} successful, {len(self.order_skipped_products)} skipped during ordering")
-        self.driver.quit()
-        shutil.rmtree(self.user_data_dir, ignore_errors=True)
-        return successful_orders, self.order_skipped_products
\ No newline at end of file
+
+        # Back to the orders list, ready for the next storage's order
+        self.driver.close()
+        self.driver.switch_to.window(self.driver.window_handles[-1])
+        return successful_orders, self.order_skipped_products
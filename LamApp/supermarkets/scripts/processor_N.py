@@ -2,6 +2,8 @@
 import math
 import logging
 
+import numpy as np
+
 from .helpers import Helper
 
 # Use Django's logging system
@@ -159,4 +161,106 @@ def process_N_sales(package_size, deviation_corrected, avg_daily_sales,
     logger.info(
         f"No order: leftover_stock={leftover_stock} >= minimum_stock={minimum_stock} and stock={stock} not critically low"
     )
-    return None, 0, False, discount
\ No newline at end of file
+    return None, 0, False, discount
+
+
+def process_N_sales_batch(package_size, deviation_corrected, avg_daily_sales,
+                          req_stock, stock, on_sale, minimum_stock_base,
+                          minimum_stock_override, expiry_factor, shelf_life_days,
+                          batch_expiry_factor, sigma_L, safety_z=1.0):
+    """
+    process_N_sales over whole arrays, one element per product. Returns
+    (order, check) arrays; order is 0 where the scalar version returns None.
+
+    Optional per-product inputs are float arrays with NaN for None;
+    batch_expiry_factor and on_sale are boolean arrays. Branch for branch the
+    same arithmetic as process_N_sales, minus the per-product logging. The one
+    power with a float base goes through Python's ** rather than numpy: the two
+    can differ in the last bit, and that bit can move a round().
+    """
+    package_size = np.asarray(package_size, dtype=float)
+    avg = np.asarray(avg_daily_sales, dtype=float)
+    stock = np.asarray(stock, dtype=float)
+    override = np.asarray(minimum_stock_override, dtype=float)
+    sigma_L = np.asarray(sigma_L, dtype=float)
+    expiry_factor = np.asarray(expiry_factor, dtype=float)
+    shelf_life = np.asarray(shelf_life_days, dtype=float)
+    batch_expiry = np.asarray(batch_expiry_factor, dtype=bool)
+    on_sale = np.asarray(on_sale, dtype=bool)
+    deviation_factor = np.array([Helper.deviation_factor(d) for d in deviation_corrected], dtype=float)
+
+    req = np.rint(np.asarray(req_stock, dtype=float))
+    leftover_stock = stock - req
+
+    has_override = ~np.isnan(override)
+    presence_target = np.where(has_override, override, float(minimum_stock_base))
+    minimum_stock = np.zeros(len(req))
+
+    # Measured sigma (above the slow-mover threshold)
+    use_sigma = ~np.isnan(sigma_L) & (avg >= Helper.SLOW_MOVER_THRESHOLD)
+    if use_sigma.any():
+        safety = safety_z * sigma_L[use_sigma]
+        req_s = req[use_sigma]
+        capped = np.where(req_s > 0, np.minimum(safety, req_s), safety)
+        factor = np.where(has_override[use_sigma], 1.0, deviation_factor[use_sigma])
+        adjusted = capped * factor
+        adjusted_sq = np.array([a ** 2 for a in adjusted.tolist()])
+        minimum_stock[use_sigma] = np.rint(np.sqrt(presence_target[use_sigma] ** 2 + adjusted_sq))
+
+    # Override without a usable sigma stands alone
+    override_only = ~use_sigma & has_override
+    minimum_stock[override_only] = presence_target[override_only]
+
+    # Legacy velocity ladder
+    legacy = ~use_sigma & ~has_override
+    if legacy.any():
+        req_l = req[legacy]
+        avg_l = avg[legacy]
+        buff = np.maximum(0, np.rint(np.sqrt(np.maximum(0, req_l - 1))) - 1)
+        velocity_margin = np.where(on_sale[legacy], buff * 3, buff)
+        slow_margin = -np.array([Helper.slow_mover_reduction(a) for a in avg_l.tolist()], dtype=float)
+        demand_margin = np.where(avg_l >= 0.6, velocity_margin, slow_margin)
+
+        legacy_min = minimum_stock_base + demand_margin
+        factor = deviation_factor[legacy]
+        scaled = legacy_min * factor
+        legacy_min = np.where(factor > 1.0, np.floor(scaled),
+                              np.where(factor < 1.0, np.ceil(scaled), legacy_min))
+        minimum_stock[legacy] = np.maximum(1, legacy_min)
+
+    apply_expiry = ~np.isnan(expiry_factor) & ~has_override
+    minimum_stock = np.where(apply_expiry, np.floor(minimum_stock * expiry_factor), minimum_stock)
+
+    has_shelf_life = ~np.isnan(shelf_life)
+    max_safe_buffer = shelf_life * avg - req
+    minimum_stock = np.where(
+        has_shelf_life,
+        np.minimum(minimum_stock, np.maximum(0, np.trunc(max_safe_buffer))),
+        minimum_stock,
+    )
+    shelf_life_has_buffer = has_shelf_life & (max_safe_buffer >= 1)
+
+    minimum_stock = np.where(batch_expiry & (minimum_stock > 1), 1, minimum_stock)
+    minimum_stock = np.maximum(np.where(shelf_life_has_buffer, 1, 0), minimum_stock)
+
+    raw_order = (req + minimum_stock - stock) / package_size
+    positive = raw_order >= 0
+    tollerance_threshold = np.minimum(0.5, minimum_stock / package_size)
+    decimal_part = np.mod(raw_order, 1)
+    round_down = batch_expiry | (decimal_part <= tollerance_threshold)
+    formula_order = np.where(round_down, np.floor(raw_order), np.ceil(raw_order))
+
+    order = np.zeros(len(req), dtype=np.int64)
+    check = np.zeros(len(req), dtype=np.int64)
+
+    by_formula = positive & (formula_order >= 1)
+    forced_leftover = ~by_formula & (leftover_stock < minimum_stock)
+    forced_presence = (~by_formula & ~forced_leftover
+                       & (leftover_stock <= np.minimum(presence_target, minimum_stock)))
+
+    order[by_formula] = formula_order[by_formula]
+    check[by_formula] = 1
+    order[forced_leftover | forced_presence] = 1
+    check[forced_leftover] = 2
+    check[forced_presence] = 3
+    return order, check
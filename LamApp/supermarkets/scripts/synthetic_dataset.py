@@ -0,0 +1,373 @@
+# LamApp/supermarkets/scripts/synthetic_dataset.py
+"""
+Synthetic supermarkets for benchmarking the order run at realistic scale.
+
+Each one is a real schema (bench_sm_01, bench_sm_02, ...) made by
+DatabaseManager.create_tables and filled the way production fills it: the
+catalogue through import_catalogue, promos through update_promos, and the rest
+(product_stats, extra_losses, EANs, shelf lives) in a few bulk statements.
+
+Every product's last 60 days are simulated forward rather than drawn at random,
+so the arrays agree with each other the way real ones do:
+  - demand: a log-normal base rate (mostly slow movers, a few fast ones), a weekday
+    profile, a slow trend, gamma-mixed Poisson noise and promo lifts;
+  - deliveries every 2-4 days depending on the settore, whole packages up to a
+    target, so bought_sets, stock and sales_sets line up;
+  - two store closures (every product sells 0) and censored stock-out days (None);
+  - 24-month sold/bought arrays, extra_losses for part of the catalogue,
+    promos running, upcoming and just ended, and product links between a new
+    product and the one it replaces.
+
+Slot 0 is today, partly sold. The run is deterministic for a given --seed.
+
+ProductLink rows belong to a Supermarket in the Django database, which the
+benchmark does not need: the links are written to the manifest instead, as the
+pairs ProductLink.build_pairs would return, and handed to DecisionMaker as such.
+
+Only schemas named bench_sm_* are ever created or dropped.
+
+Usage (from LamApp/):
+    python -m supermarkets.scripts.synthetic_dataset --supermarkets 3 --products 6000
+    python -m supermarkets.scripts.synthetic_dataset --manifest /tmp/bench.json --seed 7
+    python -m supermarkets.scripts.synthetic_dataset --drop --supermarkets 3
+"""
+import argparse
+import json
+import logging
+import math
+import random
+from datetime import date, timedelta
+
+from psycopg2.extras import Json, execute_values
+
+from .DatabaseManager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PREFIX = "bench_sm_"
+HISTORY_DAYS = DatabaseManager.DAILY_HISTORY_DAYS
+
+# settore -> (share of the catalogue, storage minimum_stock, days between deliveries,
+#             shelf life range in days or None for long-life goods)
+SETTORI = {
+    "GENERI VARI": (0.55, 6, 3, None),
+    "DEPERIBILI": (0.25, 3, 2, (5, 21)),
+    "SURGELATI": (0.20, 4, 4, None),
+}
+CATEGORIES = {
+    "GENERI VARI": ("DROGHERIA ALIMENTARE", "BEVANDE", "CURA PERSONA", "CURA CASA"),
+    "DEPERIBILI": ("LATTICINI", "SALUMI", "ORTOFRUTTA", "PANE"),
+    "SURGELATI": ("SURGELATI", "GELATI"),
+}
+WEEKDAY_WEIGHTS = (0.9, 0.85, 0.9, 1.0, 1.25, 1.45, 0.65)   # Monday first
+MONTH_WEIGHTS = (0.9, 0.88, 0.95, 1.0, 1.02, 1.05, 1.1, 1.12, 1.0, 0.97, 0.98, 1.2)
+PACK_SIZES = (1, 4, 6, 6, 8, 10, 12, 12, 24)
+CLOSED_DAYS_BACK = (19, 46)     # whole store closed: every product sells 0
+TODAY_FRACTION = 0.4            # share of the day already sold at generation time
+
+NEW_PRODUCT_SHARE = 0.08        # history shorter than 60 days
+UNVERIFIED_SHARE = 0.06
+UNAVAILABLE_SHARE = 0.05
+MIN_OVERRIDE_SHARE = 0.05
+PROMO_SHARE = 0.08
+LINK_SHARE = 0.015
+PROMO_LIFT = 1.8
+
+
+def schema_name(index: int) -> str:
+    return f"{SCHEMA_PREFIX}{index:02d}"
+
+
+def _poisson(rng, lam):
+    if lam <= 0:
+        return 0
+    if lam > 30:
+        return max(0, round(rng.gauss(lam, math.sqrt(lam))))
+    limit, k, p = math.exp(-lam), 0, rng.random()
+    while p > limit:
+        k += 1
+        p *= rng.random()
+    return k
+
+
+def _months_back(today, months):
+    """(year, month) `months` before today's month."""
+    index = today.year * 12 + today.month - 1 - months
+    return index // 12, index % 12 + 1
+
+
+def _promo_window(rng, today):
+    """A 14-day promo that is running, starts within a week, or ended up to 14 days ago."""
+    kind = rng.choice(("running", "upcoming", "ended"))
+    if kind == "running":
+        start = today - timedelta(days=rng.randint(0, 12))
+    elif kind == "upcoming":
+        start = today + timedelta(days=rng.randint(1, 6))
+    else:
+        start = today - timedelta(days=13 + rng.randint(1, 14))
+    return start, start + timedelta(days=13)
+
+
+def _simulate(rng, settore, today, history, pkg, rate, promo, verified):
+    """
+    Walk the product's last `history` days oldest first. Returns
+    (sales_sets, bought_sets, stock), newest slot first as in product_stats.
+    """
+    _, min_floor, interval, _ = SETTORI[settore]
+    shape = rng.uniform(1.5, 8.0)           # lower: more overdispersed demand
+    trend = rng.uniform(-0.3, 0.3)          # change across the window
+    target = max(min_floor, math.ceil(rate * interval * 1.5)) + pkg
+    stock = target
+
+    sales = [0] * history
+    bought = [0] * history
+    for back in range(history - 1, -1, -1):
+        day = today - timedelta(days=back)
+        if back % interval == 0 and stock < target:
+            qty = math.ceil((target - stock) / pkg) * pkg
+            bought[back] = qty
+            stock += qty
+        if back in CLOSED_DAYS_BACK:
+            continue
+        if verified and stock == 0 and back > 0:
+            sales[back] = None              # empty shelf: censored, as the day roll does
+            continue
+
+        mean = rate * WEEKDAY_WEIGHTS[day.weekday()] * (1 + trend * (0.5 - back / HISTORY_DAYS))
+        if promo and promo[0] <= day <= promo[1]:
+            mean *= PROMO_LIFT
+        if back == 0:
+            mean *= TODAY_FRACTION
+        sold = min(stock, _poisson(rng, mean * rng.gammavariate(shape, 1 / shape)))
+        sales[back] = sold
+        stock -= sold
+    return sales, bought, stock
+
+
+def _monthly(rng, today, rate, months, current_month_sold, overhead=1.0):
+    """24-month array, current month first: this month's actuals, then seasonal estimates."""
+    out = [round(current_month_sold * overhead)]
+    for m in range(1, months):
+        year, month = _months_back(today, m)
+        days = (date(year + month // 12, month % 12 + 1, 1) - date(year, month, 1)).days
+        out.append(_poisson(rng, rate * days * MONTH_WEIGHTS[month - 1] * overhead))
+    return out
+
+
+def _losses(rng, rate, cost, months=24, per_month=0.05):
+    """extra_losses array, [[qty, cost], ...] per month, current month first."""
+    return [[_poisson(rng, rate * 30 * per_month), cost] for _ in range(months)]
+
+
+def build_supermarket(index: int, products: int, seed: int, today=None) -> dict:
+    """
+    Every row of one synthetic supermarket, in memory. Nothing is written.
+    Keys: catalogue {settore: [import_catalogue record]}, stats, extras, losses,
+    promos, links.
+    """
+    rng = random.Random(f"{seed}:{index}")
+    today = today or date.today()
+
+    catalogue = {settore: [] for settore in SETTORI}
+    stats, extras, losses, promos, new_keys, old_keys = [], [], [], [], {}, {}
+    cod = 100000 + index * 1000000
+    settori = list(SETTORI)
+    weights = [SETTORI[s][0] for s in settori]
+
+    for _ in range(products):
+        cod += rng.randint(1, 9)
+        v = 1 if rng.random() > 0.1 else rng.randint(2, 4)
+        settore = rng.choices(settori, weights)[0]
+        category = rng.choice(CATEGORIES[settore])
+        pz_x_collo = rng.choice(PACK_SIZES)
+        rapp = 1 if rng.random() > 0.05 else rng.choice((2, 3))
+        pkg = pz_x_collo * rapp
+        disponibilita = "No" if rng.random() < UNAVAILABLE_SHARE else "Si"
+        verified = rng.random() >= UNVERIFIED_SHARE
+        price_std = round(rng.uniform(0.5, 12.0), 2)
+        cost_std = round(price_std * rng.uniform(0.6, 0.8), 2)
+        rate = min(40.0, rng.lognormvariate(-0.7, 1.1))
+
+        is_new = rng.random() < NEW_PRODUCT_SHARE
+        history = rng.randint(5, HISTORY_DAYS - 1) if is_new else HISTORY_DAYS
+
+        promo = None
+        if rng.random() < PROMO_SHARE:
+            promo = _promo_window(rng, today)
+            discount = rng.uniform(0.15, 0.35)
+            promos.append((cod, v, round(cost_std * (1 - discount), 2),
+                           round(price_std * (1 - discount), 2), promo[0], promo[1]))
+
+        sales, bought, stock = _simulate(rng, settore, today, history, pkg, rate, promo, verified)
+        month_days = today.day
+        month_sold = sum(s for s in sales[:month_days] if s)
+        month_bought = sum(bought[:month_days])
+        # A new product's monthly arrays only reach back to the month it was added
+        months = 1 + math.ceil(max(0, history - today.day) / 30) if is_new else 24
+
+        sold_last_24 = _monthly(rng, today, rate, months, month_sold)
+        bought_last_24 = _monthly(rng, today, rate, months, month_bought, overhead=1.03)
+        promo_lifts = None
+        if rng.random() < 0.2:
+            promo_lifts = [{"lift": round(rng.uniform(1.2, 2.4), 2), "discount": rng.choice((20.0, 25.0, 30.0))}]
+
+        shelf_range = SETTORI[settore][3]
+        shelf_life = rng.randint(*shelf_range) if shelf_range else None
+        ean = 8000000000000 + cod * 10 + v
+
+        catalogue[settore].append(
+            (cod, v, f"PRODOTTO {cod}.{v} {category}", rapp, pz_x_collo, disponibilita,
+             price_std, cost_std, category)
+        )
+        stats.append((
+            cod, v, Json(sold_last_24), Json(bought_last_24), Json(sales), Json(bought),
+            stock, verified,
+            rng.randint(1, 4) if rng.random() < MIN_OVERRIDE_SHARE else None,
+            today, today, Json(promo_lifts) if promo_lifts else None,
+        ))
+        extras.append((cod, v, ean, shelf_life, today - timedelta(days=history - 1)))
+
+        broken = expired = internal = None
+        if settore == "DEPERIBILI" and rng.random() < 0.3:
+            expired = _losses(rng, rate, cost_std, per_month=0.08)
+        if rng.random() < 0.1:
+            internal = _losses(rng, rate, cost_std, per_month=0.02)
+        if rng.random() < 0.05:
+            broken = _losses(rng, rate, cost_std, per_month=0.01)
+        if broken or expired or internal:
+            row = [cod, v]
+            for arr in (broken, expired, internal):
+                row += [Json(arr), today] if arr else [None, None]
+            losses.append(tuple(row))
+
+        (new_keys if is_new else old_keys).setdefault(settore, []).append((cod, v))
+
+    # A new product replacing an old one of the same settore: the primary is the new one
+    links = []
+    for settore, primaries in new_keys.items():
+        olds = old_keys.get(settore, [])
+        count = min(len(primaries), len(olds), math.ceil(products * LINK_SHARE * SETTORI[settore][0]))
+        for primary, secondary in zip(rng.sample(primaries, count), rng.sample(olds, count)):
+            links.append((primary, secondary))
+
+    return {
+        "catalogue": catalogue, "stats": stats, "extras": extras,
+        "losses": losses, "promos": promos, "links": links,
+    }
+
+
+def write_supermarket(name: str, data: dict):
+    """Create the schema and load `data` (from build_supermarket) into it."""
+    db = DatabaseManager(name)
+    try:
+        db.create_tables()
+        for settore, records in data["catalogue"].items():
+            db.import_catalogue(records, settore)
+
+        today = date.today()
+        with db.transaction() as cur:
+            execute_values(cur, """
+                UPDATE products AS p
+                SET ean = d.ean::bigint, shelf_life_days = d.sl::int, first_added_at = d.added::date
+                FROM (VALUES %s) AS d(cod, v, ean, sl, added)
+                WHERE p.cod = d.cod::int AND p.v = d.v::int
+            """, data["extras"], page_size=1000)
+            execute_values(cur, """
+                INSERT INTO product_stats (
+                    cod, v, sold_last_24, bought_last_24, sales_sets, bought_sets, stock,
+                    verified, minimum_stock, last_update_sold, last_update_bought, promo_lifts
+                ) VALUES %s
+            """, data["stats"], page_size=1000)
+            if data["losses"]:
+                execute_values(cur, """
+                    INSERT INTO extra_losses (cod, v, broken, broken_updated, expired,
+                                              expired_updated, internal, internal_updated)
+                    VALUES %s
+                """, data["losses"], page_size=1000)
+            cur.execute("""
+                INSERT INTO sales_roll_state (id, rolled_through) VALUES (TRUE, %s)
+                ON CONFLICT (id) DO UPDATE SET rolled_through = EXCLUDED.rolled_through
+            """, (today,))
+            if db.SALES_STORAGE == "table":
+                db._history_to_table(cur)
+            db._invalidate_store_daily_totals(cur)
+
+        db.update_promos(data["promos"])
+        db.invalidate_ean_cache()
+        DatabaseManager._rolled_through.pop(db.schema, None)
+        return db.schema
+    finally:
+        db.close()
+
+
+def drop_supermarket(name: str):
+    """Drop a synthetic schema. Names are those of schema_name(), already schema-safe."""
+    if not name.startswith(SCHEMA_PREFIX):
+        raise ValueError(f"Refusing to drop '{name}': not a {SCHEMA_PREFIX}* schema")
+    schema = name
+    db = DatabaseManager()
+    try:
+        db.cursor().execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    finally:
+        db.close()
+    DatabaseManager._upgraded_schemas.discard(schema)
+    DatabaseManager._rolled_through.pop(schema, None)
+    DatabaseManager._ean_maps.pop(schema, None)
+
+
+def generate(supermarkets: int, products: int, seed: int = 1) -> dict:
+    """
+    (Re)create `supermarkets` schemas of `products` products each. Returns the
+    manifest the benchmark reads: per supermarket its schema, storages and links.
+    """
+    manifest = {"seed": seed, "generated_on": date.today().isoformat(), "supermarkets": []}
+    for index in range(1, supermarkets + 1):
+        name = schema_name(index)
+        drop_supermarket(name)
+        data = build_supermarket(index, products, seed)
+        write_supermarket(name, data)
+        manifest["supermarkets"].append({
+            "name": name,
+            "products": products,
+            "storages": [
+                {"settore": settore, "minimum_stock": SETTORI[settore][1], "products": len(records)}
+                for settore, records in data["catalogue"].items()
+            ],
+            "links": [[list(p), list(s)] for p, s in data["links"]],
+        })
+        logger.info(
+            f"[SYNTHETIC] {name}: {products} products, {len(data['promos'])} promos, "
+            f"{len(data['losses'])} with losses, {len(data['links'])} links"
+        )
+    return manifest
+
+
+def load_manifest(path) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create synthetic supermarket schemas for benchmarking")
+    parser.add_argument("--supermarkets", type=int, default=3)
+    parser.add_argument("--products", type=int, default=6000, help="products per supermarket")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--manifest", default="bench_dataset.json", help="where to write the manifest")
+    parser.add_argument("--drop", action="store_true", help="drop the bench_sm_* schemas instead")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+
+    if args.drop:
+        for index in range(1, args.supermarkets + 1):
+            drop_supermarket(schema_name(index))
+        return
+
+    manifest = generate(args.supermarkets, args.products, args.seed)
+    with open(args.manifest, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Wrote {args.manifest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,26 +4,28 @@ Web-integrated version of the Lister script.
 Downloads product list Excel files from Dropzone automatically.
 """
 from .DatabaseManager import DatabaseManager
+from . import browser_pool, dropzone_client
 import re
 import csv
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.service import Service
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
-from selenium.webdriver.chrome.options import Options
 from pathlib import Path
 import logging
-import requests
 from datetime import date
 import time
-import os, uuid, shutil
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# fatture_righe requests one DDT import keeps in flight (further capped per host
+# by DROPZONE_MAX_PER_HOST)
+RIGHE_CONCURRENCY = int(os.environ.get('DDT_RIGHE_CONCURRENCY', 4))
+
 CSV_COLUMN_MAP = {
     "arCodiceArticolo": "Code",
     "arVarianteArticolo": "Variant",
@@ -48,7 +50,7 @@ class WebLister:
                  id_cliente: int = None, id_azienda: int = None,
                  id_marchio: int = None, id_clienti_canale: int = None,
                  id_clienti_area: int = None, id_user: int = None,
-                 x5cper: int = None, headless: bool = True):
+                 x5cper: int = None, headless: bool = True, browser: bool = None):
         """
         Initialize the lister.
 
@@ -64,6 +66,9 @@ class WebLister:
             id_clienti_canale: Channel ID from Dropzone (stored on Supermarket model)
             id_clienti_area: Area ID from Dropzone (stored on Supermarket model)
             headless: Run browser in headless mode (no UI)
+            browser: Start Chrome. Default: unless DROPZONE_HTTP_LOGIN is on.
+                Without it login() goes over HTTP and only the API calls work —
+                not gather_client_data, which reads the Dropzone UI.
         """
         self.username = username
         self.password = password
@@ -78,73 +83,64 @@ class WebLister:
         self.IDClientiArea = id_clienti_area
         self.id_user = id_user
         self.x5cper = x5cper
+        self._client = None
 
         self.dataIntercettaPrezzi = date.today().strftime("%Y-%m-%d")
         
         # Extract settore name (remove numeric prefix)
         self.settore = re.sub(r'^\d+\s+', '', storage_name)
 
-        # ✅ FIX: Use unique temp directory for THIS instance
-        self.user_data_dir = f"/tmp/chrome-{uuid.uuid4()}"
-        os.makedirs(self.user_data_dir, exist_ok=True)
-        os.chmod(self.user_data_dir, 0o700)
-
-        # ✅ FIX: Set environment variables for THIS process
-        os.environ["HOME"] = self.user_data_dir
-        os.environ["XDG_RUNTIME_DIR"] = self.user_data_dir
-
-        # Setup Chrome options
-        chrome_options = Options()
-        chrome_options.binary_location = "/usr/bin/google-chrome"
-        
-        if headless:
-            chrome_options.add_argument("--headless=new")
-            chrome_options.add_argument("--no-sandbox")
-            chrome_options.add_argument("--disable-setuid-sandbox")
-            chrome_options.add_argument("--disable-dev-shm-usage")
-            chrome_options.add_argument("--disable-gpu")
-            chrome_options.add_argument("--disable-software-rasterizer")
-            chrome_options.add_argument("--window-size=1920,1080")
-            chrome_options.add_argument("--disable-extensions")
-        
-        # Set download directory
-        prefs = {
-            "download.default_directory": str(Path(download_dir).absolute()),
-            "download.prompt_for_download": False,
-            "download.directory_upgrade": True,
-            "safebrowsing.enabled": True
-        }
-        chrome_options.add_experimental_option("prefs", prefs)
+        if browser is None:
+            browser = not dropzone_client.HTTP_LOGIN
+        self.driver = None
+        self.user_data_dir = None
+        if not browser:
+            logger.info(f"WebLister initialized for storage: {storage_name} (HTTP only)")
+            return
 
-        # Use unique user data directory
-        chrome_options.add_argument(f"--user-data-dir={self.user_data_dir}")
-
-        # ✅ FIX: Use unique log file per instance (or disable logging)
-        log_path = f"/tmp/chromedriver-{uuid.uuid4().hex[:8]}.log"
-        
-        service = Service(log_path=log_path)
-        
+        # A warm browser from the worker's pool, possibly still logged in
         try:
-            self.driver = webdriver.Chrome(service=service, options=chrome_options)
-            self.actions = ActionChains(self.driver)
-            self.wait = WebDriverWait(self.driver, 300)
-            
-            logger.info(f"WebLister initialized for storage: {storage_name}")
-        
+            self.browser = browser_pool.lease(username, headless=headless)
         except Exception as e:
             logger.exception(f"Failed to initialize WebDriver: {e}")
-            # Clean up on failure
-            shutil.rmtree(self.user_data_dir, ignore_errors=True)
             raise
+        self.driver = self.browser.driver
+        self.user_data_dir = self.browser.user_data_dir
+        self.actions = ActionChains(self.driver)
+        self.wait = WebDriverWait(self.driver, 300)
+
+        logger.info(f"WebLister initialized for storage: {storage_name}")
+
+    def close(self, discard: bool = False):
+        """Hand the browser, if any, back to the pool — or quit it with discard."""
+        if self.driver is not None:
+            browser_pool.release(self.browser, discard=discard)
+            self.driver = None
 
     def login(self):
         """Login to Dropzone and navigate to product list"""
         logger.info("Logging in to Dropzone...")
+        if self.driver is None:
+            self._client = dropzone_client.http_session(self.username, self.password)
+            return
         
         self.driver.get('https://dropzone.pac2000a.it/')
-        
-        self.wait.until(EC.presence_of_element_located((By.ID, "username")))
-        
+
+        # A pooled browser may still hold this account's session: home page, no form
+        self.wait.until(EC.any_of(
+            EC.presence_of_element_located((By.ID, "username")),
+            EC.presence_of_element_located((By.ID, "carta31")),
+        ))
+        if not self.driver.find_elements(By.ID, "username"):
+            if self.browser.account == self.username:
+                logger.info("Login completed (session still open)")
+                return
+            # Another account's session: drop it and log in as ours
+            logger.info("Browser holds a Dropzone session for another account, logging out")
+            self.browser.clear_session()
+            self.driver.get('https://dropzone.pac2000a.it/')
+            self.wait.until(EC.presence_of_element_located((By.ID, "username")))
+
         username_field = self.driver.find_element(By.ID, "username")
         password_field = self.driver.find_element(By.ID, "password")
         username_field.send_keys(self.username)
@@ -152,6 +148,7 @@ class WebLister:
         self.actions.send_keys(Keys.ENTER)
         self.actions.perform()
         time.sleep(1)
+        self.browser.account = self.username
         logger.info("Login completed")
 
     def navigate_to_invoices(self):
@@ -170,7 +167,9 @@ class WebLister:
         self.driver.switch_to.window(self.driver.window_handles[-1])
     
     def navigate_to_lists(self):
-        
+        if self.driver is None:
+            return      # the list API needs no page state over HTTP
+
         self.wait.until(EC.presence_of_element_located((By.ID, "carta31")))
         
         list_menu = self.driver.find_element(By.ID, "carta31")
@@ -240,24 +239,21 @@ class WebLister:
         logger.info(f"Captured IDUser: {id_user}")
 
         # Step 2: Fetch client params from Cliente_call.php
-        url_cliente = "https://dropzone.pac2000a.it/anagrafiche/Cliente_call.php"
+        url_cliente = f"{dropzone_client.BASE_URL}/anagrafiche/Cliente_call.php"
         payload_cliente = {"funzione": "loadComboV2", "IDUser": id_user, "Chiamante": "gestioneOrdini"}
         headers = {
             "Accept": "application/json, text/javascript, */*; q=0.01",
             "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
             "X-Requested-With": "XMLHttpRequest",
             "Referer": "https://dropzone.pac2000a.it/",
-            "User-Agent": self.driver.execute_script("return navigator.userAgent;"),
         }
-        session = requests.Session()
-        for c in self.driver.get_cookies():
-            session.cookies.set(c["name"], c["value"])
+        session = self.dropzone()
 
         row = session.post(url_cliente, data=payload_cliente, headers=headers, timeout=30).json()[0]
 
         # Step 3: Fetch x5cper from PersoneProxy.php
         persona_row = session.post(
-            "https://dropzone.pac2000a.it/include/PersoneProxy.php",
+            f"{dropzone_client.BASE_URL}/include/PersoneProxy.php",
             data={"ragsoc": "", "app": "RIEPFATT"},
             headers=headers, timeout=30
         ).json()
@@ -342,15 +338,18 @@ class WebLister:
         logger.info(f"fetch_all_listino: {len(merged)} distinct products across {len(self.reparto_groups)} Reparto groups")
         return merged
 
-    def fetch_listino(self, reparto_in: list = None):
+    def fetch_listino(self, reparto_in: list = None, session: dropzone_client.DropzoneClient = None):
         """
         Fetch listino products from Dropzone (Listino_callV2.php)
-        Requires an authenticated Selenium driver.
+        Requires an authenticated Selenium driver, or the client it was bound
+        to by dropzone().
         """
+        if session is None:
+            session = self.dropzone()
         if reparto_in is None:
             reparto_in = getattr(self, "RepartoIn", [])
 
-        url = "https://dropzone.pac2000a.it/anagrafiche/Listino_callV2.php"
+        url = f"{dropzone_client.BASE_URL}/anagrafiche/Listino_callV2.php"
 
         payload = {
             "funzione": "lista",
@@ -389,18 +388,46 @@ class WebLister:
             "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
             "X-Requested-With": "XMLHttpRequest",
             "Referer": "https://dropzone.pac2000a.it/ordini/gestione/listino",
-            "User-Agent": self.driver.execute_script("return navigator.userAgent;"),
         }
 
-        session = requests.Session()
-        for c in self.driver.get_cookies():
-            session.cookies.set(c["name"], c["value"])
-
         response = session.post(url, data=payload, headers=headers, timeout=600)
         response.raise_for_status()
 
         return response.json() or []
 
+    def dropzone(self) -> dropzone_client.DropzoneClient:
+        """
+        The account's shared Dropzone client, carrying the logged-in browser's
+        cookies and User-Agent (bound on first use, so call it after login()), or
+        without a browser the HTTP-logged-in one.
+        """
+        if self._client is None:
+            if self.driver is None:
+                self._client = dropzone_client.http_session(self.username, self.password)
+            else:
+                self._client = dropzone_client.client_for(self.username).use_browser(self.driver)
+        return self._client
+
+    def iter_listino(self, session: dropzone_client.DropzoneClient):
+        """
+        Real products of every Reparto group, deduped by (CodiceArticolo,
+        VarianteArticolo) like fetch_all_listino — but one page at a time, so
+        only the page being consumed is held in memory, never the whole merge.
+        """
+        seen = set()
+        for reparto_in in self.reparto_groups:
+            page = self.fetch_listino(reparto_in, session=session)
+            logger.info(f"fetch_listino(RepartoIn={reparto_in}): {len(page)} rows")
+            for row in page:
+                key = (row.get("arCodiceArticolo"), row.get("arVarianteArticolo"))
+                if key in seen or not is_real_product(row):
+                    continue
+                seen.add(key)
+                yield row
+            del page
+
+        logger.info(f"iter_listino: {len(seen)} distinct products across {len(self.reparto_groups)} Reparto groups")
+
     def save_listino_to_csv(self, data: list[dict], column_map: dict = CSV_COLUMN_MAP):
         products = [row for row in data if is_real_product(row)]
 
@@ -418,6 +445,31 @@ class WebLister:
 
         return self.output_path        
     
+    def stream(self, audit_csv: bool = False):
+        """
+        Log in and prepare the listino requests, then close the browser and
+        return an iterator of catalogue records (see listino_records) that
+        downloads the Reparto pages as it is consumed.
+
+        Everything that needs Selenium happens here, eagerly: the browser is
+        gone before a caller starts importing, and the pages are fetched over
+        plain HTTP with the session's cookies. With audit_csv the same rows are
+        also written to self.output_path in the usual CSV layout.
+        """
+        try:
+            self.login()
+            self.navigate_to_lists()
+            self.apply_category_filters()
+            session = self.dropzone()
+        finally:
+            self.close()
+        if not session.http_login:
+            # The browser it would re-read cookies from is gone
+            session.reauth = None
+
+        audit_path = self.output_path if audit_csv else None
+        return listino_records(self.iter_listino(session), audit_path=audit_path)
+
     def run(self) -> str:
         """
         Execute the complete download workflow.
@@ -434,8 +486,7 @@ class WebLister:
             return file_path
         finally:
             # ✅ Always clean up
-            self.driver.quit()
-            shutil.rmtree(self.user_data_dir, ignore_errors=True)
+            self.close()
 
     def gather_missing_product_data(self, cod, var):
         """
@@ -445,7 +496,7 @@ class WebLister:
         Returns a dict with selected, normalized fields or None on failure.
         """
 
-        url = "https://dropzone.pac2000a.it/anagrafiche/ArticoliDecodifica_call.php"
+        url = f"{dropzone_client.BASE_URL}/anagrafiche/ArticoliDecodifica_call.php"
 
         headers = {
             "Accept": "application/json, text/javascript, */*; q=0.01",
@@ -491,9 +542,7 @@ class WebLister:
             "dataScadenzaCosto": self.dataIntercettaPrezzi,
         }
 
-        session = requests.Session()
-        for c in self.driver.get_cookies():
-            session.cookies.set(c["name"], c["value"])
+        session = self.dropzone()
 
         try:
             response = session.post(url, headers=headers, data=payload, timeout=15)
@@ -521,7 +570,7 @@ class WebLister:
         id_articolo = data.get("IDArticolo")
         if id_articolo:
             try:
-                barcode_url = "https://dropzone.pac2000a.it/articoli/codiciBarre/CodiciBarreProxyAbs_call.php"
+                barcode_url = f"{dropzone_client.BASE_URL}/articoli/codiciBarre/CodiciBarreProxyAbs_call.php"
                 barcode_payload = {
                     "funzione": "lista",
                     "IDArticolo": id_articolo,
@@ -556,7 +605,7 @@ class WebLister:
         Calls ArticoliDecodifica_call.php with CodiceBarre instead of CodiceArticolo/VarianteArticolo.
         Returns (cod, var) tuple or None if not found.
         """
-        url = "https://dropzone.pac2000a.it/anagrafiche/ArticoliDecodifica_call.php"
+        url = f"{dropzone_client.BASE_URL}/anagrafiche/ArticoliDecodifica_call.php"
         headers = {
             "Accept": "application/json, text/javascript, */*; q=0.01",
             "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
@@ -599,9 +648,7 @@ class WebLister:
             "dataDecorrenzaCosto": self.dataIntercettaPrezzi,
             "dataScadenzaCosto": self.dataIntercettaPrezzi,
         }
-        session = requests.Session()
-        for c in self.driver.get_cookies():
-            session.cookies.set(c["name"], c["value"])
+        session = self.dropzone()
         try:
             response = session.post(url, headers=headers, data=payload, timeout=15)
             response.raise_for_status()
@@ -628,7 +675,7 @@ class WebLister:
         date_from / date_to: "YYYYMMDD"
         Requires self.x5cper to be set.
         """
-        url = "https://dropzone.pac2000a.it/fteweb/ScorporoAmministrativo_call.php"
+        url = f"{dropzone_client.BASE_URL}/fteweb/ScorporoAmministrativo_call.php"
         payload = {
             "funzione":    "lista",
             "X5TREC":      x5trec,
@@ -645,13 +692,8 @@ class WebLister:
             "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
             "X-Requested-With": "XMLHttpRequest",
             "Referer": "https://dropzone.pac2000a.it/",
-            "User-Agent": self.driver.execute_script("return navigator.userAgent;"),
         }
-        session = requests.Session()
-        for c in self.driver.get_cookies():
-            session.cookies.set(c["name"], c["value"])
-
-        response = session.post(url, data=payload, headers=headers, timeout=60)
+        response = self.dropzone().post(url, data=payload, headers=headers, timeout=60)
         response.raise_for_status()
         data = response.json() or []
         logger.info(f"fetch_scorporo: {len(data)} DDT rows for {date_from}→{date_to}")
@@ -662,7 +704,7 @@ class WebLister:
         Fetch line items for a single DDT from fatture_righe_data.php.
         Requires self.id_user to be set.
         """
-        url = "https://dropzone.pac2000a.it/fteweb/fatture_righe_data.php"
+        url = f"{dropzone_client.BASE_URL}/fteweb/fatture_righe_data.php"
         payload = {
             "iduser":                      self.id_user,
             "uacazn":                      scorporo_row["X5CAZN"],
@@ -686,18 +728,26 @@ class WebLister:
             "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
             "X-Requested-With": "XMLHttpRequest",
             "Referer": "https://dropzone.pac2000a.it/",
-            "User-Agent": self.driver.execute_script("return navigator.userAgent;"),
         }
-        session = requests.Session()
-        for c in self.driver.get_cookies():
-            session.cookies.set(c["name"], c["value"])
-
-        response = session.post(url, data=payload, headers=headers, timeout=60)
+        response = self.dropzone().post(url, data=payload, headers=headers, timeout=60)
         response.raise_for_status()
         data = response.json()
         logger.info(f"fetch_righe: {len(data)} items for X5NRCC={scorporo_row['X5NRCC']}")
         return data
 
+    def fetch_all_righe(self, scorporo_rows: list, max_workers: int = None) -> list:
+        """
+        fetch_righe for every row, up to max_workers (default RIGHE_CONCURRENCY)
+        at a time over the shared client. Returns the righe lists in the order of
+        scorporo_rows; the first failure is raised, as in a serial loop.
+        """
+        if not scorporo_rows:
+            return []
+        self.dropzone()     # bind once, before the threads share it
+        workers = max(1, min(max_workers or RIGHE_CONCURRENCY, len(scorporo_rows)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="righe") as pool:
+            return list(pool.map(self.fetch_righe, scorporo_rows))
+
     def process_righe(self, righe: list) -> dict:
         """
         Group all line items by DescMag, then aggregate by (cod, v) within each group.
@@ -762,6 +812,113 @@ def download_product_list(username: str, password: str, storage_name: str,
                        id_clienti_area=id_clienti_area, headless=headless)
     return lister.run()
 
+def stream_product_list(username: str, password: str, storage_name: str,
+                        download_dir: str, id_cod_mag: int = None,
+                        id_cliente: int = None, id_azienda: int = None,
+                        id_marchio: int = None, id_clienti_canale: int = None,
+                        id_clienti_area: int = None,
+                        headless: bool = True, audit_csv: bool = False):
+    """
+    Like download_product_list, but without the CSV round trip: returns an
+    iterator of catalogue records ready for DatabaseManager.import_catalogue.
+
+    Args are those of download_product_list, plus:
+        audit_csv: Also write the list to <download_dir>/<storage_name>.csv
+
+    Returns:
+        Iterator of (cod, v, descrizione, rapp, pz_x_collo, disponibilita,
+        price_std, cost_std, category) tuples
+    """
+    lister = WebLister(username, password, storage_name, download_dir,
+                       id_cod_mag=id_cod_mag, id_cliente=id_cliente,
+                       id_azienda=id_azienda, id_marchio=id_marchio,
+                       id_clienti_canale=id_clienti_canale,
+                       id_clienti_area=id_clienti_area, headless=headless)
+    return lister.stream(audit_csv=audit_csv)
+
+
+def _stripped(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _number(value, convert):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    return convert(value)
+
+
+def listino_record(row: dict):
+    """
+    One listino JSON row as an import_catalogue record, converted the way
+    import_from_CSV converts the CSV_COLUMN_MAP columns of the saved file.
+    Returns None for rows import_from_CSV would drop: a non-numeric code, or
+    a non-integer multiplier.
+    """
+    try:
+        cod = int(row.get("arCodiceArticolo"))
+    except (TypeError, ValueError):
+        return None
+    v = _number(row.get("arVarianteArticolo"), int) or 0
+
+    raw_rapp = row.get("arRapportoCessioneVendita")
+    try:
+        rapp = _number(raw_rapp, float)
+    except ValueError:
+        logger.warning(f"Invalid multiplier '{raw_rapp}' for code {cod}. Skipping.")
+        return None
+    if rapp is not None:
+        if not rapp.is_integer():
+            logger.warning(f"Non-integer multiplier {raw_rapp} for code {cod}. Skipping.")
+            return None
+        rapp = int(rapp)
+
+    disponibilita = row.get("disponibilita2")
+    return (
+        cod,
+        v,
+        _stripped(row.get("arDescrizione")),
+        rapp,
+        _number(row.get("Imballo"), lambda x: int(float(x))),
+        "Si" if disponibilita is None else _stripped(disponibilita),
+        _number(row.get("vendita"), float),
+        _number(row.get("cessione"), float),
+        _stripped(row.get("reDescrizione")),
+    )
+
+
+def listino_records(rows, audit_path: Path = None, column_map: dict = CSV_COLUMN_MAP):
+    """
+    Lazily turn listino rows into import_catalogue records. With audit_path,
+    every row is also written there in the save_listino_to_csv layout.
+
+    Raises ValueError once the rows run out if none were usable — the same
+    guard save_listino_to_csv applies, and raised mid-import it rolls the
+    import back instead of marking the whole settore unavailable.
+    """
+    audit_file = writer = None
+    if audit_path is not None:
+        audit_file = Path(audit_path).open("w", newline="", encoding="utf-8")
+        writer = csv.writer(audit_file, delimiter=";", quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(list(column_map.values()))
+
+    produced = 0
+    try:
+        for row in rows:
+            if writer is not None:
+                writer.writerow([row.get(field, "") for field in column_map])
+            record = listino_record(row)
+            if record is None:
+                continue
+            produced += 1
+            yield record
+    finally:
+        if audit_file is not None:
+            audit_file.close()
+
+    if not produced:
+        raise ValueError("No valid products found to import")
+
+
 def is_real_product(row: dict) -> bool:
     """
     Filters out category/separator rows like:
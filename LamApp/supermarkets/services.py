@@ -61,6 +61,9 @@ class RestockService:
             logger.warning(f"Error closing database connection: {e}")
 
 
+BLACKLIST_DELETE_BATCH = 1000
+
+
 def delete_blacklist_entries_for_purged(purged_products, *, storage=None, supermarket=None):
     """
     Remove BlacklistEntry rows left behind after purge_product() clears a
@@ -73,10 +76,9 @@ def delete_blacklist_entries_for_purged(purged_products, *, storage=None, superm
     Pass `storage` when the purge ran against a single Storage, or `supermarket`
     when it ran across all storages of a Supermarket (e.g. purge_obsolete_products).
     """
-    from django.db.models import Q
     from .models import BlacklistEntry
 
-    codes = [(p['cod'], p['v']) for p in purged_products if p.get('action') == 'purged']
+    codes = {(p['cod'], p['v']) for p in purged_products if p.get('action') == 'purged'}
     if not codes:
         return 0
 
@@ -87,16 +89,81 @@ def delete_blacklist_entries_for_purged(purged_products, *, storage=None, superm
     else:
         raise ValueError("delete_blacklist_entries_for_purged requires storage or supermarket")
 
-    code_filter = Q()
-    for cod, v in codes:
-        code_filter |= Q(product_code=cod, product_var=v)
-
-    deleted, _ = qs.filter(code_filter).delete()
+    # Narrow by code in SQL and match (code, var) pairs here: one OR clause per product
+    # grows without bound after a large purge. Then delete by id, in batches.
+    entry_ids = [
+        pk for pk, cod, v in qs.filter(
+            product_code__in={cod for cod, _ in codes}
+        ).values_list('id', 'product_code', 'product_var')
+        if (cod, v) in codes
+    ]
+    deleted = 0
+    for i in range(0, len(entry_ids), BLACKLIST_DELETE_BATCH):
+        batch_deleted, _ = BlacklistEntry.objects.filter(
+            id__in=entry_ids[i:i + BLACKLIST_DELETE_BATCH]
+        ).delete()
+        deleted += batch_deleted
     if deleted:
         logger.info(f"Removed {deleted} stale blacklist entr{'y' if deleted == 1 else 'ies'} for purged products")
     return deleted
 
 
+def record_realtime_sync(supermarket, sync_date, received, result, delta=False):
+    """
+    Bookkeeping after DatabaseManager.apply_realtime_sales, shared by the realtime
+    sync endpoint and the queued applier: stamp last_sales_sync_at and rewrite the
+    day's SalesSyncLog. Returns the unverified products, blacklisted ones excluded.
+
+    A delta payload lists only the products that changed, so its unverified products
+    are added to the day's list instead of replacing it, and the counts stay those of
+    the day's last full payload.
+    """
+    from django.utils import timezone
+    from .models import BlacklistEntry, SalesSyncLog
+
+    blacklisted = set(
+        BlacklistEntry.objects.filter(
+            blacklist__storage__supermarket=supermarket
+        ).values_list('product_code', 'product_var')
+    )
+    unverified = result['unverified_products']
+    log = None
+    if delta:
+        log = SalesSyncLog.objects.filter(supermarket=supermarket, sync_date=sync_date).first()
+        previous = log.unverified_products if log else []
+        seen = {(p['cod'], p['v']) for p in unverified}
+        unverified = unverified + [p for p in previous if (p['cod'], p['v']) not in seen]
+
+    unverified_filtered = [
+        p for p in unverified
+        if (p['cod'], p['v']) not in blacklisted
+    ]
+
+    supermarket.last_sales_sync_at = timezone.now()
+    supermarket.save(update_fields=['last_sales_sync_at'])
+
+    if log is not None:
+        # The delta's counts cover only the products it lists, not the day
+        log.unverified_products = unverified_filtered
+        log.save(update_fields=['unverified_products'])
+        return unverified_filtered
+
+    # A full payload is cumulative, so the latest one already describes the whole
+    # day — overwrite rather than accumulate.
+    SalesSyncLog.objects.update_or_create(
+        supermarket=supermarket,
+        sync_date=sync_date,
+        defaults={
+            'received': received,
+            'applied': received - result['not_in_db'],
+            'already_synced': result['unchanged'],
+            'not_in_db': result['not_in_db'],
+            'unverified_products': unverified_filtered,
+        },
+    )
+    return unverified_filtered
+
+
 # Optional: Keep StorageService for discovery operations
 class StorageService:
     """Service to manage storage discovery and setup"""
@@ -2,6 +2,7 @@
 sync_views.py — Machine-to-machine API endpoints + onboarding UI for supermarket PC sync.
 
   POST /api/sync/realtime-sales/               — today's running sold totals (Everest till log)
+  GET  /api/sync/realtime-sales/receipt/<id>/  — outcome of a queued realtime payload
   POST /api/sync/intraday-curve/               — measured per-weekday hourly sales shape
   POST /supermarkets/<pk>/generate-sync-token/ — generate/regenerate token (admin UI)
   GET  /api/sync/setup/<token>/bootstrap-rt/   — serve ready-to-run PS1 installer script
@@ -10,7 +11,9 @@ sync_views.py — Machine-to-machine API endpoints + onboarding UI for supermark
 import hashlib
 import json
 import logging
+import os
 import secrets
+import zlib
 from datetime import date
 
 from django.conf import settings
@@ -24,6 +27,7 @@ from django.views.decorators.http import require_POST
 from django.http import JsonResponse
 from .models import Blacklist, BlacklistEntry, SalesSyncLog, Storage, Supermarket
 from .scripts.DatabaseManager import DatabaseManager
+from .services import record_realtime_sync
 from .logging_context import enter_supermarket_log, exit_supermarket_log
 
 logger = logging.getLogger(__name__)
@@ -33,6 +37,57 @@ logger = logging.getLogger(__name__)
 # Data sync endpoint (called by PowerShell on supermarket PC)
 # ---------------------------------------------------------------------------
 
+# How realtime_sales_sync_view applies a payload.
+#   "inline": inside the request, as the store PC waits for the answer.
+#   "queue":  validate, store it in the schema's realtime_sync_inbox and answer 202 with
+#             a receipt; tasks.apply_realtime_sales_queue applies it on the default
+#             Celery queue, one supermarket at a time, skipping any payload a newer
+#             one for the same day has made redundant.
+RT_SYNC_INGEST_MODE = os.environ.get('RT_SYNC_INGEST_MODE', 'inline')
+
+
+def _parse_realtime_products(products_raw):
+    """(totals, shelf_life_map, skipped_float) from the payload's product list."""
+    totals = []
+    shelf_life_map = {}
+    skipped_float = 0
+    for entry in products_raw:
+        try:
+            cod = int(entry['cod'])
+            var = int(entry['var'])
+            sold_raw = entry['sold']
+            # Everest reports whole units only (weight-sold lines are filtered out
+            # store-side by N0_UOM_CODE), but stay defensive: the rest of the system
+            # cannot represent fractional sales.
+            if isinstance(sold_raw, float) and sold_raw != int(sold_raw):
+                skipped_float += 1
+                continue
+            totals.append((cod, var, int(sold_raw)))
+            sl = entry.get('shelf_life')
+            if sl is not None:
+                shelf_life_map[(cod, var)] = int(sl)
+        except (KeyError, ValueError, TypeError):
+            continue
+    return totals, shelf_life_map, skipped_float
+
+
+# Inflated size cap for gzip-encoded bodies: a full-store payload is well under 1 MB.
+RT_SYNC_MAX_BODY = 16 * 1024 * 1024
+
+
+def _request_json(request):
+    """
+    The request's JSON body, inflated first when sent with Content-Encoding: gzip.
+    Raises ValueError (or zlib.error) on anything unreadable.
+    """
+    body = request.body
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = inflater.decompress(body, RT_SYNC_MAX_BODY)
+        if inflater.unconsumed_tail:
+            raise ValueError('Body too large')
+    return json.loads(body)
+
 
 @csrf_exempt
 @require_POST
@@ -40,22 +95,34 @@ def realtime_sales_sync_view(request):
     """
     Receive the day's running sold totals from the Everest till log and apply them.
 
-    Expected JSON body:
+    Expected JSON body (optionally gzip-encoded, with Content-Encoding: gzip):
     {
         "token":     "<sync_api_token>",
         "sync_date": "YYYY-MM-DD",
         "mode":      "absolute",
+        "seq":       41,                       # optional in absolute mode
         "products":  [{"cod": 606, "var": 1, "sold": 7, "shelf_life": 360}, ...]
     }
 
     `sold` is the day's total SO FAR, not an increment; the server books the difference.
     An empty product list is valid — the first run of a new day rolls the previous closed.
 
+    mode "delta" lists only the products whose total changed since the payload the
+    server acknowledged as `base_seq` (a product back to zero is sent as 0), and
+    must carry both `seq` and `base_seq`. Entries are still absolute totals, so
+    replays stay harmless. When base_seq is not the server's last sequence for the
+    day — missed response, new day, server-side failure — the answer is 409 with
+    "resync": true and the store sends a full absolute payload, which resets the
+    sequence to its `seq`.
+
     One SalesSyncLog row per supermarket per day, rewritten on each run.
+
+    With RT_SYNC_INGEST_MODE="queue" the payload is only validated and stored here, and
+    the answer is 202 with a receipt id instead of the applied counts.
     """
     try:
-        data = json.loads(request.body)
-    except (json.JSONDecodeError, UnicodeDecodeError):
+        data = _request_json(request)
+    except (ValueError, zlib.error):
         return HttpResponse('Invalid JSON body', status=400)
 
     token = data.get('token')
@@ -65,10 +132,17 @@ def realtime_sales_sync_view(request):
     if not token or not sync_date_str or not isinstance(products_raw, list):
         return HttpResponse('Missing required fields: token, sync_date, products', status=400)
 
-    if data.get('mode') != 'absolute':
-        # Guards against an older delta-style client being pointed here by mistake,
+    mode = data.get('mode')
+    seq = data.get('seq')
+    base_seq = data.get('base_seq')
+    if mode not in ('absolute', 'delta'):
+        return HttpResponse("Unsupported mode, expected 'absolute' or 'delta'", status=400)
+    if mode == 'delta' and not (isinstance(seq, int) and isinstance(base_seq, int)):
+        # Guards against an older increment-style client being pointed here by mistake,
         # which would double-book every run.
-        return HttpResponse("Unsupported mode, expected 'absolute'", status=400)
+        return HttpResponse("Mode 'delta' requires integer seq and base_seq", status=400)
+    if seq is not None and not isinstance(seq, int):
+        return HttpResponse('seq must be an integer', status=400)
 
     try:
         supermarket = Supermarket.objects.get(sync_api_token=token)
@@ -83,74 +157,53 @@ def realtime_sales_sync_view(request):
         except ValueError:
             return HttpResponse('Invalid sync_date, expected YYYY-MM-DD', status=400)
 
-        totals = []
-        shelf_life_map = {}
-        skipped_float = 0
-        for entry in products_raw:
-            try:
-                cod = int(entry['cod'])
-                var = int(entry['var'])
-                sold_raw = entry['sold']
-                # Everest reports whole units only (weight-sold lines are filtered out
-                # store-side by N0_UOM_CODE), but stay defensive: the rest of the system
-                # cannot represent fractional sales.
-                if isinstance(sold_raw, float) and sold_raw != int(sold_raw):
-                    skipped_float += 1
-                    continue
-                totals.append((cod, var, int(sold_raw)))
-                sl = entry.get('shelf_life')
-                if sl is not None:
-                    shelf_life_map[(cod, var)] = int(sl)
-            except (KeyError, ValueError, TypeError):
-                continue
+        totals, shelf_life_map, skipped_float = _parse_realtime_products(products_raw)
 
         if skipped_float:
             logger.info(f"[RT SYNC] skipped {skipped_float} fractional-qty products")
 
+        delta = mode == 'delta'
         db = DatabaseManager(supermarket_name=supermarket.name)
         try:
-            result = db.apply_realtime_sales(totals, sync_date, shelf_life_map=shelf_life_map)
-        except Exception:
-            logger.exception(f"[RT SYNC] DB error for supermarket '{supermarket.name}'")
-            return HttpResponse('Internal server error', status=500)
+            if delta and not db.advance_realtime_seq(sync_date, base_seq, seq):
+                state = db.get_realtime_seq()
+                last_seq = state[1] if state and state[0] == sync_date else None
+                logger.info(
+                    f"[RT SYNC] supermarket='{supermarket.name}' delta base_seq={base_seq} "
+                    f"does not match last_seq={last_seq}, asking for a full resync"
+                )
+                return JsonResponse({'ok': False, 'resync': True, 'last_seq': last_seq}, status=409)
+
+            if RT_SYNC_INGEST_MODE == 'queue':
+                return _enqueue_realtime_sales(
+                    db, supermarket, sync_date, totals, shelf_life_map, delta, seq
+                )
+
+            try:
+                result = db.apply_realtime_sales(totals, sync_date, shelf_life_map=shelf_life_map)
+                if not delta and seq is not None:
+                    db.set_realtime_seq(sync_date, seq)
+            except Exception:
+                # A delta's seq was already taken: the store never sees it acknowledged,
+                # so its next delta mismatches and it resyncs in full.
+                logger.exception(f"[RT SYNC] DB error for supermarket '{supermarket.name}'")
+                return HttpResponse('Internal server error', status=500)
         finally:
             db.close()
 
-        blacklisted = set(
-            BlacklistEntry.objects.filter(
-                blacklist__storage__supermarket=supermarket
-            ).values_list('product_code', 'product_var')
-        )
-        unverified_filtered = [
-            p for p in result['unverified_products']
-            if (p['cod'], p['v']) not in blacklisted
-        ]
-
-        supermarket.last_sales_sync_at = timezone.now()
-        supermarket.save(update_fields=['last_sales_sync_at'])
-
-        # The payload is cumulative, so the latest run already describes the whole day —
-        # overwrite rather than accumulate.
-        SalesSyncLog.objects.update_or_create(
-            supermarket=supermarket,
-            sync_date=sync_date,
-            defaults={
-                'received': len(totals),
-                'applied': len(totals) - result['not_in_db'],
-                'already_synced': result['unchanged'],
-                'not_in_db': result['not_in_db'],
-                'unverified_products': unverified_filtered,
-            },
+        unverified_filtered = record_realtime_sync(
+            supermarket, sync_date, len(totals), result, delta=delta
         )
 
         logger.info(
-            f"[RT SYNC] supermarket='{supermarket.name}' date={sync_date_str} "
-            f"received={len(totals)} changed={result['applied']} "
+            f"[RT SYNC] supermarket='{supermarket.name}' date={sync_date_str} mode={mode} "
+            f"seq={seq} received={len(totals)} changed={result['applied']} "
             f"units={result['units_applied']} rolled_over={result['rolled_over']} "
             f"unverified={len(unverified_filtered)}"
         )
         return JsonResponse({
             'ok': True,
+            'seq': seq,
             'received': len(totals),
             'changed': result['applied'],
             'units': result['units_applied'],
@@ -161,6 +214,71 @@ def realtime_sales_sync_view(request):
         exit_supermarket_log(_log_ctx)
 
 
+def _enqueue_realtime_sales(db, supermarket, sync_date, totals, shelf_life_map, delta, seq):
+    """Queued ingestion: one INSERT into the inbox, then hand off to Celery."""
+    from .tasks import apply_realtime_sales_queue
+
+    try:
+        receipt = db.enqueue_realtime_sales(
+            totals, sync_date, shelf_life_map=shelf_life_map, delta=delta
+        )
+        if not delta and seq is not None:
+            db.set_realtime_seq(sync_date, seq)
+    except Exception:
+        logger.exception(f"[RT SYNC] Could not queue payload for supermarket '{supermarket.name}'")
+        return HttpResponse('Internal server error', status=500)
+
+    try:
+        apply_realtime_sales_queue.apply_async(args=[supermarket.id])
+    except Exception:
+        # The payload is stored: the next accepted run drains it along with its own.
+        logger.exception(f"[RT SYNC] Broker unavailable, receipt {receipt} waits for the next run")
+
+    logger.info(
+        f"[RT SYNC] supermarket='{supermarket.name}' date={sync_date} "
+        f"delta={delta} seq={seq} received={len(totals)} queued receipt={receipt}"
+    )
+    return JsonResponse({
+        'ok': True,
+        'queued': True,
+        'receipt': receipt,
+        'seq': seq,
+        'received': len(totals),
+        'send_curve': _curve_is_stale(supermarket),
+    }, status=202)
+
+
+def realtime_sales_receipt_view(request, receipt_id):
+    """
+    Outcome of a queued realtime payload. The token goes in the X-Sync-Token header
+    (or ?token=), as the receipt alone does not say which supermarket it belongs to.
+    """
+    token = request.headers.get('X-Sync-Token') or request.GET.get('token')
+    if not token:
+        return HttpResponse('Missing token', status=400)
+    try:
+        supermarket = Supermarket.objects.get(sync_api_token=token)
+    except Supermarket.DoesNotExist:
+        return HttpResponse('Invalid token', status=401)
+
+    db = DatabaseManager(supermarket_name=supermarket.name)
+    try:
+        receipt = db.get_realtime_receipt(receipt_id)
+    finally:
+        db.close()
+
+    if receipt is None:
+        return HttpResponse('Not found', status=404)
+    return JsonResponse({
+        'receipt': receipt['id'],
+        'sync_date': receipt['sync_date'].isoformat(),
+        'status': receipt['status'],
+        'received_at': receipt['received_at'].isoformat(),
+        'processed_at': receipt['processed_at'].isoformat() if receipt['processed_at'] else None,
+        'result': receipt['result'],
+    })
+
+
 CURVE_MAX_AGE_HOURS = 20
 
 
@@ -457,7 +575,12 @@ def _build_realtime_sync_script(token: str, server_url: str, curve_url: str) ->
     Returns sync_sales_rt.ps1: today's running sales totals from the Everest till log.
 
     Sends ABSOLUTE totals, not increments — the server subtracts what it already applied,
-    so runs are idempotent and the store PC keeps no state.
+    so runs are idempotent.
+
+    After the day's first acknowledged run it sends only the products whose total
+    changed (mode "delta"), gzip-encoded. What the server last acknowledged is kept
+    in rt_state.json beside the script; losing or corrupting that file costs nothing
+    but one full payload, and so does a 409 from the server.
 
     Maps via CassaAna.CodEan (what the till resolves against) filtered to segn = 1;
     without that filter a barcode resolves to several articles and quantities multiply.
@@ -518,26 +641,101 @@ $Products = @($Rows | ForEach-Object {{
     @{{ cod = [int]$_.cod; var = [int]$_.var; sold = [int]$_.sold; shelf_life = $sl }}
 }})
 
+$StatePath = Join-Path $PSScriptRoot 'rt_state.json'
+
+# What this run reports, keyed "cod.var"
+$Current = @{{}}
+foreach ($p in $Products) {{ $Current["$($p.cod).$($p.var)"] = $p.sold }}
+
+# The server's view after our last acknowledged run. Only today's counts: a new day
+# starts with a full payload.
+$State = $null
+if (Test-Path $StatePath) {{
+    try {{ $State = Get-Content $StatePath -Raw | ConvertFrom-Json }} catch {{ $State = $null }}
+}}
+$UseDelta = ($State -ne $null) -and ($State.date -eq $TodayStr) -and ($State.seq -ne $null)
+$Seq = 1
+if ($UseDelta) {{ $Seq = [int64]$State.seq + 1 }}
+
+function Send-Payload($Body) {{
+    $json  = $Body | ConvertTo-Json -Depth 3 -Compress
+    $bytes = [System.Text.Encoding]::UTF8.GetBytes($json)
+    $ms = New-Object System.IO.MemoryStream
+    $gz = New-Object System.IO.Compression.GZipStream($ms, [System.IO.Compression.CompressionMode]::Compress)
+    $gz.Write($bytes, 0, $bytes.Length)
+    $gz.Close()
+    return Invoke-RestMethod -Uri $ServerUrl -Method POST -Body $ms.ToArray() `
+        -ContentType "application/json" -Headers @{{ 'Content-Encoding' = 'gzip' }} -ErrorAction Stop
+}}
+
 # Posted even when empty: the 08:30 run is the first of the day and carries little or
 # nothing, but it is what tells the server to close the previous day and open a new slot.
-$Payload = @{{
+$Full = @{{
     token     = $Token
     sync_date = $TodayStr
     mode      = 'absolute'
+    seq       = $Seq
     products  = $Products
-}} | ConvertTo-Json -Depth 3 -Compress
-
-Write-Host "Sending $($Products.Count) products for $TodayStr..."
+}}
+$Body = $Full
+
+if ($UseDelta) {{
+    $Known = @{{}}
+    foreach ($prop in $State.totals.PSObject.Properties) {{ $Known[$prop.Name] = [int]$prop.Value }}
+    $Changed = @($Products | Where-Object {{
+        $key = "$($_.cod).$($_.var)"
+        -not $Known.ContainsKey($key) -or $Known[$key] -ne $_.sold
+    }})
+    # Gone from the query (HAVING <> 0): the day's total is back to zero
+    foreach ($key in $Known.Keys) {{
+        if (-not $Current.ContainsKey($key) -and $Known[$key] -ne 0) {{
+            $parts = $key.Split('.')
+            $Changed += @{{ cod = [int]$parts[0]; var = [int]$parts[1]; sold = 0; shelf_life = $null }}
+        }}
+    }}
+    $Body = @{{
+        token     = $Token
+        sync_date = $TodayStr
+        mode      = 'delta'
+        seq       = $Seq
+        base_seq  = [int64]$State.seq
+        products  = $Changed
+    }}
+    Write-Host "Sending $($Changed.Count) changed of $($Products.Count) products for $TodayStr (seq $Seq)..."
+}} else {{
+    Write-Host "Sending $($Products.Count) products for $TodayStr (full, seq $Seq)..."
+}}
 
 try {{
-    $resp = Invoke-RestMethod -Uri $ServerUrl -Method POST -Body $Payload -ContentType "application/json" -ErrorAction Stop
+    $resp = Send-Payload $Body
     Write-Host "Sync OK."
 }} catch {{
-    Write-Host "ERROR: POST failed: $_"
-    exit 1
+    $status = $null
+    if ($_.Exception.Response) {{ $status = [int]$_.Exception.Response.StatusCode }}
+    if (-not ($UseDelta -and $status -eq 409)) {{
+        Write-Host "ERROR: POST failed: $_"
+        exit 1
+    }}
+    Write-Host "Server asked for a full resync, sending all $($Products.Count) products..."
+    $Body = $Full
+    try {{
+        $resp = Send-Payload $Body
+        Write-Host "Sync OK."
+    }} catch {{
+        Write-Host "ERROR: POST failed: $_"
+        exit 1
+    }}
+}}
+
+# Acknowledged: the server now holds exactly $Current
+try {{
+    @{{ date = $TodayStr; seq = $Body.seq; totals = $Current }} | ConvertTo-Json -Depth 3 -Compress |
+        Out-File -FilePath $StatePath -Encoding ASCII -Force
+}} catch {{
+    Write-Host "WARNING: could not save sync state, next run sends everything: $_"
 }}
 
-# Server-driven so a missed run just gets asked again, with no clock rule or local state.
+# Server-driven so a missed run just gets asked again, with no clock rule.
 if (-not $resp.send_curve) {{ exit 0 }}
 
 Write-Host "Server requested intraday curve, computing..."
@@ -3,8 +3,9 @@
 Celery tasks for automated operations.
 Replaces scheduler.py with proper distributed task queue.
 """
-from celery import shared_task
+from celery import shared_task, chain, group
 import datetime
+import os
 from django.utils import timezone
 from django.conf import settings
 import logging
@@ -214,7 +215,6 @@ def import_ddt_for_supermarket(self, supermarket_id):
     Login once, fetch all invoices for the supermarket, then apply deliveries
     per storage — one RestockLog per storage.
     """
-    import shutil
     from .models import Supermarket, RestockLog
     from .scripts.web_lister import WebLister
 
@@ -249,18 +249,20 @@ def import_ddt_for_supermarket(self, supermarket_id):
                 logger.info(f"[DDT] No DDT rows for {supermarket.name} on {yesterday}")
                 return
 
-            # Fetch righe once per distinct invoice number.
+            # Fetch righe once per distinct invoice number, in parallel, then
+            # merge in invoice order.
             # Track desc_mag → [invoice_numbers] using the first DescMag seen per invoice.
             seen = set()
+            invoices = []
+            for row in rows:
+                if row["X5NRCC"] not in seen:
+                    seen.add(row["X5NRCC"])
+                    invoices.append(row)
+
             all_righe = []
             desc_mag_to_invoices = {}  # desc_mag → [nrcc_stripped, ...]
-            for row in rows:
-                nrcc = row["X5NRCC"]
-                if nrcc in seen:
-                    continue
-                seen.add(nrcc)
-                nrcc_stripped = str(int(nrcc))
-                righe = lister.fetch_righe(row)
+            for row, righe in zip(invoices, lister.fetch_all_righe(invoices)):
+                nrcc_stripped = str(int(row["X5NRCC"]))
                 # Derive desc_mag for this invoice from its first riga
                 if righe:
                     dm = righe[1].get("DescMag", "").strip() if len(righe) > 1 else righe[0].get("DescMag", "").strip()
@@ -269,10 +271,10 @@ def import_ddt_for_supermarket(self, supermarket_id):
 
             # Group by DescMag — one group per storage
             grouped = lister.process_righe(all_righe)
+            lister.dropzone().log_metrics()
 
         finally:
-            lister.driver.quit()
-            shutil.rmtree(lister.user_data_dir, ignore_errors=True)
+            lister.close()
 
         # Fan out: one DB write + RestockLog per matched storage
         for desc_mag, ean_qty in grouped.items():
@@ -710,7 +712,6 @@ def add_products_unified_task(self, storage_id, products_list, settore):
     from .scripts.web_lister import WebLister
     from pathlib import Path
     from django.utils import timezone
-    import shutil
     
     _log_ctx = None
     try:
@@ -812,8 +813,7 @@ def add_products_unified_task(self, storage_id, products_list, settore):
                     'storage_id': storage_id
                 }
             finally:
-                lister.driver.quit()
-                shutil.rmtree(lister.user_data_dir, ignore_errors=True)
+                lister.close()
            
     except Exception as exc:
         logger.exception(f"[ADD PRODUCTS] Error for storage {storage_id}")
@@ -1008,7 +1008,6 @@ def verify_stock_with_auto_add_task(self, storage_id, pdf_file_path, cluster=Non
     from .scripts.web_lister import WebLister
     from pathlib import Path
     import os
-    import shutil
     
     _log_ctx = None
     try:
@@ -1183,8 +1182,7 @@ def verify_stock_with_auto_add_task(self, storage_id, pdf_file_path, cluster=Non
                         service.db.verify_stock(p['cod'], p['var'], p['qty'], cluster)
 
                 finally:
-                    lister.driver.quit()
-                    shutil.rmtree(lister.user_data_dir, ignore_errors=True)
+                    lister.close()
             
             # Step 5: Verify existing products
             self.update_state(
@@ -1357,7 +1355,7 @@ def order_promo_products_task(self, user_id, orders_list):
                             exit_order_log(_order_log_ctx)
 
                 finally:
-                    orderer.driver.quit()
+                    orderer.close()
             finally:
                 exit_supermarket_log(_sm_log_ctx)
 
@@ -1684,12 +1682,14 @@ def sync_storages_task(self, supermarket_id):
                 storage_name='',
                 download_dir=tmp_dir,
                 headless=True,
+                browser=True,
             )
             try:
                 lister.login()
                 client_data = lister.gather_client_data()
             finally:
-                lister.driver.quit()
+                # The XHR hook it injects stays in the browser: not for reuse
+                lister.close(discard=True)
 
         supermarket.id_cliente = client_data.get('id_cliente')
         supermarket.id_azienda = client_data.get('id_azienda')
@@ -1734,7 +1734,6 @@ def backfill_ean_and_id_for_verified_products(self):
     from .services import RestockService
     from .scripts.web_lister import WebLister
     from pathlib import Path
-    import shutil
     import time
 
     try:
@@ -1807,12 +1806,7 @@ def backfill_ean_and_id_for_verified_products(self):
                                     total_failed += 1
                                     continue
 
-                                cur = service.db.cursor()
-                                cur.execute(
-                                    "UPDATE products SET ean = %s WHERE cod = %s AND v = %s",
-                                    (ean, cod, v)
-                                )
-                                service.db.conn.commit()
+                                service.db.set_product_ean(cod, v, ean)
                                 total_updated += 1
                                 logger.info(f"[EAN BACKFILL] {cod}.{v} -> EAN {ean}")
 
@@ -1823,8 +1817,7 @@ def backfill_ean_and_id_for_verified_products(self):
                             time.sleep(0.1)
 
                 finally:
-                    lister.driver.quit()
-                    shutil.rmtree(lister.user_data_dir, ignore_errors=True)
+                    lister.close()
             finally:
                 exit_supermarket_log(_log_ctx)
 
@@ -1847,7 +1840,6 @@ def fetch_single_ean(storage_id, cod, v):
     from .services import RestockService
     from .scripts.web_lister import WebLister
     from pathlib import Path
-    import shutil
 
     storage = Storage.objects.select_related('supermarket').get(id=storage_id)
     _log_ctx = enter_supermarket_log(storage.supermarket.name)
@@ -1878,16 +1870,13 @@ def fetch_single_ean(storage_id, cod, v):
 
         ean = product_data[7]
         with RestockService(storage) as service:
-            cur = service.db.cursor()
-            cur.execute("UPDATE products SET ean = %s WHERE cod = %s AND v = %s", (ean, cod, v))
-            service.db.conn.commit()
+            service.db.set_product_ean(cod, v, ean)
 
         logger.info(f"[EAN FETCH] {cod}.{v} -> EAN {ean}")
         return {'ean': ean, 'message': f'EAN {ean} salvato per {cod}.{v}'}
 
     finally:
-        lister.driver.quit()
-        shutil.rmtree(lister.user_data_dir, ignore_errors=True)
+        lister.close()
         exit_supermarket_log(_log_ctx)
 
 
@@ -1902,7 +1891,6 @@ def fetch_product_from_ean(storage_id, ean, qty=None, loss_type=None):
     from .services import RestockService
     from .scripts.web_lister import WebLister
     from pathlib import Path
-    import shutil
 
     storage = Storage.objects.select_related('supermarket').get(id=storage_id)
     _log_ctx = enter_supermarket_log(storage.supermarket.name)
@@ -1946,9 +1934,7 @@ def fetch_product_from_ean(storage_id, ean, qty=None, loss_type=None):
         new_ean = latest_ean if latest_ean is not None else ean
 
         with RestockService(storage) as service:
-            cur = service.db.cursor()
-            cur.execute("UPDATE products SET ean=%s WHERE cod=%s AND v=%s", (new_ean, cod, v))
-            service.db.conn.commit()
+            service.db.set_product_ean(cod, v, new_ean)
 
             if qty and loss_type:
                 service.db.register_losses(cod, v, qty, loss_type)
@@ -1958,8 +1944,7 @@ def fetch_product_from_ean(storage_id, ean, qty=None, loss_type=None):
         return {'success': True, 'ean': ean, 'cod': cod, 'v': v, 'new_ean': new_ean, 'message': f'EAN aggiornato per {cod}.{v} ({new_ean})'}
 
     finally:
-        lister.driver.quit()
-        shutil.rmtree(lister.user_data_dir, ignore_errors=True)
+        lister.close()
         exit_supermarket_log(_log_ctx)
 
 
@@ -1986,6 +1971,81 @@ def roll_sales_day_for_supermarket(self, supermarket_id, day_iso):
         exit_supermarket_log(_ctx)
 
 
+@shared_task(bind=True, acks_late=True)
+def apply_realtime_sales_queue(self, supermarket_id):
+    """
+    Apply the realtime payloads queued for one supermarket (RT_SYNC_INGEST_MODE="queue").
+
+    On the default queue, with the other database-only tasks: the deployed worker
+    consumes it, and nothing here waits on a browser the way the selenium queue does.
+
+    Drains the schema's inbox under its realtime-sync lock, so a supermarket's payloads
+    are applied one at a time and in arrival order whatever the worker count, while
+    different supermarkets proceed in parallel. Pending payloads for the same day are
+    coalesced into one (see DatabaseManager.claim_realtime_sales). A task that finds the
+    inbox already drained by its predecessor simply returns.
+
+    No retry: a failed payload is marked 'failed' and the delta sequence cleared, so the
+    store's next run, 30 minutes later, resends its full totals.
+    """
+    from .models import Supermarket
+    from .scripts.DatabaseManager import DatabaseManager
+    from .services import record_realtime_sync
+
+    supermarket = Supermarket.objects.get(id=supermarket_id)
+    _ctx = enter_supermarket_log(supermarket.name)
+    db = None
+    applied = 0
+    try:
+        db = DatabaseManager(supermarket_name=supermarket.name)
+        with db.realtime_sync_lock():
+            while True:
+                payloads = db.claim_realtime_sales()
+                if not payloads:
+                    break
+                for payload in payloads:
+                    receipt = payload['id']
+                    try:
+                        result = db.apply_realtime_sales(
+                            payload['totals'], payload['sync_date'],
+                            shelf_life_map=payload['shelf_life_map'],
+                        )
+                    except Exception as e:
+                        logger.exception(f"[RT SYNC] {supermarket.name}: receipt {receipt} failed")
+                        db.finish_realtime_sales(receipt, 'failed', {'error': str(e)})
+                        # Its sequence was acknowledged on receipt: clear it, so the
+                        # store's next delta is refused and it resyncs in full.
+                        db.set_realtime_seq(payload['sync_date'], None)
+                        continue
+
+                    received = len(payload['totals'])
+                    unverified = record_realtime_sync(
+                        supermarket, payload['sync_date'], received, result, delta=payload['delta']
+                    )
+                    db.finish_realtime_sales(receipt, 'applied', {
+                        'received': received,
+                        'merged': payload['merged'],
+                        'changed': result['applied'],
+                        'unchanged': result['unchanged'],
+                        'not_in_db': result['not_in_db'],
+                        'units': result['units_applied'],
+                        'rolled_over': result['rolled_over'],
+                        'unverified': len(unverified),
+                    })
+                    applied += 1
+                    logger.info(
+                        f"[RT SYNC] supermarket='{supermarket.name}' date={payload['sync_date']} "
+                        f"receipt={receipt} received={received} changed={result['applied']} "
+                        f"units={result['units_applied']} rolled_over={result['rolled_over']} "
+                        f"unverified={len(unverified)}"
+                    )
+        return f"{supermarket.name}: {applied} payloads applied"
+    finally:
+        if db:
+            db.close()
+        exit_supermarket_log(_ctx)
+
+
 @shared_task(bind=True, max_retries=2, default_retry_delay=300)
 def roll_sales_day_all_supermarkets(self):
     """
@@ -2011,6 +2071,12 @@ def roll_sales_day_all_supermarkets(self):
 
 RT_SYNC_STALE_BLOCK_HOURS = 3
 
+# How run_scheduled_orders dispatches the storages due in one pass.
+#   "storage":     one run_restock_for_storage per storage, each reading every input itself.
+#   "supermarket": one plan_orders_for_supermarket per supermarket, which loads the
+#                  per-supermarket inputs once and plans its storages in parallel.
+ORDER_PLANNING_MODE = os.environ.get('ORDER_PLANNING_MODE', 'storage')
+
 
 def _realtime_sync_is_usable(supermarket, now_local, today, storage_name) -> bool:
     """
@@ -2049,6 +2115,164 @@ def _realtime_sync_is_usable(supermarket, now_local, today, storage_name) -> boo
     return False
 
 
+@shared_task(bind=True, max_retries=2, default_retry_delay=300)
+def plan_orders_for_supermarket(self, supermarket_id, storage_ids):
+    """
+    Supermarket-level order planning for the storages due in one scheduler pass.
+
+    Losses, promos, the closure mask and product links belong to the supermarket, not
+    the storage, so they are read once here and passed along. Each storage then gets
+    its own RestockLog and a chain of plan_storage_order (any worker, so the storages
+    are calculated in parallel) and place_planned_order (the selenium queue, one
+    Orderer per storage as before).
+
+    Retried only while nothing has been written: once RestockLogs exist (and maybe
+    their chains are queued), a retry would plan and order those storages twice, so
+    a failure from there on marks the logs failed instead.
+    """
+    from .models import Supermarket, Storage, RestockLog, ProductLink
+    from .scripts.DatabaseManager import DatabaseManager
+    from .scripts.decision_maker import DecisionMaker
+    from .scripts.helpers import Helper
+
+    _log_ctx = None
+    try:
+        try:
+            supermarket = Supermarket.objects.get(id=supermarket_id)
+            _log_ctx = enter_supermarket_log(supermarket.name)
+
+            db = DatabaseManager(supermarket_name=supermarket.name)
+            try:
+                planner = DecisionMaker(db, Helper(), product_links=ProductLink.build_pairs(supermarket))
+                shared_inputs = planner.export_shared_inputs()
+            finally:
+                db.close()
+            storages = list(Storage.objects.filter(id__in=storage_ids, supermarket=supermarket))
+        except Exception as exc:
+            logger.exception(f"[CELERY-PLAN] Error loading inputs for supermarket {supermarket_id}")
+            raise self.retry(exc=exc)
+
+        logs = []
+        try:
+            plans = []
+            for storage in storages:
+                log = RestockLog.objects.create(
+                    storage=storage,
+                    status='processing',
+                    current_stage='pending',
+                    operation_type='full_restock',
+                    started_at=timezone.now()
+                )
+                logs.append(log)
+                plans.append(chain(
+                    plan_storage_order.s(log.id, shared_inputs),
+                    place_planned_order.s(),
+                ))
+
+            group(plans).apply_async()
+        except Exception as e:
+            logger.exception(f"[CELERY-PLAN] Error dispatching orders for {supermarket.name}, not retried")
+            for log in logs:
+                log.status = 'failed'
+                log.error_message = f"Order planning could not be dispatched: {e}"
+                log.completed_at = timezone.now()
+                log.save()
+            raise
+
+        logger.info(
+            f"[CELERY-PLAN] {supermarket.name}: planning {len(plans)} storages in parallel "
+            f"({len(shared_inputs['internal'])} internal-loss, {len(shared_inputs['expired'])} expired-loss, "
+            f"{len(shared_inputs['sales'])} promo entries shared)"
+        )
+        return len(plans)
+
+    finally:
+        exit_supermarket_log(_log_ctx)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=900)
+def plan_storage_order(self, log_id, shared_inputs):
+    """
+    Calculate one storage's order into its RestockLog. Returns the log id for
+    place_planned_order, or None when there is nothing left to place.
+
+    shared_inputs are only trusted on the day they were read: the closure mask and
+    the ended-promo ages are relative to it, and a retry can run past midnight. A
+    stale set is dropped and the storage reads its own.
+    """
+    from .models import RestockLog
+
+    log = RestockLog.objects.select_related('storage__supermarket', 'storage__schedule').get(id=log_id)
+    _log_ctx = enter_supermarket_log(log.storage.supermarket.name)
+    try:
+        today = datetime.date.today().isoformat()
+        if shared_inputs is not None and shared_inputs.get("date") != today:
+            logger.warning(
+                f"[CELERY-PLAN] Log #{log_id}: shared inputs are from {shared_inputs.get('date')}, "
+                f"not {today}; reading them again for {log.storage.name}"
+            )
+            shared_inputs = None
+
+        if self.request.retries:
+            log.status = 'processing'
+            log.current_stage = 'processing'
+            log.error_message = None
+            log.retry_count = (log.retry_count or 0) + 1
+            log.save()
+
+        with AutomatedRestockService(log.storage) as service:
+            service.run_full_restock_workflow(
+                log=log,
+                skip_stats_update=True,
+                shared_inputs=shared_inputs,
+                place_order=False,
+            )
+        logger.info(
+            f"[CELERY-PLAN] Order calculated for {log.storage.name} "
+            f"(Log #{log.id}: {log.products_ordered} products)"
+        )
+        return None if log.status == 'completed' else log.id
+
+    except Exception as exc:
+        logger.exception(f"[CELERY-PLAN] Error calculating order for log #{log_id}")
+        raise self.retry(exc=exc)
+    finally:
+        exit_supermarket_log(_log_ctx)
+
+
+@shared_task(
+    bind=True,
+    max_retries=3,
+    default_retry_delay=900,
+    queue='selenium',
+    acks_late=True,
+    reject_on_worker_lost=True
+)
+def place_planned_order(self, log_id):
+    """Send an order calculated by plan_storage_order to the supplier."""
+    from .models import RestockLog
+
+    if log_id is None:
+        return None
+
+    log = RestockLog.objects.select_related('storage__supermarket').get(id=log_id)
+    _log_ctx = enter_supermarket_log(log.storage.supermarket.name)
+    try:
+        with AutomatedRestockService(log.storage) as service:
+            service.place_planned_order(log)
+        logger.info(
+            f"✓ [CELERY-ORDER] Placed planned order for {log.storage.name} "
+            f"(Log #{log.id}: {log.products_ordered} products, {log.total_packages} packages)"
+        )
+        return log.id
+
+    except Exception as exc:
+        logger.exception(f"[CELERY-ORDER] Error placing planned order for log #{log_id}")
+        raise self.retry(exc=exc)
+    finally:
+        exit_supermarket_log(_log_ctx)
+
+
 @shared_task(
     bind=True,
     max_retries=3,
@@ -2064,6 +2288,9 @@ def run_scheduled_orders(self):
 
     Fires late rather than not at all: a missed order costs a stockout, a late one just
     covers a shorter window, which coverage already accounts for.
+
+    With ORDER_PLANNING_MODE="supermarket" the storages due in this pass are handed to
+    plan_orders_for_supermarket instead, one task per supermarket.
     """
     from .models import Storage, is_closure_day, ScheduleException, OrderDispatch
 
@@ -2080,6 +2307,7 @@ def run_scheduled_orders(self):
 
         queued = 0
         skipped = 0
+        due_by_supermarket = {}  # supermarket id -> [storage id], planning mode "supermarket"
 
         for storage in storages:
             # Routine skips stay at debug: this runs 96 times a day, and at info level
@@ -2139,16 +2367,22 @@ def run_scheduled_orders(self):
                 skipped += 1
                 continue
 
-            run_restock_for_storage.apply_async(
-                args=[storage.id],
-                kwargs={'skip_stats_update': True},
-            )
+            if ORDER_PLANNING_MODE == 'supermarket':
+                due_by_supermarket.setdefault(supermarket.id, []).append(storage.id)
+            else:
+                run_restock_for_storage.apply_async(
+                    args=[storage.id],
+                    kwargs={'skip_stats_update': True},
+                )
             logger.info(
                 f"[CELERY-SCHED] Queued restock for {storage.name} "
                 f"(slot {order_time:%H:%M}, fired {now_local:%H:%M})"
             )
             queued += 1
 
+        for supermarket_id, storage_ids in due_by_supermarket.items():
+            plan_orders_for_supermarket.apply_async(args=[supermarket_id, storage_ids])
+
         msg = f"Scheduled orders: {queued} queued, {skipped} skipped"
         if queued:
             logger.info(f"[CELERY-SCHED] {msg}")
@@ -2403,4 +2637,4 @@ def prepend_monthly_sold_zeros(self):
 
     except Exception as exc:
         logger.exception("[MONTHLY-ROLLOVER] Fatal error (sold_last_24)")
-        raise self.retry(exc=exc)
\ No newline at end of file
+        raise self.retry(exc=exc)
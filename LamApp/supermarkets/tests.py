@@ -1,3 +1,545 @@
-from django.test import TestCase
+import gzip
+import json
+import math
+import os
+import random
+import uuid
+from datetime import date, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.test import RequestFactory, SimpleTestCase
+from psycopg2.extras import Json, execute_values
+
+from . import sync_views, tasks
+from .models import Supermarket
+from .scripts import feature_store, synthetic_dataset
+from .scripts.orderer import Orderer
+from .scripts.DatabaseManager import DatabaseManager
+from .scripts.decision_maker import DecisionMaker
+from .scripts.helpers import Helper
+from .scripts.processor_N import process_N_sales, process_N_sales_batch
+
+
+def random_history(rng):
+    """A completed-days sales history as the order run sees it: newest first, None for censored days."""
+    length = rng.choice((0, 5, 13, 14, 20, 27, 28, 35, 41, 59, 59, 59))
+    rate = rng.choice((0, 0.1, 0.4, 1, 2.5, 6, 15))
+    history = []
+    for _ in range(length):
+        if rng.random() < 0.06:
+            history.append(None)
+        elif rng.random() < 0.03:
+            history.append(rng.randint(20, 120))     # bulk purchase, to be winsorized
+        else:
+            history.append(max(0, round(rng.gauss(rate, math.sqrt(rate) * 1.5))))
+    return history
+
+
+class BatchStatsMatchHelperTest(SimpleTestCase):
+    """
+    DecisionMaker's batch path must give the very orders the scalar path gives, so the
+    matrix statistics are compared for exact equality with Helper's, not approximately.
+    """
+
+    def test_features_match_scalar_helpers(self):
+        rng = random.Random(20261017)
+        for today in (date(2026, 10, 12), date(2026, 10, 15), date(2026, 10, 18)):
+            histories = [random_history(rng) for _ in range(800)]
+            closure_mask = [rng.random() < 0.04 for _ in range(59)]
+
+            features = feature_store.compute_features(histories, closure_mask, today=today)
+
+            for history, (avg, deviation, sigma) in zip(histories, features):
+                with self.subTest(today=today, history=history):
+                    self.assertEqual(avg, Helper.avg_daily_sales_from_sales_sets(history, silent=True))
+                    self.assertEqual(deviation, Helper.calculate_deviation(history, silent=True))
+                    self.assertEqual(sigma, Helper.demand_sigma_daily(history, closure_mask, today=today))
+
+    def test_process_n_sales_batch_matches_scalar(self):
+        rng = random.Random(7)
+        cases = []
+        for _ in range(3000):
+            avg = rng.choice((0.0, 0.05, 0.2, 0.5, 0.9, 1.7, 4.2, 12.5)) * rng.uniform(0.5, 1.5)
+            coverage = rng.choice((2, 3, 4, 5, 6))
+            shelf_life = rng.choice((None, None, 5, 9, 21, 60))
+            cases.append(dict(
+                package_size=rng.choice((1, 4, 6, 12, 24)),
+                deviation_corrected=rng.choice((0, 0, -50, -20.5, 12.25, 50)),
+                avg_daily_sales=avg,
+                req_stock=avg * coverage * rng.choice((1, 1, 1.1, 1.5)),
+                stock=rng.randint(0, 40),
+                discount=rng.choice((None, None, None, 10, 25.5)),
+                minimum_stock_base=rng.choice((3, 4, 6)),
+                minimum_stock_override=rng.choice((None,) * 8 + (0, 2, 5)),
+                expiry_factor=rng.choice((None, None, 0.5, 0.8)) if shelf_life else None,
+                shelf_life_days=shelf_life,
+                batch_expiry_factor=rng.choice((None, True)) if shelf_life else None,
+                sigma_L=rng.choice((None, 0.0, 0.7, 1.9, 6.3)),
+            ))
+
+        safety_z = 0.8
+        orders, checks = process_N_sales_batch(
+            [c["package_size"] for c in cases],
+            [c["deviation_corrected"] for c in cases],
+            [c["avg_daily_sales"] for c in cases],
+            [c["req_stock"] for c in cases],
+            [c["stock"] for c in cases],
+            [c["discount"] is not None for c in cases],
+            6,
+            [math.nan if c["minimum_stock_override"] is None else c["minimum_stock_override"] for c in cases],
+            [math.nan if c["expiry_factor"] is None else c["expiry_factor"] for c in cases],
+            [math.nan if c["shelf_life_days"] is None else c["shelf_life_days"] for c in cases],
+            [bool(c["batch_expiry_factor"]) for c in cases],
+            [math.nan if c["sigma_L"] is None else c["sigma_L"] for c in cases],
+            safety_z,
+        )
+
+        for case, order, check in zip(cases, orders, checks):
+            with self.subTest(**case):
+                result, scalar_check, _, _ = process_N_sales(**dict(case, minimum_stock_base=6), safety_z=safety_z)
+                self.assertEqual(int(order), result or 0)
+                self.assertEqual(int(check), scalar_check)
+
+
+@skipUnless(os.environ.get("PG_DATABASE"), "needs PostgreSQL (PG_HOST, PG_DATABASE, PG_USER, PG_PASSWORD)")
+class SchemaTestCase(SimpleTestCase):
+    """A throwaway supermarket schema per test, made by DatabaseManager.create_tables."""
+
+    # DatabaseManager.SALES_STORAGE for the test; None keeps SALES_HISTORY_STORAGE's
+    sales_storage = None
+
+    def setUp(self):
+        if self.sales_storage is not None:
+            patcher = mock.patch.object(DatabaseManager, "SALES_STORAGE", self.sales_storage)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.schema = f"test_{uuid.uuid4().hex[:12]}"
+        self.db = DatabaseManager(self.schema)
+        self.db.create_tables()
+
+    def tearDown(self):
+        self.db.close()
+        admin = DatabaseManager()
+        try:
+            admin.cursor().execute(f"DROP SCHEMA IF EXISTS {self.schema} CASCADE")
+        finally:
+            admin.close()
+        DatabaseManager._upgraded_schemas.discard(self.schema)
+        DatabaseManager._rolled_through.pop(self.schema, None)
+
+
+class DecisionMakerBatchTest(SchemaTestCase):
+
+    def test_batch_orders_match_scalar(self):
+        data = synthetic_dataset.build_supermarket(1, 1500, seed=3)
+        synthetic_dataset.write_supermarket(self.schema, data)
+
+        for settore, (_, minimum_stock, _, _) in synthetic_dataset.SETTORI.items():
+            orders = {}
+            for batch in (False, True):
+                decision_maker = DecisionMaker(DatabaseManager(self.schema), Helper(), product_links=data["links"])
+                try:
+                    decision_maker.decide_orders_for_settore(settore, 3.5, minimum_stock, batch=batch)
+                finally:
+                    decision_maker.close()
+                orders[batch] = (decision_maker.orders_list, decision_maker.zombie_products)
+            with self.subTest(settore=settore):
+                self.assertTrue(orders[False][0])
+                self.assertEqual(orders[True], orders[False])
+
+
+def old_roll(row, sync_date):
+    """The per-product Python roll _rollover_sales_day replaced, kept as the reference."""
+    if row["last_update_sold"] is not None and row["last_update_sold"] >= sync_date:
+        return row
+    ss = list(row["sales_sets"] or [])
+    bs = list(row["bought_sets"] or [])
+    if ss and (ss[0] or 0) == 0 and row["verified"]:
+        if (row["stock"] or 0) == 0 and row["disponibilita"] != 'No':
+            previous = next((x for x in ss[1:] if x is not None), None)
+            if previous is not None and previous > 0:
+                ss[0] = None
+    ss.insert(0, 0)
+    bs.insert(0, 0)
+    return dict(row, sales_sets=ss[:60], bought_sets=bs[:60], last_update_sold=sync_date)
+
+
+class RollSalesDayTest(SchemaTestCase):
+
+    # old_roll works on the arrays; SalesStorageTest holds "table" to the same results
+    sales_storage = "jsonb"
+
+    def test_roll_matches_python_reference(self):
+        rng = random.Random(14)
+        sync_date = date(2026, 10, 17)
+        rows = []
+        for cod in range(1, 801):
+            sales = [rng.choice((None, 0, 0, 0, 1, 2, 7)) for _ in range(rng.randint(0, 62))]
+            if sales and rng.random() < 0.5:
+                sales[0] = rng.choice((None, 0))
+            rows.append({
+                "cod": cod, "v": 1,
+                "sales_sets": None if rng.random() < 0.05 else sales,
+                "bought_sets": None if rng.random() < 0.05 else [
+                    rng.choice((0, 0, 6, 12)) for _ in range(rng.randint(0, 62))],
+                "stock": rng.choice((None, 0, 0, 0, 3)),
+                "verified": rng.random() < 0.8,
+                "disponibilita": rng.choice(("Si", "Si", "No", "N.B.")),
+                "last_update_sold": rng.choice(
+                    (None, sync_date - timedelta(days=1), sync_date - timedelta(days=4), sync_date)),
+            })
+
+        with self.db.transaction() as cur:
+            execute_values(cur, """
+                INSERT INTO products (cod, v, descrizione, settore, disponibilita) VALUES %s
+            """, [(r["cod"], r["v"], f"P{r['cod']}", "TEST", r["disponibilita"]) for r in rows])
+            execute_values(cur, """
+                INSERT INTO product_stats (cod, v, sales_sets, bought_sets, stock, verified, last_update_sold)
+                VALUES %s
+            """, [(r["cod"], r["v"], Json(r["sales_sets"]) if r["sales_sets"] is not None else None,
+                   Json(r["bought_sets"]) if r["bought_sets"] is not None else None,
+                   r["stock"], r["verified"], r["last_update_sold"]) for r in rows])
+
+        due = sum(1 for r in rows if r["last_update_sold"] is None or r["last_update_sold"] < sync_date)
+        self.assertEqual(self.db.roll_sales_day(sync_date), due)
+        self.assertEqual(self.db.roll_sales_day(sync_date), 0)
+
+        cur = self.db.cursor()
+        cur.execute("SELECT cod, sales_sets, bought_sets, last_update_sold FROM product_stats")
+        rolled = {r["cod"]: r for r in cur.fetchall()}
+        for row in rows:
+            expected = old_roll(row, sync_date)
+            with self.subTest(row=row):
+                got = rolled[row["cod"]]
+                self.assertEqual(got["last_update_sold"], expected["last_update_sold"])
+                self.assertEqual(got["sales_sets"], expected["sales_sets"])
+                self.assertEqual(got["bought_sets"], expected["bought_sets"])
+
+
+class SalesStorageTest(SchemaTestCase):
+    """SALES_STORAGE "table" against the JSONB arrays: the same day read the same way."""
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(21)
+        self.today = date.today()
+        self.rows = []
+        for cod in range(1, 401):
+            length = rng.randint(1, 62)
+            history = None if rng.random() < 0.05 else (
+                [rng.choice((None, 0, 0, 0, 1, 2, 7)) for _ in range(length)],
+                [rng.choice((0, 0, 0, 6, 12)) for _ in range(length)],
+            )
+            if history and rng.random() < 0.5:
+                history[0][0] = rng.choice((None, 0))
+            self.rows.append({
+                "cod": cod, "history": history,
+                "stock": rng.choice((None, 0, 0, 3, 20)),
+                "verified": rng.random() < 0.8,
+                "disponibilita": rng.choice(("Si", "Si", "No", "N.B.")),
+                "rapp": rng.choice((1, 1, 6)),
+                "last_update_sold": None if rng.random() < 0.05 else self.today - timedelta(days=1),
+            })
+        keys = [r["cod"] for r in self.rows]
+        self.syncs = []
+        totals = {}
+        for _ in range(2):
+            for cod in rng.sample(keys, 120):
+                totals[cod] = totals.get(cod, 0) + rng.randint(1, 4)
+            self.syncs.append([(cod, 1, sold) for cod, sold in totals.items()] + [(9999, 1, 3)])
+        self.deliveries = {(cod, 1): rng.randint(1, 4) for cod in rng.sample(keys, 80)}
+        # Losses go to the completed days, which the roll may censor; JSONB cannot add to those
+        safe = [r["cod"] for r in self.rows if r["history"] and r["history"][0][0]
+                and None not in r["history"][0][:3]]
+        self.losses = [(cod, 1, rng.randint(1, 9)) for cod in rng.sample(safe, 40)]
+        self.purged = rng.sample(keys, 25)
+
+    def use_storage(self, storage):
+        """Reopen self.db with `storage`, converting the schema's history as a deploy would."""
+        self.db.close()
+        DatabaseManager._upgraded_schemas.discard(self.schema)
+        with mock.patch.object(DatabaseManager, "SALES_STORAGE", storage):
+            self.db = DatabaseManager(self.schema)
+        patcher = mock.patch.object(self.db, "SALES_STORAGE", storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_day(self):
+        """Load the fixtures and run a day over them; returns what the readers see."""
+        with self.db.transaction() as cur:
+            cur.execute("TRUNCATE products, product_stats, daily_sales, extra_losses, store_daily_totals CASCADE")
+            cur.execute("DELETE FROM sales_roll_state")
+            execute_values(cur, """
+                INSERT INTO products (cod, v, descrizione, settore, disponibilita, rapp) VALUES %s
+            """, [(r["cod"], 1, f"P{r['cod']}", "TEST", r["disponibilita"], r["rapp"]) for r in self.rows])
+            execute_values(cur, """
+                INSERT INTO product_stats (cod, v, sales_sets, bought_sets, stock, verified, last_update_sold)
+                VALUES %s
+            """, [(r["cod"], 1, *(Json(h) for h in r["history"] or (None, None)),
+                   r["stock"], r["verified"], r["last_update_sold"]) for r in self.rows])
+            if self.db.SALES_STORAGE == "table":
+                self.db._history_to_table(cur)
+        DatabaseManager._rolled_through.pop(self.schema, None)
+
+        self.db.roll_sales_day(self.today)
+        for payload in self.syncs:
+            self.db.apply_realtime_sales(payload, self.today)
+        self.db.apply_invoice_deliveries(self.deliveries)
+        self.db.register_losses_bulk(self.losses, "internal", spread_days=3)
+        day = {"totals": self.db.get_store_daily_totals()}
+        self.db.purge_products([(cod, 1) for cod in self.purged])
+        day["totals_after_purge"] = self.db.get_store_daily_totals()
+        day["stats"] = self.read_stats()
+        return day
+
+    def read_stats(self):
+        cur = self.db.cursor()
+        cur.execute(f"""
+            SELECT ps.cod, {self.db.sales_sets_sql("ps")} AS sales_sets,
+                   {self.db.bought_sets_sql("ps")} AS bought_sets, ps.stock, ps.sold_last_24
+            FROM product_stats ps
+        """)
+        return {r["cod"]: dict(r) for r in cur.fetchall()}
+
+    def test_table_reads_like_jsonb(self):
+        self.use_storage("jsonb")
+        expected = self.run_day()
+        self.use_storage("table")
+        got = self.run_day()
+
+        self.assertEqual(got["totals"], expected["totals"])
+        self.assertEqual(got["totals_after_purge"], expected["totals_after_purge"])
+        self.assertEqual(got["stats"].keys(), expected["stats"].keys())
+        for cod, row in expected["stats"].items():
+            with self.subTest(cod=cod):
+                self.assertEqual(got["stats"][cod], row)
+
+    def test_conversion_round_trip(self):
+        self.use_storage("jsonb")
+        expected = self.run_day()["stats"]
+        self.use_storage("table")
+        self.assertEqual(self.read_stats(), expected)
+        self.use_storage("jsonb")
+        self.assertEqual(self.read_stats(), expected)
+
+        cur = self.db.cursor()
+        cur.execute("SELECT COUNT(*) AS n FROM daily_sales")
+        self.assertEqual(cur.fetchone()["n"], 0)
+
+
+class RelativeStockTest(SchemaTestCase):
+    """Batched stock writes keep a change another connection makes after the batch's read."""
+
+    def setUp(self):
+        super().setUp()
+        with self.db.transaction() as cur:
+            cur.execute("INSERT INTO products (cod, v, descrizione, settore, rapp) VALUES (1, 1, 'P1', 'TEST', 1)")
+            cur.execute("""
+                INSERT INTO product_stats (cod, v, sales_sets, bought_sets, stock, verified, last_update_sold)
+                VALUES (1, 1, '[0]', '[0]', 10, TRUE, %s)
+            """, (date.today(),))
+            if self.db.SALES_STORAGE == "table":
+                self.db._history_to_table(cur)
+
+    def interleave(self, change):
+        """Run `change` on its own connection just before the batch's first write."""
+        real = execute_values
+        pending = [change]
+
+        def write(*args, **kwargs):
+            if pending:
+                other = DatabaseManager(self.schema)
+                try:
+                    pending.pop()(other)
+                finally:
+                    other.close()
+            return real(*args, **kwargs)
+
+        return mock.patch("supermarkets.scripts.DatabaseManager.execute_values", side_effect=write)
+
+    def test_delivery_keeps_a_concurrent_sale(self):
+        with self.interleave(lambda other: other.adjust_stock(1, 1, -3)):
+            self.db.apply_invoice_deliveries({(1, 1): 5})
+        self.assertEqual(self.db.get_stock(1, 1), 12)
+
+    def test_losses_keep_a_concurrent_delivery(self):
+        with self.interleave(lambda other: other.apply_invoice_deliveries({(1, 1): 4})):
+            self.db.register_losses_bulk([(1, 1, 2), (1, 1, 1)], "broken")
+        self.assertEqual(self.db.get_stock(1, 1), 11)
+
+
+class MonthlyLossRolloverTest(SchemaTestCase):
+
+    def test_rollover_matches_python_reference(self):
+        rng = random.Random(16)
+        loss_types = DatabaseManager.LOSS_TYPES
+        long_ago = date(2026, 9, 1)
+        rows = []
+        for cod in range(1, 301):
+            row = {"cod": cod, "v": 1}
+            for t in loss_types:
+                row[t] = rng.choice((
+                    None,
+                    [],
+                    [[rng.randint(0, 5), rng.randint(0, 3)] for _ in range(rng.randint(1, 30))],
+                    {"not": "an array"},
+                    7,
+                ))
+            rows.append(row)
+
+        with self.db.transaction() as cur:
+            execute_values(cur, "INSERT INTO products (cod, v, descrizione, settore) VALUES %s",
+                           [(r["cod"], r["v"], f"P{r['cod']}", "TEST") for r in rows])
+            columns = ", ".join(f"{t}, {t}_updated" for t in loss_types)
+            execute_values(cur, f"INSERT INTO extra_losses (cod, v, {columns}) VALUES %s", [
+                (r["cod"], r["v"], *(v for t in loss_types for v in (
+                    Json(r[t]) if r[t] is not None else None, long_ago)))
+                for r in rows
+            ])
+
+        rolled = self.db.prepend_monthly_loss_zeros()
+
+        # The old per-column loop: only lists roll, and they keep 24 months
+        today = date.today()
+        expected_rolled = 0
+        cur = self.db.cursor()
+        cur.execute("SELECT * FROM extra_losses")
+        got = {r["cod"]: r for r in cur.fetchall()}
+        for row in rows:
+            for t in loss_types:
+                arr = row[t]
+                if isinstance(arr, list):
+                    expected_rolled += 1
+                    expected, updated = ([[0, 0]] + arr)[:24], today
+                else:
+                    expected, updated = arr, long_ago
+                with self.subTest(cod=row["cod"], loss_type=t):
+                    self.assertEqual(got[row["cod"]][t], expected)
+                    self.assertEqual(got[row["cod"]][f"{t}_updated"], updated)
+        self.assertEqual(rolled, expected_rolled)
+
+
+class OrdererSkipsTest(SimpleTestCase):
+
+    def test_each_order_reports_only_its_own_skips(self):
+        browser = mock.Mock(driver=mock.MagicMock(), user_data_dir=None)
+        # Every product shows the "doesn't accept orders" switch
+        browser.driver.find_elements.side_effect = (
+            lambda by, xpath: ["label"] if "label-off" in xpath else [])
+        with mock.patch("supermarkets.scripts.orderer.browser_pool.lease", return_value=browser):
+            orderer = Orderer("user", "secret")
+        orderer.wait = mock.MagicMock()
+        orderer._fill = mock.Mock()
+        orderer._select_storage = mock.Mock()
+
+        _, first = orderer.make_orders("1 FRESCO", [(1, 1, 4, None), (2, 1, 6, None)])
+        _, second = orderer.make_orders("2 SECCO", [(3, 1, 2, None)])
+
+        self.assertEqual([p["cod"] for p in first], [1, 2])
+        self.assertEqual([p["cod"] for p in second], [3])
+
+
+class RealtimeSyncTest(SchemaTestCase):
+    """The delta sequence and the queued inbox behind realtime_sales_sync_view."""
+
+    def setUp(self):
+        super().setUp()
+        self.today = date.today()
+        self.supermarket = Supermarket(id=1, name=self.schema)
+        with self.db.transaction() as cur:
+            execute_values(cur, "INSERT INTO products (cod, v, descrizione, settore) VALUES %s",
+                           [(cod, 1, f"P{cod}", "TEST") for cod in (1, 2, 3)])
+            execute_values(cur, """
+                INSERT INTO product_stats (cod, v, sales_sets, bought_sets, stock, verified, last_update_sold)
+                VALUES %s
+            """, [(cod, 1, Json([0]), Json([0]), 10, True, self.today) for cod in (1, 2, 3)])
+            if self.db.SALES_STORAGE == "table":
+                self.db._history_to_table(cur)
+        # Only the supermarket schema is real: the Django rows are stood in for
+        for patcher in (
+            mock.patch.object(Supermarket.objects, "get", return_value=self.supermarket),
+            mock.patch.object(sync_views, "record_realtime_sync", return_value=[]),
+            mock.patch.object(sync_views, "_curve_is_stale", return_value=False),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, **body):
+        request = RequestFactory().post(
+            "/api/sync/realtime-sales/",
+            data=json.dumps(dict(token="t", sync_date=self.today.isoformat(), **body)),
+            content_type="application/json",
+        )
+        return sync_views.realtime_sales_sync_view(request)
+
+    def stock(self, cod):
+        return self.db.get_stock(cod, 1)
+
+    def test_delta_on_another_base_asks_for_a_resync(self):
+        response = self.post(mode="absolute", seq=5, products=[{"cod": 1, "var": 1, "sold": 2}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.db.get_realtime_seq(), (self.today, 5))
+
+        response = self.post(mode="delta", base_seq=4, seq=6, products=[{"cod": 1, "var": 1, "sold": 3}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content), {"ok": False, "resync": True, "last_seq": 5})
+        self.assertEqual(self.db.get_realtime_seq(), (self.today, 5))
+        self.assertEqual(self.stock(1), 8)
+
+        response = self.post(mode="delta", base_seq=5, seq=6, products=[{"cod": 1, "var": 1, "sold": 3}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.db.get_realtime_seq(), (self.today, 6))
+        self.assertEqual(self.stock(1), 7)
+
+        # The same delta again no longer builds on the server's base
+        response = self.post(mode="delta", base_seq=5, seq=6, products=[{"cod": 1, "var": 1, "sold": 3}])
+        self.assertEqual(response.status_code, 409)
+
+    def test_failed_queued_payload_clears_the_seq(self):
+        self.db.set_realtime_seq(self.today, 7)
+        receipt = self.db.enqueue_realtime_sales([(1, 1, 2)], self.today, delta=True)
+        self.assertTrue(self.db.advance_realtime_seq(self.today, 7, 8))
+
+        with mock.patch.object(DatabaseManager, "apply_realtime_sales", side_effect=RuntimeError("boom")), \
+                self.assertLogs(tasks.logger, "ERROR"):
+            tasks.apply_realtime_sales_queue(self.supermarket.id)
+
+        self.assertEqual(self.db.get_realtime_receipt(receipt)["status"], "failed")
+        self.assertEqual(self.db.get_realtime_seq(), (self.today, None))
+        self.assertFalse(self.db.advance_realtime_seq(self.today, 8, 9))
+
+    def test_claim_coalesces_a_day_oldest_to_newest(self):
+        yesterday = self.today - timedelta(days=1)
+        first = self.db.enqueue_realtime_sales([(1, 1, 2), (2, 1, 1)], self.today, {(1, 1): 30})
+        other_day = self.db.enqueue_realtime_sales([(3, 1, 5)], yesterday, delta=True)
+        second = self.db.enqueue_realtime_sales([(1, 1, 3)], self.today, delta=True)
+        third = self.db.enqueue_realtime_sales([(2, 1, 4), (3, 1, 1)], self.today, {(1, 1): 20}, delta=True)
+
+        with self.db.realtime_sync_lock():
+            payloads = self.db.claim_realtime_sales()
+
+        self.assertEqual([p["id"] for p in payloads], [other_day, third])
+        day = payloads[1]
+        self.assertEqual(sorted(day["totals"]), [(1, 1, 3), (2, 1, 4), (3, 1, 1)])
+        self.assertEqual(day["shelf_life_map"], {(1, 1): 20})
+        self.assertEqual(day["merged"], 3)
+        self.assertFalse(day["delta"])
+        self.assertTrue(payloads[0]["delta"])
+        for receipt in (first, second):
+            self.assertEqual(self.db.get_realtime_receipt(receipt)["status"], "superseded")
+        self.assertEqual(self.db.get_realtime_receipt(third)["status"], "pending")
+
+
+class RequestJsonTest(SimpleTestCase):
+
+    def request(self, body):
+        return RequestFactory().post("/api/sync/realtime-sales/", data=gzip.compress(body),
+                                     content_type="application/json", HTTP_CONTENT_ENCODING="gzip")
+
+    def test_gzip_body_is_inflated(self):
+        self.assertEqual(sync_views._request_json(self.request(b'{"products": []}')), {"products": []})
+
+    def test_gzip_body_over_the_cap_is_refused(self):
+        body = b'{"pad": "' + b" " * sync_views.RT_SYNC_MAX_BODY + b'"}'
+        with self.assertRaises(ValueError):
+            sync_views._request_json(self.request(body))
@@ -125,6 +125,7 @@ urlpatterns = [
 
     # ============ Sync API (supermarket PC → server) ============
     path('api/sync/realtime-sales/', sync_views.realtime_sales_sync_view, name='realtime-sales-sync'),
+    path('api/sync/realtime-sales/receipt/<int:receipt_id>/', sync_views.realtime_sales_receipt_view, name='realtime-sales-receipt'),
     path('api/sync/intraday-curve/', sync_views.intraday_curve_sync_view, name='intraday-curve-sync'),
     path('api/sync/setup/<str:token>/bootstrap-rt/', sync_views.sync_bootstrap_realtime_view, name='sync-bootstrap-rt'),
     path('api/sync/add-to-non-gestiti/', sync_views.add_to_non_gestiti_view, name='add-to-non-gestiti'),
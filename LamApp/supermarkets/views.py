@@ -674,9 +674,10 @@ class StorageDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
                 logger.info(f"Found {len(negative_stock_products)} products with negative stock")
 
                 # Load out of stock products (verified, stock=0, disponibilita='Si')
-                cursor.execute("""
+                cursor.execute(f"""
                     SELECT
-                        p.cod, p.v, p.descrizione, p.pz_x_collo, ps.stock, ps.sales_sets
+                        p.cod, p.v, p.descrizione, p.pz_x_collo, ps.stock,
+                        {service.db.sales_sets_sql("ps")} AS sales_sets
                     FROM products p
                     JOIN product_stats ps ON p.cod = ps.cod AND p.v = ps.v
                     WHERE p.settore = %s
@@ -830,7 +831,7 @@ def calibration_report_view(request, pk):
                         blue_dot_keys.add((_r['cod'], _r['v']))
                         break
         finally:
-            _db.conn.close()
+            _db.close()
     except Exception:
         pass
 
@@ -997,7 +998,7 @@ def order_comparison_view(request, storage_id):
                 )
                 promo_keys = {(r['cod'], r['v']) for r in cur.fetchall()}
         finally:
-            db.conn.close()
+            db.close()
 
     # --- Calibration report: user-selected or most recent ---
     calib_report_id_str = request.POST.get('calib_report_id', '').strip()
@@ -1977,13 +1978,14 @@ class BlacklistDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
                                     -- ord 1 is today, still in progress. Counting it would
                                     -- report a day without sales before the day is over.
                                     (SELECT (MIN(t.ord) - 2)::int
-                                     FROM jsonb_array_elements_text(ps.sales_sets) WITH ORDINALITY AS t(elem, ord)
+                                     FROM jsonb_array_elements_text(h.sales_sets) WITH ORDINALITY AS t(elem, ord)
                                      WHERE t.ord > 1 AND t.elem::numeric != 0),
-                                    GREATEST(jsonb_array_length(ps.sales_sets) - 1, 0)
+                                    GREATEST(jsonb_array_length(h.sales_sets) - 1, 0)
                                 )
                             ) AS days_without_sales
                         FROM products p
                         LEFT JOIN product_stats ps ON ps.cod = p.cod AND ps.v = p.v
+                        LEFT JOIN LATERAL (SELECT {service.db.sales_sets_sql("ps")} AS sales_sets) h ON TRUE
                         WHERE (p.cod, p.v) IN ({placeholders})
                     """, params)
 
@@ -3550,10 +3552,11 @@ def inventory_search_view(request):
             try:
                 with RestockService(storage) as service:
                     cursor = service.db.cursor()
-                    cursor.execute("""
+                    cursor.execute(f"""
                         SELECT COUNT(*) AS cnt
                         FROM product_stats ps
                         JOIN products p ON p.cod = ps.cod AND p.v = ps.v
+                        CROSS JOIN LATERAL (SELECT {service.db.sales_sets_sql("ps")} AS sales_sets) h
                         WHERE ps.verified = TRUE
                           AND p.disponibilita != 'No'
                           AND p.settore = %s
@@ -3561,7 +3564,7 @@ def inventory_search_view(request):
                               SELECT bool_and(elem::numeric = 0)
                               FROM (
                                   SELECT value AS elem
-                                  FROM jsonb_array_elements_text(ps.sales_sets) WITH ORDINALITY
+                                  FROM jsonb_array_elements_text(h.sales_sets) WITH ORDINALITY
                                   -- from 2: ordinality 1 is today and not yet finished
                                   WHERE ordinality BETWEEN 2 AND 15
                               ) recent
@@ -3597,20 +3600,21 @@ def fermi_products_api_view(request, storage_id):
 
         with RestockService(storage) as service:
             cursor = service.db.cursor()
-            cursor.execute("""
+            cursor.execute(f"""
                 SELECT p.settore, ps.cod, ps.v, p.descrizione, ps.stock, p.cluster,
                     (
                         SELECT COALESCE(
                             -- ord 1 is today, still in progress. Counting it would report
                             -- a day without sales before the day is over.
                             (SELECT (MIN(t.ord) - 2)::int
-                             FROM jsonb_array_elements_text(ps.sales_sets) WITH ORDINALITY AS t(elem, ord)
+                             FROM jsonb_array_elements_text(h.sales_sets) WITH ORDINALITY AS t(elem, ord)
                              WHERE t.ord > 1 AND t.elem::numeric != 0),
-                            GREATEST(jsonb_array_length(ps.sales_sets) - 1, 0)
+                            GREATEST(jsonb_array_length(h.sales_sets) - 1, 0)
                         )
                     ) AS days_without_sales
                 FROM product_stats ps
                 JOIN products p ON p.cod = ps.cod AND p.v = ps.v
+                CROSS JOIN LATERAL (SELECT {service.db.sales_sets_sql("ps")} AS sales_sets) h
                 WHERE ps.verified = TRUE
                   AND p.disponibilita != 'No'
                   AND p.settore = %s
@@ -3618,7 +3622,7 @@ def fermi_products_api_view(request, storage_id):
                       SELECT bool_and(elem::numeric = 0)
                       FROM (
                           SELECT value AS elem
-                          FROM jsonb_array_elements_text(ps.sales_sets) WITH ORDINALITY
+                          FROM jsonb_array_elements_text(h.sales_sets) WITH ORDINALITY
                           -- from 2: ordinality 1 is today and not yet finished
                           WHERE ordinality BETWEEN 2 AND 15
                       ) recent
@@ -4468,12 +4472,7 @@ def manage_cluster_view(request):
                 "SELECT cod, v FROM products WHERE settore = %s AND cluster = %s",
                 (storage.settore, source)
             )
-            for row in cur.fetchall():
-                cur.execute(
-                    "UPDATE product_stats SET stock = 0 WHERE cod = %s AND v = %s",
-                    (row['cod'], row['v'])
-                )
-                service.db.purge_product(row['cod'], row['v'])
+            service.db.purge_products([(row['cod'], row['v']) for row in cur.fetchall()])
             cur.execute(
                 "UPDATE products SET cluster = NULL WHERE settore = %s AND cluster = %s",
                 (storage.settore, source)
@@ -4688,6 +4687,7 @@ def verify_product_ajax_view(request):
                     WHERE cod = %s AND v = %s
                 """, (int(package_size), cod, var))
                 service.db.conn.commit()
+                service.db.invalidate_ean_cache()
                 logger.info(f"Updated package size for {cod}.{var} to {package_size}")
 
             # Handle cluster update (including clearing with 'NONE')